@@ -14,11 +14,20 @@ import pytesseract
 import pickle
 import enchant
 import configparser
-import threading
+import asyncio
 import re
+import traceback
 from datetime import datetime
 from copy import copy, deepcopy
 from MaxLairInstance import MaxLairInstance
+import calibration
+import video_capture
+import frame_bus
+import timing_profiles
+from clip_recorder import ClipRecorder
+from display import FrameTimer, Dashboard
+from fake_serial import FakeSerial
+from stage_machine import Stage, StageMachine
 from Pokemon_Data import matchup_scoring
 
 
@@ -32,6 +41,8 @@ if not config.read('Config.ini', 'utf8'):
     
 
 COM_PORT = config['default']['COM_PORT']
+BATCH_BUTTONS = config.getboolean('serial', 'BATCH_BUTTONS', fallback=False)
+SERIAL_THREAD = config.getboolean('serial', 'SERIAL_THREAD', fallback=True)
 VIDEO_INDEX = int(config['default']['VIDEO_INDEX'])
 VIDEO_SCALE = float(config['default']['VIDEO_SCALE'])
 BOSS = config['default']['BOSS']
@@ -41,9 +52,41 @@ BASE_BALLS = int(config['default']['BASE_BALLS'])
 LEGENDARY_BALL = config['default']['LEGENDARY_BALL']
 LEGENDARY_BALLS = int(config['default']['LEGENDARY_BALLS'])
 MODE = config['default']['MODE']
+VISUAL_WAITS = config.getboolean('timing', 'VISUAL_WAITS', fallback=True)
+TIMING_PROFILE = config.get('timing', 'PROFILE', fallback='default')
+TIMING_PROFILE_FILE = config.get('timing', 'PROFILE_FILE',
+    fallback='Timing/profiles.json')
+OBSERVE_TIMING = config.getboolean('timing', 'OBSERVE', fallback=False)
+SHUTDOWN_TIMEOUT = config.getfloat('timing', 'SHUTDOWN_TIMEOUT', fallback=10)
 DYNITE_ORE = int(config['default']['DYNITE_ORE'])
 pytesseract.pytesseract.tesseract_cmd = config['default']['TESSERACT_PATH']
 
+VIDEO_SOURCE = config.get('video', 'VIDEO_SOURCE', fallback='')
+REAL_TIME = config.getboolean('video', 'REAL_TIME', fallback=True)
+LOOP = config.getboolean('video', 'LOOP', fallback=False)
+REPLAY_FPS = config.getfloat('video', 'REPLAY_FPS', fallback=30)
+PROCESSING_HEIGHT = config.getint('video', 'PROCESSING_HEIGHT', fallback=1080)
+CAPTURE_PROCESS = config.getboolean('video', 'CAPTURE_PROCESS', fallback=False)
+RECORD_CLIPS = config.getboolean('video', 'RECORD_CLIPS', fallback=False)
+CLIP_FPS = config.getfloat('video', 'CLIP_FPS', fallback=10)
+CLIP_SECONDS_BEFORE = config.getfloat('video', 'CLIP_SECONDS_BEFORE',
+    fallback=10)
+CLIP_SECONDS_AFTER = config.getfloat('video', 'CLIP_SECONDS_AFTER', fallback=5)
+
+DISPLAY_FPS = config.getfloat('display', 'DISPLAY_FPS', fallback=30)
+HEADLESS = config.getboolean('display', 'HEADLESS', fallback=False)
+DASHBOARD_PORT = config.getint('display', 'DASHBOARD_PORT', fallback=0)
+DASHBOARD_FPS = config.getfloat('display', 'DASHBOARD_FPS', fallback=5)
+# Log display performance this often (s)
+DISPLAY_STATS_INTERVAL = 300
+
+CALIBRATE = config.getboolean('calibration', 'CALIBRATE', fallback=False)
+RECALIBRATE = config.getboolean('calibration', 'RECALIBRATE', fallback=False)
+CALIBRATION_FILE = config.get('calibration', 'CALIBRATION_FILE',
+    fallback='Calibration/calibration.json')
+ANCHORS_FILE = config.get('calibration', 'ANCHORS_FILE',
+    fallback='Calibration/anchors.json')
+
 boss_pokemon_path = config['pokemon_data_paths']['Boss_Pokemon']
 rental_pokemon_path = config['pokemon_data_paths']['Rental_Pokemon']
 boss_matchup_LUT_path = config['pokemon_data_paths']['Boss_Matchup_LUT']
@@ -55,24 +98,30 @@ TESSERACT_LANG_NAME = config[language]['TESSERACT_LANG_NAME']
 
 PHRASES = config[language]
 
-def join(inst) -> str:
+async def join(inst) -> str:
     """Join a Dynamax Adventure and choose a Pokemon."""
     # Start a new Dynamax Adventure.
     # 
     # First, start a new run by talking to the scientist in the Max Lair.
     inst.log('Run #' + str(inst.runs + 1) + ' started!')
-    inst.push_buttons((b'b', 2), (b'a', 1), (b'a', 1.5), (b'a', 1.5), (b'a', 1.5), (b'b', 1))
+    await inst.push_buttons((b'b', 'join.leave'), (b'a', 'join.talk'),
+        (b'a', 'join.dialogue'), (b'a', 'join.dialogue'),
+        (b'a', 'join.dialogue'), (b'b', 'join.open_paths')
+    )
 
     # select the right path
     for __ in range(PATH_INDEX):
-        inst.push_buttons((b'v', 1))
+        await inst.queue_buttons((b'v', 'menu.move'))
   
-    inst.push_buttons((b'a', 1.5), (b'a', 1), (b'a', 1.5), (b'a', 4), (b'v', 1), (b'a', 5))
+    await inst.push_buttons((b'a', 'join.confirm_path'), (b'a', 'join.lock_in'),
+        (b'a', 'join.confirm_save'), (b'a', 'join.save'), (b'v', 'menu.move'),
+        (b'a', 'join.load_rentals')
+    )
 
     # Next, read what rental Pokemon are available to choose.
     # Note that pokemon_list contains preconfigured Pokemon objects with types,
     # abilities, stats, moves, et cetera.
-    pokemon_list = inst.read_selectable_pokemon('join', language)
+    pokemon_list = await inst.read_selectable_pokemon('join', language)
     pokemon_scores = []
 
     # Then, assign a score to each of the Pokemon based on how it is estimated
@@ -94,9 +143,14 @@ def join(inst) -> str:
         inst.log('Score for ' + name + ':\t%0.2f' % score)
     selection_index = pokemon_scores.index(max(pokemon_scores))
     for __ in range(selection_index):
-        inst.push_buttons((b'v', 1))
+        await inst.queue_buttons((b'v', 'menu.move'))
     inst.pokemon = pokemon_list[selection_index]
-    inst.push_buttons((b'a',27))
+    inst.stats_dirty = True
+    # Wait for the other players to choose and the adventure to start.
+    await inst.push_buttons((b'a', 'join.select_rental'))
+    await inst.wait_until(inst.dialog_matches('PATH'), 'join.choose_rental',
+        poll_interval=0.5
+    )
     inst.log('Choosing a path...')
 
     inst.caught_pokemon = []
@@ -104,15 +158,15 @@ def join(inst) -> str:
     return 'path'
 
 
-def path(inst) -> str:
+async def path(inst) -> str:
     """Choose a path to follow."""
     # TODO: implement intelligent path selection
-    inst.push_buttons((b'a', 4))
+    await inst.push_buttons((b'a', 'path.choose'))
     print('Detecting where the path led...')
     return 'detect'
 
 
-def detect(inst) -> str:
+async def detect(inst) -> str:
     """Detect whether the chosen path has led to a battle, scientist,
     backpacker, or fork in the path.
     """
@@ -123,7 +177,10 @@ def detect(inst) -> str:
     #
     # This function returns directly when those conditions are found.
     while True:
-        text = inst.read_text(inst.get_frame(), ((0, 0.6), (1, 1)), invert=True,
+        # Read a new frame each time: with no dialogue on screen no text is
+        # found without running Tesseract, so waiting for the frame is what
+        # paces this loop and lets other tasks run.
+        text = await inst.read_dialog_text(await inst.get_new_frame(),
             language=inst.tesseract_language
         )
         if re.search(inst.phrases['FIGHT'], text) != None:
@@ -144,7 +201,7 @@ def detect(inst) -> str:
             return 'path'
 
 
-def battle(inst) -> str:
+async def battle(inst) -> str:
     """Choose moves during a battle and detect whether the battle has ended."""
     # Loop continuously until an event that ends the battle is detected.
     # The battle ends either in victory (signalled by the catch screen)
@@ -152,10 +209,10 @@ def battle(inst) -> str:
     #
     # This function returns directly when those conditions are found.
     while True:
-        # Read text from the bottom section of the screen.
-        text = inst.read_text(inst.get_frame(), ((0, 0.6), (1, 1)), invert=True,
+        # Read text from the bottom section of a new frame (see detect).
+        text = await inst.read_dialog_text(await inst.get_new_frame(),
             language=inst.tesseract_language
-        )  
+        )
         
         # then check the text for key phrases that inform the bot what to do next
         if re.search(inst.phrases['CATCH'], text) != None:
@@ -165,25 +222,35 @@ def battle(inst) -> str:
         elif re.search(inst.phrases['FAINT'], text) != None:
             inst.log('Pokemon fainted...')
             inst.lives -= 1
-            inst.push_buttons((b'0', 4))
+            inst.stats_dirty = True
+            await inst.push_buttons((b'0', 'battle.faint'))
         elif re.search(inst.phrases['LOSS'], text) != None:
             inst.log('You lose :(. Quitting...')
+            inst.record_event('loss')
             inst.reset_stage()
-            inst.push_buttons((b'0', 7))
+            # Start watching for the end of the run now, before the screen
+            # changes, so select_pokemon can tell when it has settled.
+            inst.loss_settled = inst.screen_settled()
+            await inst.push_buttons((b'0', 'battle.loss'))
             return 'select_pokemon'  # Go to quit sequence
         elif re.search(inst.phrases['CHEER'], text) != None:
             if inst.pokemon.dynamax:
                 inst.pokemon.dynamax = False
                 inst.move_index = 0
                 inst.dmax_timer = 0
-            inst.push_buttons((b'a', 1.5))
+            await inst.push_buttons((b'a', 'battle.cheer'))
         elif re.search(inst.phrases['FIGHT'], text) != None:
             # If we got the pokemon from the scientist, we don't know what
             # is our current pokemon, check it first
             if inst.pokemon is None:
-                inst.push_buttons((b'y', 1), (b'a', 1))
-                inst.pokemon = inst.read_selectable_pokemon('battle', language)[0]
-                inst.push_buttons((b'0', 1), (b'b', 1.5), (b'b', 2))
+                await inst.push_buttons((b'y', 'battle.open_info'),
+                    (b'a', 'battle.select_info')
+                )
+                inst.pokemon = (await inst.read_selectable_pokemon('battle', language))[0]
+                inst.stats_dirty = True
+                await inst.push_buttons((b'0', 'battle.read_info'),
+                    (b'b', 'battle.close_info'), (b'b', 'battle.close_info_menu')
+                )
                 inst.log('We got ' + inst.pokemon.name + ' at the scientist')
 
             # Before the bot makes a decision, it needs to know what the boss
@@ -197,9 +264,15 @@ def battle(inst) -> str:
                 # Otherwise, we identify the boss using its name and types.
                 else:
                     # 
-                    inst.push_buttons((b'y', 1), (b'a', 1), (b'l', 3))
-                    inst.opponent = inst.read_selectable_pokemon('battle', language)[0]
-                    inst.push_buttons((b'0', 1), (b'b', 1.5), (b'b', 2))
+                    await inst.push_buttons((b'y', 'battle.open_info'),
+                        (b'a', 'battle.select_info'),
+                        (b'l', 'battle.show_opponent')
+                    )
+                    inst.opponent = (await inst.read_selectable_pokemon('battle', language))[0]
+                    await inst.push_buttons((b'0', 'battle.read_info'),
+                        (b'b', 'battle.close_info'),
+                        (b'b', 'battle.close_info_menu')
+                    )
 
                     # When we fight a Ditto, he will always copy your pokemon
                     if inst.opponent.name == 'Ditto':
@@ -215,6 +288,7 @@ def battle(inst) -> str:
                     inst.pokemon.max_moves = inst.pokemon.max_moves[:4]
                     inst.pokemon.name = 'Ditto'
                     inst.pokemon.PP = [5,5,5,5]
+                inst.stats_dirty = True
 
             # Handle the Dynamax timer
             # The timer starts at 3 and decreases by 1 after each turn of
@@ -231,7 +305,7 @@ def battle(inst) -> str:
                 inst.dmax_timer -= 1
 
             # Navigate to the move selection screen.
-            inst.push_buttons((b'b', 2), (b'a', 2))
+            await inst.push_buttons((b'b', 'battle.back'), (b'a', 'battle.fight'))
 
             # Then, check whether Dynamax is available.
             # Note that a dmax_timer value of -1 indicates that the player's
@@ -269,36 +343,45 @@ def battle(inst) -> str:
             # available but not optimal.
             if inst.dynamax_available:
                 # Dynamax and then choose a move as usual
-                inst.push_buttons((b'<', 1), (b'a', 1))
+                await inst.push_buttons((b'<', 'menu.move'), (b'a', 'battle.dynamax'))
                 inst.dmax_timer = 3
                 inst.pokemon.dynamax = True
                 inst.dynamax_available = False
             move = inst.pokemon.max_moves[best_move_index] if inst.pokemon.dynamax else inst.pokemon.moves[best_move_index]
             inst.log('Best move against ' + inst.opponent.name + ': ' + move.name + ' (index ' + str(best_move_index) + ')')
             inst.move_index %= 4  # Loop index back to zero if it exceeds 3
-            for _ in range((best_move_index - inst.move_index + 4) % 4):
-                inst.push_buttons((b'v', 1))
-                inst.move_index = (inst.move_index + 1) % 4
-
-            inst.push_buttons((b'a', 1), (b'a', 1), (b'a', 1), (b'v', 1),
-                (b'a', 0.5), (b'b', 0.5), (b'^', 0.5), (b'b', 0.5)
+            presses = (best_move_index - inst.move_index + 4) % 4
+            await inst.queue_buttons(*[(b'v', 'menu.move')] * presses)
+            # Only track the cursor once the presses have actually been made.
+            await inst.wait_for_buttons()
+            inst.move_index = best_move_index
+
+            await inst.push_buttons((b'a', 'battle.select_move'),
+                (b'a', 'battle.select_move'), (b'a', 'battle.select_move'),
+                (b'v', 'menu.move'), (b'a', 'battle.clear_menu'),
+                (b'b', 'battle.clear_menu'), (b'^', 'battle.clear_menu'),
+                (b'b', 'battle.clear_menu')
             )
             inst.pokemon.PP[inst.move_index] -= 1 if inst.opponent.ability != 'Pressure' else 2
         else:
             # Press B which can speed up dialogue
-            inst.push_buttons((b'b', 0.005))
+            await inst.push_buttons((b'b', 'battle.skip_dialogue'))
         
 
-def catch(inst) -> str:
+async def catch(inst) -> str:
     """Catch each boss after defeating it."""
     # Start by navigating to the ball selection screen
-    inst.push_buttons((b'a', 2))
+    await inst.push_buttons((b'a', 'catch.open_balls'))
     # then navigate to the ball specified in the config file
-    while (inst.get_target_ball() != 'DEFAULT'
-        and inst.get_target_ball() not in inst.check_ball()
-    ):
-        inst.push_buttons((b'<', 2))
-    inst.push_buttons((b'a', 30))
+    await inst.select_ball()
+    if inst.num_caught < 3:
+        # Wait for the caught Pokemon's summary to appear.
+        await inst.push_buttons((b'a', 'catch.throw'))
+        await inst.wait_until(inst.card_text_shown(inst.sel_rect_4,
+            inst.abil_rect_4), 'catch.summary', min_wait=4, settle=1
+        )
+    else:
+        await inst.push_buttons((b'a', 'catch.throw_final'))
     inst.record_ball_use()
 
     # If the caught Pokemon was not the final boss, check out the Pokemon and
@@ -308,7 +391,7 @@ def catch(inst) -> str:
         # Pokemon objects with types, abilities, stats, moves, et cetera.
         # 
         # In this stage the list contains only 1 item.
-        pokemon = inst.read_selectable_pokemon('catch', language)[0]
+        pokemon = (await inst.read_selectable_pokemon('catch', language))[0]
         # Consider the amount of remaining minibosses when scoring each rental
         # Pokemon, at the start of the run, there are 3 - num_caught minibosses
         # and 1 final boss. We weigh the boss more heavily because it is more
@@ -337,9 +420,10 @@ def catch(inst) -> str:
         if score > existing_score:
             # Choose to swap your existing Pokemon for the new Pokemon.
             inst.pokemon = pokemon
-            inst.push_buttons((b'a', 3))
+            inst.stats_dirty = True
+            await inst.push_buttons((b'a', 'catch.swap'))
         else:
-            inst.push_buttons((b'b', 3))
+            await inst.push_buttons((b'b', 'catch.keep'))
 
         # Move on to the detect stage.
         inst.log('Detecting where the path led...')
@@ -349,19 +433,19 @@ def catch(inst) -> str:
     # Pokemon caught along the way.
     else:
         inst.caught_pokemon.append(inst.boss)
-        inst.push_buttons((b'0',10))
+        await inst.push_buttons((b'0', 'catch.finish_run'))
         inst.log('Congratulations! Checking the haul from this run...')
         return 'select_pokemon'
 
 
-def backpacker(inst) -> str:
+async def backpacker(inst) -> str:
     """Choose an item from the backpacker."""
-    inst.push_buttons((b'0', 7), (b'a', 5))
+    await inst.push_buttons((b'0', 'backpacker.wait'), (b'a', 'backpacker.take_item'))
     inst.log('Detecting where the path led...')
     return 'detect'
 
 
-def scientist(inst) -> str:
+async def scientist(inst) -> str:
     """Take (or not) a Pokemon from the scientist."""
     # Consider the amount of remaining minibosses when scoring each rental
     # Pokemon, at the start of the run, there are 3 - num_caught minibosses
@@ -392,15 +476,16 @@ def scientist(inst) -> str:
     inst.log('Score for ' + inst.pokemon.name + ':\t%0.2f' % existing_score)
 
     if average_score > existing_score:
-        inst.push_buttons((b'0', 3), (b'a', 1))
+        await inst.push_buttons((b'0', 'scientist.wait'), (b'a', 'scientist.answer'))
         inst.pokemon = None
+        inst.stats_dirty = True
     else:
-        inst.push_buttons((b'0', 3), (b'b', 1))
+        await inst.push_buttons((b'0', 'scientist.wait'), (b'b', 'scientist.answer'))
     inst.log('Detecting where the path led...')
     return 'detect'
 
 
-def select_pokemon(inst) -> str:
+async def select_pokemon(inst) -> str:
     """Check Pokemon caught during the run and keep one if it's shiny.
     
     Note that this function returns 'done', causing the program to quit, if a
@@ -409,12 +494,17 @@ def select_pokemon(inst) -> str:
     # If the bot lost against the first boss, skip the checking process since
     # there are no Pokemon to check.
     if inst.num_caught == 0:
-        inst.push_buttons((b'0', 10), (b'b', 1))
+        await inst.wait_until(inst.loss_settled, 'select_pokemon.after_loss',
+            min_wait=2, settle=2
+        )
+        await inst.push_buttons((b'b', 'select_pokemon.dismiss'))
         return 'join'
 
     # Otherwise, navigate to the summary screen of the last Pokemon caught (the
     # legendary if the run was successful)
-    inst.push_buttons((b'^', 1), (b'a', 1), (b'v', 1), (b'a', 3))
+    await inst.push_buttons((b'^', 'menu.move'), (b'a', 'select_pokemon.open'),
+        (b'v', 'menu.move'), (b'a', 'select_pokemon.summary')
+    )
 
     # Check all Pokemon for shininess
     take_pokemon = False # Set to True if a non-legendary shiny is found
@@ -427,8 +517,12 @@ def select_pokemon(inst) -> str:
             inst.log('Shiny ' + inst.caught_pokemon[inst.num_caught - 1 - i] + ' will be kept')
             inst.shinies_found += 1
             inst.caught_shinies.append(inst.caught_pokemon[inst.num_caught - 1 - i])
-            inst.display_results(screenshot=True)
-            inst.push_buttons((b'p', 1), (b'b', 3), (b'p', 1))
+            inst.stats_dirty = True
+            inst.record_event('shiny', screenshot=True)
+            await inst.push_buttons((b'p', 'select_pokemon.capture'),
+                (b'b', 'select_pokemon.close_summary'),
+                (b'p', 'select_pokemon.capture')
+            )
             if inst.num_caught == 4 and i == 0:
                 return 'done'  # End whenever a shiny legendary is found
             else:
@@ -441,7 +535,7 @@ def select_pokemon(inst) -> str:
             else:
                 return 'done' # End if there isn't enough ore to keep resetting
         elif i < inst.num_caught - 1:
-            inst.push_buttons((b'^',3))
+            await inst.push_buttons((b'^', 'select_pokemon.next'))
         elif ('strong boss' in inst.mode.lower() and inst.num_caught == 4 and
                 inst.check_sufficient_ore(inst.consecutive_resets + 1)
             ):
@@ -451,29 +545,45 @@ def select_pokemon(inst) -> str:
     # Pokemon or resetting the game, where appropriate).     
     if not reset_game:
         if take_pokemon:
-            inst.push_buttons((b'a', 1), (b'a', 1), (b'a', 1), (b'a', 1.5),
-                (b'a', 3), (b'b', 2), (b'b', 10), (b'a', 2)
+            await inst.push_buttons((b'a', 'select_pokemon.take'),
+                (b'a', 'select_pokemon.take'), (b'a', 'select_pokemon.take'),
+                (b'a', 'select_pokemon.take_confirm'),
+                (b'a', 'select_pokemon.take_save'),
+                (b'b', 'select_pokemon.take_dialogue')
             )
+            settled = inst.screen_settled()
+            await inst.push_buttons((b'b', 'select_pokemon.dismiss'))
+            await inst.wait_until(settled, 'select_pokemon.take_finish', min_wait=1,
+                settle=2
+            )
+            await inst.push_buttons((b'a', 'select_pokemon.take_close'))
         else:
-            inst.push_buttons((b'b', 3), (b'b', 1))
+            await inst.push_buttons((b'b', 'select_pokemon.leave'),
+                (b'b', 'select_pokemon.leave_confirm')
+            )
         inst.record_ore_reward()
     else:
         inst.log('Resetting game...')
         inst.record_game_reset()
         # The original button sequence was added with the help of users fawress
         # and Miguel90 on the Pokemon Automation Discord.
-        inst.push_buttons((b'h', 2), (b'x', 2))
+        await inst.push_buttons((b'h', 'select_pokemon.home'),
+            (b'x', 'select_pokemon.close_game')
+        )
     # The button press sequences differ depending on how many Pokemon were
     # defeated and are further modified by the language.
     # Therefore, press A until the starting dialogue appears, then back out.
-    while inst.phrases['START_PHRASE'] not in inst.read_text(inst.get_frame(),
-        ((0, 0.6), (1, 1)), threshold=False):
-        inst.push_buttons((b'a', 1.5))
-    inst.push_buttons((b'b', 1.5), (b'b', 1.5))
+    while inst.phrases['START_PHRASE'] not in await inst.read_text(inst.get_frame(),
+        inst.dialog_rect, threshold=False):
+        await inst.push_buttons((b'a', 'select_pokemon.advance'))
+    await inst.push_buttons((b'b', 'select_pokemon.back_out'),
+        (b'b', 'select_pokemon.back_out')
+    )
     
     # Update statistics and reset stored information about the complete run.
     inst.wins += 1 if inst.num_caught == 4 else 0
     inst.runs += 1
+    # reset_run marks the statistics panel for redrawing.
     inst.reset_run()
 
     # Start another run if there are sufficient Poke balls to do so.
@@ -484,18 +594,74 @@ def select_pokemon(inst) -> str:
         inst.log('Out of balls. Quitting...')
         return 'done'
 
-    
-def button_control_task(inst, actions) -> None:
-    """Loop called by a thread which handles the main button detecting and
-    detection aspects of the bot.
+
+# The stages of a run, each with the function executed in it and the stages
+# it can go to next
+STAGES = (
+    Stage('join', join, ('path',)),
+    Stage('path', path, ('detect',)),
+    Stage('detect', detect, ('battle', 'backpacker', 'scientist', 'path')),
+    Stage('battle', battle, ('catch', 'select_pokemon')),
+    Stage('catch', catch, ('detect', 'select_pokemon')),
+    Stage('backpacker', backpacker, ('detect',)),
+    Stage('scientist', scientist, ('detect',)),
+    Stage('select_pokemon', select_pokemon, ('join', 'done'))
+)
+
+
+async def show_display(inst, cap, control) -> None:
+    """Show the video and statistics in a window at a fixed frame rate until
+    the control task ends, cancelling it if the Q key is pressed or a replayed
+    recording has run out of frames.
+    """
+    timer = FrameTimer(DISPLAY_FPS)
+    last_stats_time = time.time()
+    while not control.done():
+        timer.start_frame()
+        inst.display_results()
+        delay = timer.end_frame()
+
+        # Check for a key press without blocking, then let the control task
+        # run until the next frame is due.
+        if cv2.waitKey(1) & 0xFF == ord('q') or cap.finished:
+            control.cancel()
+
+        if time.time() - last_stats_time > DISPLAY_STATS_INTERVAL:
+            inst.log('Display: ' + str(timer))
+            last_stats_time = time.time()
+        await asyncio.sleep(delay)
+    inst.log('Display: ' + str(timer))
+
+
+async def watch_headless(inst, cap, control) -> None:
+    """Without a window, save any screenshots the control task requests until
+    it ends, cancelling it if a replayed recording has run out of frames.
     """
+    while not control.done():
+        inst.display_results()
+        if cap.finished:
+            control.cancel()
+        await asyncio.sleep(0.5)
 
-    while inst.stage != 'done':
-        # Note that this task holds the lock by default but drops it while
-        # waiting for Tesseract to respond or while delaying after a button
-        # push.
-        with inst.lock:
-            inst.stage = actions[inst.stage](inst)
+
+async def run_bot(inst, stages, cap) -> None:
+    """Run the stages as the control task alongside the display task until
+    the control task ends or is cancelled. Cancelling the control task stops
+    the bot immediately, whatever it is waiting for.
+    """
+    control = asyncio.create_task(stages.run(inst))
+    display = asyncio.create_task(watch_headless(inst, cap, control) if
+        inst.headless else show_display(inst, cap, control))
+    try:
+        await asyncio.wait([control])
+    finally:
+        # Stop both tasks if this was interrupted (e.g., by Ctrl+C).
+        control.cancel()
+        display.cancel()
+        await asyncio.wait([display])
+    if not control.cancelled():
+        # Raise any error that ended the control task.
+        control.result()
 
 
 def main_loop():
@@ -503,8 +669,12 @@ def main_loop():
     pressing 'Q'.
     """
 
-    # Connect to the Teensy over a serial port
-    com = serial.Serial(COM_PORT, 9600, timeout=0.05)
+    # Connect to the Teensy over a serial port, or to a software stand-in for
+    # testing without one.
+    if COM_PORT.upper() == 'FAKE':
+        com = FakeSerial(COM_PORT, 9600, timeout=0.05)
+    else:
+        com = serial.Serial(COM_PORT, 9600, timeout=0.05)
     print('Connecting to ' + com.port + '...')
     while not com.is_open:
         try:
@@ -515,23 +685,86 @@ def main_loop():
 
     # Open the video capture
     print('Opening the video connection...')
-    cap = cv2.VideoCapture(VIDEO_INDEX)
+    source = VIDEO_SOURCE or str(VIDEO_INDEX)
+    if CAPTURE_PROCESS:
+        # Capture in a separate process that shares frames through memory.
+        cap = frame_bus.SharedCapture(source, real_time=REAL_TIME, loop=LOOP,
+            fps=REPLAY_FPS
+        )
+        cap.start()
+    else:
+        cap = video_capture.open_video_source(source, REAL_TIME, LOOP,
+            REPLAY_FPS
+        )
     if not cap.isOpened():
         print('''Failed to open the video connection. Check the config file and
             ensure no other application is using the video input.'''
         )
+        cap.release()
         com.close()
         return
 
     # Create a Max Lair Instance object to store information about each run
     # and the entire sequence of runs
     instance = MaxLairInstance(BOSS, (BASE_BALL, BASE_BALLS, LEGENDARY_BALL,
-        LEGENDARY_BALLS), com, cap, VIDEO_SCALE, threading.Lock(),
-        threading.Event(), datetime.now(), (boss_pokemon_path,
+        LEGENDARY_BALLS), com, cap, VIDEO_SCALE, datetime.now(),
+        (boss_pokemon_path,
         rental_pokemon_path, boss_matchup_LUT_path, rental_matchup_LUT_path,
         rental_pokemon_scores_path), PHRASES, TESSERACT_LANG_NAME, MODE,
-        DYNITE_ORE, 'join'
+        DYNITE_ORE, 'join', (round(PROCESSING_HEIGHT*16/9), PROCESSING_HEIGHT)
+    )
+    instance.batch_buttons = BATCH_BUTTONS
+    if instance.type_references is None:
+        instance.log('Type badge references have not been learned, so the '
+            'opponent\'s types will be read with Tesseract (see the README).')
+    if SERIAL_THREAD:
+        instance.serial_writer.start()
+    instance.visual_waits = VISUAL_WAITS
+    instance.timing = timing_profiles.load_profile(TIMING_PROFILE_FILE,
+        TIMING_PROFILE
     )
+    instance.observe_timing = OBSERVE_TIMING
+    instance.log('Using timing profile ' + str(instance.timing))
+    # Read frames continuously in the background so they're always fresh.
+    # Recordings replayed as fast as possible are read on demand by the stages
+    # instead, so the recording only advances when the bot reads a frame and
+    # slow processing can't fall behind it. The display and the dashboard
+    # never read the source themselves: without the grabber they show the
+    # last frame the stages read (see acquire_display_frame). A capture process
+    # already reads frames continuously, so it replaces the grabber.
+    if CAPTURE_PROCESS:
+        instance.frame_grabber = cap
+    elif cap.paced:
+        instance.frame_grabber.start()
+    # Keep recent frames so clips can be saved around notable events.
+    if RECORD_CLIPS and instance.frame_grabber.running:
+        instance.clip_recorder = ClipRecorder(instance.frame_grabber,
+            instance.filename[:-8], CLIP_FPS, CLIP_SECONDS_BEFORE,
+            CLIP_SECONDS_AFTER
+        )
+        instance.clip_recorder.start()
+
+    # Correct the detection rectangles for the alignment of the capture,
+    # measuring it if it isn't already known for this capture device.
+    if CALIBRATE:
+        device = source
+        correction = (None if RECALIBRATE else
+            calibration.load_calibration(CALIBRATION_FILE, device))
+        if correction is None:
+            print('Calibrating the video connection...')
+            frames = [instance.get_frame(newer_than=instance.frame_timestamp).copy()
+                for __ in range(10)]
+            correction = calibration.calibrate(frames,
+                calibration.load_anchors(ANCHORS_FILE))
+            if correction is not None:
+                calibration.save_calibration(CALIBRATION_FILE, device,
+                    correction)
+        if correction is not None:
+            instance.apply_calibration(correction)
+        else:
+            # Measured again next time, when the scene may be brighter.
+            instance.log('The capture alignment could not be measured, so the '
+                'detection rectangles were left uncorrected.')
 
     # DEBUG overrides for starting the script mid-run
     # instance.pokemon = instance.rental_pokemon['Krookodile']
@@ -539,49 +772,48 @@ def main_loop():
     # instance.stage = 'detect'
     ##    instance.consecutive_resets = 1
 
-    # Map stages to the appropriate function to execute when in each stage
-    actions = {'join': join, 'path': path, 'detect': detect, 'battle': battle,
-        'catch': catch, 'backpacker': backpacker, 'scientist': scientist,
-        'select_pokemon': select_pokemon
-    }
-    
+    # Run the declared stages, timing each one
+    stages = StageMachine(STAGES, log=instance.log)
 
-    # Start a thread that will control all the button press sequences
-    button_control_thread = threading.Thread(target=button_control_task,
-        args=(instance,actions,)
-    )
-    button_control_thread.start()
-    
-
-    
-    # Start event loop which handles the display and checks for the user
-    # manually quitting.
-    # The loop ends when the button control thread ends naturally or when
-    # signalled by the user pressing the Q key.
-    while button_control_thread.is_alive():
-
-        # Wait until the button control thread releases the lock, then use the
-        # idle time to update the graphical display.
-        with instance.lock:
-            instance.display_results()
-
-        # Tell the button control thread to quit if the Q key is pressed.
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            instance.exit_flag.set()
-            # After setting the exit flag, we need to wait for the button
-            # control thread to exit because it only checks the flag at the
-            # start of a new button push or OCR call.
-            button_control_thread.join()
-
-        # Add a brief delay between each frame so the button control thread has
-        # some time to acquire the lock.
-        time.sleep(0.01)
-
-    # When finished, clean up video and serial connections
-    instance.display_results(log=True)
-    cap.release()
-    com.close()
-    cv2.destroyAllWindows()
+    # Serve a preview and the statistics over HTTP if requested.
+    dashboard = None
+    if DASHBOARD_PORT:
+        dashboard = Dashboard(instance.acquire_display_frame,
+            lambda: {label.strip(' :#'): value for label, value
+            in instance.get_stats()}, DASHBOARD_PORT, fps=DASHBOARD_FPS
+        )
+        dashboard.start()
+        print('Serving the dashboard at http://127.0.0.1:%d/' % DASHBOARD_PORT)
+
+    # Run the stages as a coroutine on an event loop alongside the display,
+    # which shows the newest frame and statistics at a fixed frame rate.
+    # Button delays and Tesseract calls are awaited, so the display keeps
+    # running meanwhile, and quitting cancels the stages immediately.
+    # Without a window, press Ctrl+C to quit.
+    instance.headless = HEADLESS
+    try:
+        asyncio.run(run_bot(instance, stages, cap))
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        # Record what stopped the bot before shutting down.
+        instance.log('ERROR: ' + traceback.format_exc())
+        raise
+    finally:
+        # When finished, record the final state and clean up video and
+        # serial connections, within a bounded time however the bot stopped.
+        shutdown_start = time.time()
+        instance.display_results(log=True)
+        instance.log('Time spent in each stage:\n' + str(stages))
+        if not HEADLESS:
+            cv2.destroyAllWindows()
+        if dashboard is not None and not dashboard.stop(SHUTDOWN_TIMEOUT):
+            instance.log('WARNING: Dashboard did not stop within %g s.'
+                % SHUTDOWN_TIMEOUT)
+        instance.close(SHUTDOWN_TIMEOUT)
+        cap.release()
+        com.close()
+        instance.log('Shut down in %.1f s.' % (time.time() - shutdown_start))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,240 @@
+# benchmark_ocr
+#   Measure OCR latency and accuracy for every rectangle read by
+#   MaxLairInstance against a labeled corpus of captured frames.
+#
+#   Run from the repository root (Config.ini is used for the Tesseract path
+#   and language settings):
+#       python -m Benchmarks.benchmark_ocr [corpus_dir] [--output results.json]
+#
+#   The corpus directory (default Benchmarks/Corpus) contains PNG frames and a
+#   labels.json file listing one entry per frame, e.g.
+#       {"frame": "English/join_001.png", "language": "English",
+#        "screen": "join",
+#        "rois": {"sel_rect_1": "Tsareena", "abil_rect_1": "Queenly Majesty"},
+#        "pokemon": ["Tsareena", "Blaziken", "Flygon"]}
+#   Frames can be captured and labeled with Benchmarks/capture_corpus.py.
+#   "rois" maps rectangle names to the text they contain ("type_rect_1" and
+#   "type_rect_2" hold English type names) and "pokemon" lists the rental
+#   Pokemon shown on join, catch, and battle screens.
+
+import argparse
+import asyncio
+import configparser
+import json
+import os
+import time
+from datetime import datetime
+import cv2
+import numpy
+import enchant
+import pytesseract
+import image_processing
+from MaxLairInstance import MaxLairInstance
+from video_capture import VideoSource
+
+# How each rectangle the bot reads is read: (threshold, invert, profile name,
+# segmentation mode and language it was read with before OCR profiles were
+# added, keep only the last line).
+ROI_READS = {
+    'sel_rect_1': (False, True, 'name_ocr', '--psm 8', None, False),
+    'sel_rect_2': (False, False, 'name_ocr', '--psm 8', None, False),
+    'sel_rect_3': (False, False, 'name_block_ocr', '--psm 3', None, False),
+    'sel_rect_4': (False, False, 'name_block_ocr', '--psm 3', None, True),
+    'sel_rect_5': (False, False, 'name_ocr', '--psm 8', None, False),
+    'abil_rect_1': (False, True, 'ability_ocr', '--psm 8', None, False),
+    'abil_rect_2': (False, False, 'ability_ocr', '--psm 8', None, False),
+    'abil_rect_3': (False, False, 'ability_block_ocr', '--psm 3', None, False),
+    'abil_rect_4': (False, False, 'ability_block_ocr', '--psm 3', None, False),
+    'ball_rect': (False, True, 'ball_ocr', '--psm 8', 'eng', False),
+}
+TYPE_ROIS = ('type_rect_1', 'type_rect_2')
+DIALOG_ROI = 'dialog'
+IDENTIFICATION_SCREENS = ('join', 'catch', 'battle')
+
+
+class CorpusCapture(VideoSource):
+    """Video source that returns a loaded corpus frame."""
+    paced = False
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.frame = numpy.zeros((1080, 1920, 3), numpy.uint8)
+
+    def read(self):
+        return True, self.frame.copy()
+
+
+def character_error_rate(text: str,
+                         label: str) -> float:
+    """Return the edit distance between OCRed text and its label, relative to
+    the length of the label.
+    """
+    text = ' '.join(text.split())
+    return enchant.utils.levenshtein(text, label) / max(1, len(label))
+
+
+def summarize(latencies, errors=None) -> dict:
+    """Summarize a list of latencies (s) and optional error values."""
+    summary = {'samples': len(latencies),
+        'p50_ms': round(1000 * float(numpy.percentile(latencies, 50)), 2),
+        'p95_ms': round(1000 * float(numpy.percentile(latencies, 95)), 2)
+    }
+    if errors is not None:
+        summary['mean_error'] = round(float(numpy.mean(errors)), 4)
+    return summary
+
+
+def make_instance(config, language: str, capture: CorpusCapture,
+                  resolution=(1920, 1080)) -> MaxLairInstance:
+    """Create a MaxLairInstance that reads frames from the corpus, processed
+    at the given resolution.
+    """
+    paths = config['pokemon_data_paths']
+    instance = MaxLairInstance(config['default']['BOSS'], ('DEFAULT', 0,
+        'DEFAULT', 0), None, capture, 1, datetime.now(),
+        (paths['Boss_Pokemon'], paths['Rental_Pokemon'],
+        paths['Boss_Matchup_LUT'], paths['Rental_Matchup_LUT'],
+        paths['Rental_Pokemon_Scores']), config[language],
+        config[language]['TESSERACT_LANG_NAME'], 'DEFAULT', 0, 'join', resolution
+    )
+    instance.filename = os.devnull
+    return instance
+
+
+async def benchmark_rois(instance, frame, entry, results) -> None:
+    """Read every labeled rectangle in a frame with each read variant."""
+    for roi, label in entry.get('rois', {}).items():
+        if roi in TYPE_ROIS:
+            rect = getattr(instance, roi)
+            variants = {}
+            if instance.type_references is not None:
+                start = time.perf_counter()
+                text = image_processing.classify_type(frame, rect,
+                    instance.type_references)
+                variants['colour_classifier'] = (time.perf_counter() - start,
+                    float(text != label))
+            start = time.perf_counter()
+            text = await instance.read_text(frame, rect, threshold=False,
+                invert=True, language=instance.tesseract_language,
+                segmentation_mode='--psm 8')
+            variants['ocr'] = (time.perf_counter() - start, float(
+                text.strip().title() != instance.localize_type(label,
+                entry['language'])))
+        elif roi == DIALOG_ROI:
+            variants = {}
+            start = time.perf_counter()
+            text = await instance.read_dialog_text(frame,
+                language=instance.tesseract_language)
+            variants['localized_lines'] = (time.perf_counter() - start,
+                character_error_rate(text, label))
+            start = time.perf_counter()
+            text = await instance.read_text(frame, instance.dialog_rect, invert=True,
+                language=instance.tesseract_language)
+            variants['full_section'] = (time.perf_counter() - start,
+                character_error_rate(text, label))
+        elif roi in ROI_READS:
+            (threshold, invert, profile_name, segmentation_mode, language,
+                last_line) = ROI_READS[roi]
+            rect = getattr(instance, roi)
+            profile = getattr(instance, profile_name)
+            options = {
+                'default': (threshold, invert, None, profile),
+                'no_profile': (threshold, invert, language, None),
+                'text_threshold': (True, True, None, profile),
+            }
+            variants = {}
+            for name, (threshold, invert, language, profile) in options.items():
+                start = time.perf_counter()
+                text = (await instance.read_text(frame, rect, threshold, invert,
+                    language, segmentation_mode, profile)).strip()
+                if last_line:
+                    text = text.split('\n')[-1]
+                variants[name] = (time.perf_counter() - start,
+                    character_error_rate(text, label))
+        else:
+            print('Skipping unknown rectangle ' + roi)
+            continue
+
+        for name, result in variants.items():
+            results.setdefault(roi, {}).setdefault(name, []).append(result)
+
+
+async def benchmark_identification(instance, entry, results) -> None:
+    """Identify the Pokemon on a join, catch, or battle screen."""
+    screen = entry['screen']
+    if screen not in IDENTIFICATION_SCREENS or 'pokemon' not in entry:
+        return
+    start = time.perf_counter()
+    pokemon_list = await instance.read_selectable_pokemon(screen, entry['language'])
+    elapsed = time.perf_counter() - start
+    names = [pokemon.name for pokemon in pokemon_list]
+    correct = sum(name == label for name, label in zip(names, entry['pokemon']))
+    results.setdefault(screen, []).append((elapsed,
+        1 - correct / len(entry['pokemon'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark OCR against a '
+        'labeled corpus of frames.')
+    parser.add_argument('corpus', nargs='?', default='Benchmarks/Corpus')
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    if not config.read('Config.ini', 'utf8'):
+        raise FileNotFoundError('Failed to locate the Config.ini file.')
+    pytesseract.pytesseract.tesseract_cmd = config['default']['TESSERACT_PATH']
+    with open(os.path.join(args.corpus, 'labels.json'), encoding='utf-8') as file:
+        entries = json.load(file)
+
+    capture = CorpusCapture()
+    instances = {}
+    roi_results = {}
+    identification_results = {}
+    for entry in entries:
+        frame = cv2.imread(os.path.join(args.corpus, entry['frame']))
+        if frame is None:
+            print('Failed to read frame ' + entry['frame'])
+            continue
+        language = entry['language']
+        if language not in instances:
+            instances[language] = make_instance(config, language, capture)
+        capture.frame = frame
+        asyncio.run(benchmark_rois(instances[language], frame, entry,
+            roi_results.setdefault(language, {})))
+        asyncio.run(benchmark_identification(instances[language], entry,
+            identification_results.setdefault(language, {})))
+
+    # Summarize per language, rectangle, and read variant.
+    report = {'date': datetime.now().isoformat(timespec='seconds'),
+        'corpus': args.corpus, 'frames': len(entries), 'rois': {},
+        'identification': {}
+    }
+    for language, rois in roi_results.items():
+        for roi, variants in rois.items():
+            for name, samples in variants.items():
+                latencies, errors = zip(*samples)
+                summary = summarize(latencies, errors)
+                report['rois'].setdefault(language, {}).setdefault(roi,
+                    {})[name] = summary
+                key = ' / '.join((language, roi, name))
+                print('%-45s p50 %8.1f ms  p95 %8.1f ms  error %.3f' % (key,
+                    summary['p50_ms'], summary['p95_ms'],
+                    summary['mean_error']))
+    for language, screens in identification_results.items():
+        for screen, samples in screens.items():
+            latencies, errors = zip(*samples)
+            summary = summarize(latencies, errors)
+            summary['accuracy'] = round(1 - summary.pop('mean_error'), 4)
+            report['identification'].setdefault(language, {})[screen] = summary
+            key = ' / '.join((language, screen))
+            print('%-45s p50 %8.1f ms  p95 %8.1f ms  accuracy %.3f' % (key,
+                summary['p50_ms'], summary['p95_ms'], summary['accuracy']))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
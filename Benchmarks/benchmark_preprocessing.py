@@ -0,0 +1,78 @@
+# benchmark_preprocessing
+#   Compare the old full-frame preprocessing pipeline used before OCR and HSV
+#   checks with the crop-first pipeline in image_processing.
+#
+#   Run from the repository root:
+#       python -m Benchmarks.benchmark_preprocessing [path/to/frame.png]
+#   If no frame is supplied, a random 1920x1080 frame is used.
+
+import sys
+import timeit
+import cv2
+import numpy
+import image_processing
+
+ITERATIONS = 200
+
+# Representative sections taken from MaxLairInstance and AutoMaxLair.
+SECTIONS = {
+    'dialog': ((0, 0.6), (1, 1)),
+    'sel_rect_1': ((0.485,0.28), (0.60,0.33)),
+    'ball_rect': ((0.69,0.63), (0.88,0.68)),
+    'shiny_rect': ((0.075,0.53), (0.105,0.58)),
+    'dmax_symbol_rect': ((0.58, 0.80), (0.61 ,0.84)),
+}
+
+
+def full_frame_text(img, section):
+    """Pipeline used by read_text before preprocessing was made crop-first."""
+    h, w = img.shape[:2]
+    img = cv2.inRange(cv2.cvtColor(img, cv2.COLOR_BGR2HSV), (0,0,100), (180,15,255))
+    img = cv2.bitwise_not(img)
+    return img[round(section[0][1]*h):round(section[1][1]*h),
+               round(section[0][0]*w):round(section[1][0]*w)]
+
+
+def full_frame_hsv(img, rect):
+    """Pipeline used by check_rect_HSV_match before it was made crop-first."""
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    h, w = img.shape[:2]
+    return img[round(rect[0][1]*h):round(rect[1][1]*h),
+               round(rect[0][0]*w):round(rect[1][0]*w)]
+
+
+def main():
+    if len(sys.argv) > 1:
+        frame = cv2.imread(sys.argv[1])
+        if frame is None:
+            raise FileNotFoundError('Failed to read frame ' + sys.argv[1])
+    else:
+        frame = numpy.random.randint(0, 256, (1080, 1920, 3), numpy.uint8)
+    buffers = {}
+
+    print('%-18s %-6s %12s %12s %9s' % ('Section', 'Step', 'Full (ms)',
+        'Crop (ms)', 'Speedup'))
+    for name, section in SECTIONS.items():
+        # Check that both pipelines produce identical pixels before timing.
+        assert numpy.array_equal(full_frame_text(frame, section),
+            image_processing.preprocess_section(frame, section, True, True,
+            buffers))
+        assert numpy.array_equal(full_frame_hsv(frame, section),
+            image_processing.crop_hsv(frame, section, buffers))
+
+        cases = (
+            ('text', lambda: full_frame_text(frame, section),
+                lambda: image_processing.preprocess_section(frame, section,
+                True, True, buffers)),
+            ('hsv', lambda: full_frame_hsv(frame, section),
+                lambda: image_processing.crop_hsv(frame, section, buffers)),
+        )
+        for step, old, new in cases:
+            old_time = timeit.timeit(old, number=ITERATIONS) / ITERATIONS * 1000
+            new_time = timeit.timeit(new, number=ITERATIONS) / ITERATIONS * 1000
+            print('%-18s %-6s %12.3f %12.3f %8.1fx' % (name, step, old_time,
+                new_time, old_time / new_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# benchmark_resolution
+#   Measure CPU usage and detection accuracy at reduced processing
+#   resolutions, using the labeled corpus of benchmark_ocr.
+#
+#   Run from the repository root:
+#       python -m Benchmarks.benchmark_resolution [corpus_dir] [--heights 1080 720]
+#           [--output results.json]
+#
+#   Corpus frames are captured at 1920x1080, which the bot always captures at.
+#   The processing height only sets the scaled-down copies that lines of
+#   dialogue are located in; text is read from the full frames. CPU time
+#   includes the Tesseract processes started while reading the frames.
+
+import argparse
+import asyncio
+import configparser
+import json
+import os
+import time
+from datetime import datetime
+import cv2
+import numpy
+import pytesseract
+import image_processing
+from Benchmarks.benchmark_ocr import (CorpusCapture, make_instance,
+    benchmark_rois, benchmark_identification)
+
+
+def cpu_time() -> float:
+    """Return the CPU time used by this process and its finished children."""
+    times = os.times()
+    return (times.user + times.system + times.children_user
+        + times.children_system)
+
+
+def benchmark_checks(instance, frame) -> None:
+    """Run the checks that don't use OCR on a frame."""
+    instance.check_shiny()
+    instance.check_dynamax_available()
+    for rect in (instance.type_rect_1, instance.type_rect_2):
+        image_processing.type_badge_histogram(frame, rect)
+    image_processing.locate_text_lines(
+        image_processing.crop(frame, instance.dialog_rect), frame.shape[0],
+        processing_height=instance.processing_resolution[1]
+    )
+
+
+def benchmark_height(config, corpus, entries, height) -> dict:
+    """Process the whole corpus at one frame height."""
+    resolution = (round(height*16/9), height)
+    capture = CorpusCapture()
+    instances = {}
+    roi_results = {}
+    identification_results = {}
+    checks_time = 0
+    frames = 0
+    start_cpu = cpu_time()
+    start_wall = time.perf_counter()
+    for entry in entries:
+        frame = cv2.imread(os.path.join(corpus, entry['frame']))
+        if frame is None:
+            continue
+        frames += 1
+        language = entry['language']
+        if language not in instances:
+            instances[language] = make_instance(config, language, capture,
+                resolution
+            )
+        instance = instances[language]
+        capture.frame = frame
+        start = time.perf_counter()
+        benchmark_checks(instance, frame)
+        checks_time += time.perf_counter() - start
+        asyncio.run(benchmark_rois(instance, frame, entry, roi_results))
+        asyncio.run(benchmark_identification(instance, entry,
+            identification_results))
+    cpu = cpu_time() - start_cpu
+    wall = time.perf_counter() - start_wall
+
+    # Only the reads the bot actually uses count towards accuracy.
+    errors = {roi: round(float(numpy.mean([error for _, error in
+        variants['default']])), 4) for roi, variants in roi_results.items()
+        if 'default' in variants}
+    for roi in ('type_rect_1', 'type_rect_2'):
+        if roi in roi_results:
+            errors[roi] = round(float(numpy.mean([error for _, error in
+                roi_results[roi]['colour_classifier']])), 4)
+    identification = [error for samples in identification_results.values()
+        for _, error in samples]
+    return {'resolution': '%dx%d' % resolution, 'frames': frames,
+        'cpu_ms_per_frame': round(1000 * cpu / max(1, frames), 1),
+        'wall_ms_per_frame': round(1000 * wall / max(1, frames), 1),
+        'checks_ms_per_frame': round(1000 * checks_time / max(1, frames), 2),
+        'roi_error': errors,
+        'identification_accuracy': (round(1 - float(numpy.mean(
+            identification)), 4) if identification else None)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CPU usage and '
+        'accuracy at reduced processing resolutions.')
+    parser.add_argument('corpus', nargs='?', default='Benchmarks/Corpus')
+    parser.add_argument('--heights', type=int, nargs='+',
+        default=[1080, 900, 720, 540])
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    if not config.read('Config.ini', 'utf8'):
+        raise FileNotFoundError('Failed to locate the Config.ini file.')
+    pytesseract.pytesseract.tesseract_cmd = config['default']['TESSERACT_PATH']
+    with open(os.path.join(args.corpus, 'labels.json'), encoding='utf-8') as file:
+        entries = json.load(file)
+
+    report = {'date': datetime.now().isoformat(timespec='seconds'),
+        'corpus': args.corpus, 'heights': []
+    }
+    for height in args.heights:
+        summary = benchmark_height(config, args.corpus, entries, height)
+        report['heights'].append(summary)
+        accuracy = summary['identification_accuracy']
+        print('%-10s CPU %8.1f ms/frame  wall %8.1f ms/frame  checks %6.2f ms'
+            '  identification %s' % (summary['resolution'],
+            summary['cpu_ms_per_frame'], summary['wall_ms_per_frame'],
+            summary['checks_ms_per_frame'],
+            'N/A' if accuracy is None else '%.3f' % accuracy))
+        for roi, error in sorted(summary['roi_error'].items()):
+            print('    %-16s error %.3f' % (roi, error))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
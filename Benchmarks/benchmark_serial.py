@@ -0,0 +1,87 @@
+# benchmark_serial
+#   Measure the time push_buttons spends beyond the requested delays, sending
+#   button presses one at a time or as sequences, directly or through the
+#   serial writer thread, against the software stand-in for the
+#   microcontroller in fake_serial.
+#
+#   Run from the repository root (Config.ini is used to create the instance):
+#       python -m Benchmarks.benchmark_serial [--latency 0.005] [--drop-rate 0.01]
+#           [--scale 0.05] [--repeats 5]
+#
+#   Delays are multiplied by scale so that the benchmark runs quickly; the
+#   overhead per press doesn't depend on them.
+
+import argparse
+import asyncio
+import configparser
+import time
+from Benchmarks.benchmark_ocr import CorpusCapture, make_instance
+from fake_serial import FakeSerial, FirmwareEmulator, summarize_presses
+from serial_writer import SerialWriter
+
+# Representative sequences from AutoMaxLair
+SEQUENCES = {
+    'join': ((b'b', 2), (b'a', 1), (b'a', 1.5), (b'a', 1.5), (b'a', 1.5),
+        (b'b', 1)),
+    'battle_move': ((b'a', 1), (b'a', 1), (b'a', 1), (b'v', 1), (b'a', 0.5),
+        (b'b', 0.5), (b'^', 0.5), (b'b', 0.5)),
+    'battle_dialogue': ((b'b', 0.005),),
+    'select_pokemon': ((b'^', 1), (b'a', 1), (b'v', 1), (b'a', 3)),
+}
+
+
+async def benchmark(instance, commands, repeats) -> tuple:
+    """Push a sequence of buttons several times and return the mean overhead
+    (s) beyond the requested delays.
+    """
+    overheads = []
+    for __ in range(repeats):
+        start = time.perf_counter()
+        await instance.push_buttons(*commands)
+        overheads.append(time.perf_counter() - start
+            - sum(duration for _, duration in commands))
+    return sum(overheads) / len(overheads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark button pushing '
+        'against an emulated microcontroller.')
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--drop-rate', type=float, default=0)
+    parser.add_argument('--scale', type=float, default=0.05)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    if not config.read('Config.ini', 'utf8'):
+        raise FileNotFoundError('Failed to locate the Config.ini file.')
+    instance = make_instance(config, config['language']['LANGUAGE'],
+        CorpusCapture()
+    )
+
+    print('%-16s %-16s %14s %14s' % ('Sequence', 'Mode', 'Overhead (ms)',
+        'Per press (ms)'))
+    for mode, batch, threaded in (('single', False, False),
+            ('batch', True, False), ('threaded', False, True),
+            ('threaded batch', True, True)):
+        emulator = FirmwareEmulator(args.latency, args.drop_rate)
+        instance.com = FakeSerial(timeout=0.05, emulator=emulator)
+        instance.batch_buttons = batch
+        instance.serial_writer = SerialWriter(instance.com, lambda string: None)
+        if threaded:
+            instance.serial_writer.start()
+        for name, commands in SEQUENCES.items():
+            commands = [(character, duration * args.scale)
+                for character, duration in commands]
+            overhead = asyncio.run(benchmark(instance, commands, args.repeats))
+            print('%-16s %-16s %14.1f %14.2f' % (name, mode, 1000 * overhead,
+                1000 * overhead / len(commands)))
+        print('  ' + summarize_presses(emulator.presses))
+        if threaded:
+            instance.serial_writer.stop()
+            print('  ' + str(instance.serial_writer))
+        emulator.close()
+
+
+if __name__ == '__main__':
+    main()
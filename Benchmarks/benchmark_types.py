@@ -0,0 +1,119 @@
+# benchmark_types
+#   Measure how accurately type badges are classified by colour on the
+#   labeled corpus of benchmark_ocr, and learn the reference histograms the
+#   bot uses from it.
+#
+#   Run from the repository root:
+#       python -m Benchmarks.benchmark_types [corpus_dir] [--write]
+#   Each labeled badge is classified with references learned from every other
+#   badge (leave-one-out), and the accuracy is reported per type. With
+#   --write, references learned from the whole corpus are saved for the bot,
+#   which otherwise OCRs the types, but only if every type has samples and
+#   the accuracy is at least --min-accuracy.
+
+import argparse
+import json
+import os
+import cv2
+import image_processing
+
+# Type badge rectangles, as in MaxLairInstance
+TYPE_RECTS = {
+    'type_rect_1': ((0.24,0.17), (0.31,0.215)),
+    'type_rect_2': ((0.35,0.17), (0.425,0.214)),
+}
+TYPE_REFERENCES_PATH = 'Pokemon_Data/Type_Badges.json'
+
+
+def load_samples(corpus: str) -> list:
+    """Return (type name, badge histogram) pairs for every labeled badge in
+    the corpus, where badges labeled '' are empty.
+    """
+    labels_path = os.path.join(corpus, 'labels.json')
+    if not os.path.exists(labels_path):
+        return []
+    with open(labels_path, encoding='utf-8') as file:
+        entries = json.load(file)
+    samples = []
+    for entry in entries:
+        labels = {roi: label for roi, label in entry.get('rois', {}).items()
+            if roi in TYPE_RECTS}
+        if len(labels) == 0:
+            continue
+        frame = cv2.imread(os.path.join(corpus, entry['frame']))
+        if frame is None:
+            print('Failed to read frame ' + entry['frame'])
+            continue
+        for roi, label in labels.items():
+            samples.append((label, image_processing.type_badge_histogram(frame,
+                TYPE_RECTS[roi])))
+    return samples
+
+
+def cross_validate(samples: list) -> list:
+    """Classify each sample with references learned from all the others and
+    return (label, predicted) pairs.
+    """
+    results = []
+    for i, (label, histogram) in enumerate(samples):
+        references = image_processing.build_type_references(
+            samples[:i] + samples[i+1:])
+        results.append((label, image_processing.classify_type_histogram(
+            histogram, references)))
+    return results
+
+
+def accuracy_by_type(results: list) -> dict:
+    """Return {type: (samples, correct)}, with empty badges under ''."""
+    accuracy = {}
+    for label, predicted in results:
+        samples, correct = accuracy.get(label, (0, 0))
+        accuracy[label] = (samples + 1, correct + (predicted == label))
+    return accuracy
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the type badge '
+        'classifier on a labeled corpus of frames.')
+    parser.add_argument('corpus', nargs='?', default='Benchmarks/Corpus')
+    parser.add_argument('--write', action='store_true',
+        help='Save references learned from the corpus for the bot.')
+    parser.add_argument('--min-accuracy', type=float, default=0.99)
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    args = parser.parse_args()
+
+    samples = load_samples(args.corpus)
+    if len(samples) == 0:
+        print('No labeled type badges found in ' + args.corpus)
+        return
+    accuracy = accuracy_by_type(cross_validate(samples))
+    print('%-10s %8s %8s %9s' % ('Type', 'Samples', 'Correct', 'Accuracy'))
+    for name in image_processing.TYPE_NAMES + ('',):
+        count, correct = accuracy.get(name, (0, 0))
+        print('%-10s %8d %8d %9s' % (name or '(none)', count, correct,
+            '%.3f' % (correct / count) if count else 'N/A'))
+    total = sum(count for count, _ in accuracy.values())
+    overall = sum(correct for _, correct in accuracy.values()) / total
+    print('Overall accuracy %.3f over %d badges' % (overall, total))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'overall': overall, 'types': {name or 'none':
+                {'samples': count, 'correct': correct} for name, (count,
+                correct) in accuracy.items()}}, file, indent=2)
+    if args.write:
+        missing = [name for name in image_processing.TYPE_NAMES
+            if name not in accuracy]
+        if missing:
+            print('Not saving references: no samples of ' + ', '.join(missing))
+        elif overall < args.min_accuracy:
+            print('Not saving references: accuracy is below %g'
+                % args.min_accuracy)
+        else:
+            image_processing.save_type_references(TYPE_REFERENCES_PATH,
+                image_processing.build_type_references(samples))
+            print('Saved type references to ' + TYPE_REFERENCES_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+# benchmark_waits
+#   Measure how long each visual wait (see MaxLairInstance.wait_until) takes
+#   on a recording, compared with the fixed delay it replaces, and whether
+#   the white-text check it used to rely on would have returned earlier.
+#
+#   Run from the repository root (Config.ini is used to create the instance):
+#       python -m Benchmarks.benchmark_waits recording --wait catch.summary
+#           --start 12.4 [--fps 30]
+#
+#   The recording is a video file or a directory of PNG frames (e.g. a clip
+#   saved with RECORD_CLIPS = True), and start is the time (s) in it at which
+#   the button that starts the wait was pressed. Without a recording, a
+#   synthetic catch (battle screen, white flash, blank card, then the card's
+#   text) is measured instead, which only shows when each check returns.
+
+import argparse
+import asyncio
+import configparser
+import cv2
+import numpy
+import image_processing
+from Benchmarks.benchmark_ocr import CorpusCapture, make_instance
+from video_capture import open_video_source
+
+# How AutoMaxLair waits for each named delay: (condition, min_wait, settle)
+WAITS = {
+    'catch.summary': (lambda inst: inst.card_text_shown(inst.sel_rect_4,
+        inst.abil_rect_4), 4, 1),
+    'select_pokemon.after_loss': (lambda inst: inst.screen_settled(), 2, 2),
+    'select_pokemon.take_finish': (lambda inst: inst.screen_settled(), 1, 2),
+}
+# Section of the screen covered by the summary card in the synthetic catch
+SYNTHETIC_CARD = ((0.47, 0.55), (0.75, 0.80))
+
+
+def white_text_shown(inst):
+    """The check catch.summary used before card_text_shown: white text in
+    both summary rectangles.
+    """
+    return lambda img: all(inst.check_rect_HSV_match(rect,
+        image_processing.TEXT_LOWER_HSV, image_processing.TEXT_UPPER_HSV, 15,
+        img) for rect in (inst.sel_rect_4, inst.abil_rect_4))
+
+
+def synthetic_catch(inst, fps: float):
+    """Yield the frames of a synthetic catch: 6 s of battle, a 0.5 s white
+    flash, 2 s of blank card, then 5 s of the card with its text.
+    """
+    battle = numpy.full((1080, 1920, 3), 40, numpy.uint8)
+    flash = numpy.full((1080, 1920, 3), 255, numpy.uint8)
+    blank = battle.copy()
+    h, w = blank.shape[:2]
+    (left, top), (right, bottom) = SYNTHETIC_CARD
+    cv2.rectangle(blank, (round(left*w), round(top*h)),
+        (round(right*w), round(bottom*h)), (235, 240, 240), -1)
+    card = blank.copy()
+    for rect, text in ((inst.sel_rect_4, 'Tsareena'),
+            (inst.abil_rect_4, 'Queenly Majesty')):
+        cv2.putText(card, text, (round(rect[0][0]*w) + 10,
+            round(rect[1][1]*h) - 12), cv2.FONT_HERSHEY_SIMPLEX, 1.2,
+            (50, 50, 50), 3)
+    for seconds, frame in ((6, battle), (0.5, flash), (2, blank), (5, card)):
+        for __ in range(round(seconds * fps)):
+            yield frame
+
+
+async def measure(condition, frames, fps: float, timeout: float,
+                  min_wait: float, settle: float,
+                  poll_interval: float=0.1) -> float:
+    """Return the time (s) after which wait_until would have returned on
+    these frames, or None if it would have timed out.
+    """
+    next_check = min_wait
+    met_since = None
+    for index, frame in enumerate(frames):
+        elapsed = index / fps
+        if elapsed >= timeout:
+            return None
+        if elapsed < next_check:
+            continue
+        met = condition(frame)
+        if asyncio.iscoroutine(met):
+            met = await met
+        if met:
+            if met_since is None:
+                met_since = elapsed
+            if elapsed - met_since >= settle:
+                return elapsed
+        else:
+            met_since = None
+        next_check = elapsed + poll_interval
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure visual waits on '
+        'a recording against the fixed delays they replace.')
+    parser.add_argument('recording', nargs='?')
+    parser.add_argument('--wait', choices=sorted(WAITS),
+        default='catch.summary')
+    parser.add_argument('--start', type=float, default=0,
+        help='Time (s) in the recording at which the wait starts.')
+    parser.add_argument('--fps', type=float, default=30,
+        help='Frame rate of a directory of frames or of the synthetic catch.')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    if not config.read('Config.ini', 'utf8'):
+        raise FileNotFoundError('Failed to locate the Config.ini file.')
+    capture = CorpusCapture()
+    instance = make_instance(config, config['language']['LANGUAGE'], capture)
+    if args.recording is None:
+        args.wait = 'catch.summary'
+        frames = list(synthetic_catch(instance, args.fps))
+        fps = args.fps
+    else:
+        source = open_video_source(args.recording, real_time=False,
+            fps=args.fps)
+        fps = source.fps
+        frames = []
+        while not source.finished:
+            success, frame = source.read()
+            if not success or source.finished:
+                break
+            frames.append(frame)
+        source.release()
+        frames = frames[round(args.start * fps):]
+    if not frames:
+        raise ValueError('The recording has no frames after the start time.')
+
+    # Conditions that compare against the screen take it from the first frame.
+    capture.frame = frames[0]
+    timeout = instance.timing[args.wait]
+    make_condition, min_wait, settle = WAITS[args.wait]
+    checks = {'visual wait': make_condition(instance)}
+    if args.wait == 'catch.summary':
+        checks['white text'] = white_text_shown(instance)
+    print('%-30s %8.2f s' % ('fixed delay', timeout))
+    for name, condition in checks.items():
+        elapsed = asyncio.run(measure(condition, frames, fps, timeout,
+            min_wait, settle))
+        if elapsed is None:
+            print('%-30s timed out' % name)
+        else:
+            print('%-30s %8.2f s (%.2f s saved)' % (name, elapsed,
+                timeout - elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# capture_corpus
+#   Capture frames from the Switch for the OCR benchmark corpus.
+#
+#   Run from the repository root:
+#       python -m Benchmarks.capture_corpus [corpus_dir]
+#   Press a key to save the current frame as one of the following screens:
+#       j: join, c: catch, b: battle, l: ball, d: dialog
+#   then press Q to quit. Each saved frame gets an entry in labels.json with
+#   empty labels for the rectangles on that screen, which need to be filled in
+#   by hand before running Benchmarks/benchmark_ocr.py.
+
+import configparser
+import json
+import os
+import sys
+import cv2
+
+SCREENS = {
+    'j': ('join', ['sel_rect_1', 'sel_rect_2', 'sel_rect_3', 'abil_rect_1',
+        'abil_rect_2', 'abil_rect_3'], 3),
+    'c': ('catch', ['sel_rect_4', 'abil_rect_4'], 1),
+    'b': ('battle', ['sel_rect_5', 'type_rect_1', 'type_rect_2'], 1),
+    'l': ('ball', ['ball_rect'], 0),
+    'd': ('dialog', ['dialog'], 0),
+}
+
+
+def main():
+    corpus = sys.argv[1] if len(sys.argv) > 1 else 'Benchmarks/Corpus'
+    config = configparser.ConfigParser()
+    if not config.read('Config.ini', 'utf8'):
+        raise FileNotFoundError('Failed to locate the Config.ini file.')
+    language = config['language']['LANGUAGE']
+    os.makedirs(os.path.join(corpus, language), exist_ok=True)
+
+    labels_path = os.path.join(corpus, 'labels.json')
+    entries = []
+    if os.path.exists(labels_path):
+        with open(labels_path, encoding='utf-8') as file:
+            entries = json.load(file)
+
+    cap = cv2.VideoCapture(int(config['default']['VIDEO_INDEX']))
+    cap.set(3, 1920)
+    cap.set(4, 1080)
+    while True:
+        _, frame = cap.read()
+        cv2.imshow('Corpus capture', cv2.resize(frame, (960, 540)))
+        key = chr(cv2.waitKey(1) & 0xFF)
+        if key == 'q':
+            break
+        if key not in SCREENS:
+            continue
+
+        screen, rois, num_pokemon = SCREENS[key]
+        count = sum(entry['screen'] == screen and entry['language'] == language
+            for entry in entries)
+        name = '%s/%s_%03d.png' % (language, screen, count + 1)
+        cv2.imwrite(os.path.join(corpus, name), frame)
+        entry = {'frame': name, 'language': language, 'screen': screen,
+            'rois': {roi: '' for roi in rois}}
+        if num_pokemon > 0:
+            entry['pokemon'] = [''] * num_pokemon
+        entries.append(entry)
+        with open(labels_path, 'w', encoding='utf-8') as file:
+            json.dump(entries, file, indent=2, ensure_ascii=False)
+        print('Saved ' + name)
+
+    cap.release()
+    cv2.destroyAllWindows()
+
+
+if __name__ == '__main__':
+    main()
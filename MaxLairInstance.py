@@ -4,15 +4,28 @@
 #       Last updated 2021-01-08
 #       Created 2020-11-20
 
+import asyncio
 import cv2
+import functools
+import numpy
 import time
 import pytesseract
 import enchant
 import pickle
-import sys
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import TypeVar, Dict, List, Tuple
+from typing import TypeVar, Awaitable, Callable, Dict, List, Tuple
 from Translations import french_translation, spanish_translation
+from ball_wheel import BallWheel
+import image_processing
+from video_capture import FrameGrabber, HeldFrame
+from ocr_profiles import OCRProfile, write_word_list
+import ocr_profiles
+import serial_protocol
+from serial_writer import SerialWriter
+from timing_profiles import TimingProfile
+import timing_profiles
 Pokemon = TypeVar('Pokemon')
 Move = TypeVar('Move')
 Serial = TypeVar('serial.Serial')
@@ -20,6 +33,40 @@ VideoCapture = TypeVar('cv2.VideoCapture')
 DateTime = TypeVar('datetime.datetime')
 Image = TypeVar('cv2 image')
 
+# Rectangles (and their colours) drawn on the display during each stage
+STAGE_ANNOTATIONS = {
+    'select_pokemon': (('shiny_rect', (0,255,0)),),
+    'join': (('sel_rect_1', (0,255,0)), ('sel_rect_2', (0,255,0)),
+        ('sel_rect_3', (0,255,0)), ('abil_rect_1', (0,255,255)),
+        ('abil_rect_2', (0,255,255)), ('abil_rect_3', (0,255,255))),
+    'catch': (('sel_rect_4', (0,255,0)), ('abil_rect_4', (0,255,255)),
+        ('ball_rect', (0,0,255))),
+    'battle': (('sel_rect_5', (0,255,0)), ('type_rect_1', (255,255,0)),
+        ('type_rect_2', (255,255,0)), ('dmax_symbol_rect', (255,255,0))),
+    'backpacker': (('item_rect_1', (0,255,0)), ('item_rect_2', (0,255,0)),
+        ('item_rect_3', (0,255,0)), ('item_rect_4', (0,255,0)),
+        ('item_rect_5', (0,255,0))),
+}
+
+# Rectangles corrected for the alignment of the capture device by
+# apply_calibration
+CALIBRATED_RECTS = ('shiny_rect', 'sel_rect_1', 'sel_rect_2', 'sel_rect_3',
+    'sel_rect_4', 'sel_rect_5', 'type_rect_1', 'type_rect_2',
+    'dmax_symbol_rect', 'abil_rect_1', 'abil_rect_2', 'abil_rect_3',
+    'abil_rect_4', 'ball_rect', 'dialog_rect', 'item_rect_1', 'item_rect_2',
+    'item_rect_3', 'item_rect_4', 'item_rect_5')
+
+# Reference histograms of the type badges, learned from the labeled corpus by
+# Benchmarks/benchmark_types.py
+TYPE_REFERENCES_PATH = 'Pokemon_Data/Type_Badges.json'
+
+# The panel is also redrawn this often (s) to keep the time per run current
+STATS_REFRESH_INTERVAL = 1
+# Reads from the video source that may fail in a row, and the time (s) between
+# them, before get_frame gives up
+FRAME_READ_ATTEMPTS = 5
+FRAME_READ_RETRY_DELAY = 0.1
+
 
 class MaxLairInstance():
     """An object for storing and processing information related to a Dynamax
@@ -31,15 +78,14 @@ class MaxLairInstance():
                  com: Serial,
                  cap: Serial,
                  video_scale: float,
-                 lock,
-                 exit_flag,
                  datetime: DateTime,
                  pokemon_data_paths: Tuple[str, str, str, str, str],
                  phrases,
                  tesseract_language: str,
                  mode: str,
                  dynite_ore: int,
-                 stage: str='join') -> None:
+                 stage: str='join',
+                 processing_resolution: Tuple[int, int]=(1920, 1080)) -> None:
         self.boss_pokemon_path, self.rental_pokemon_path, self.boss_matchups_path, self.rental_matchups_path, self.rental_scores_path = pokemon_data_paths
         self.phrases = phrases
         self.tesseract_language = tesseract_language
@@ -59,18 +105,82 @@ class MaxLairInstance():
         self.shinies_found = 0
         self.caught_shinies = []
         self.consecutive_resets = 0
+        # Order of the balls on the ball selection wheel, learned while
+        # searching for the target ball
+        self.ball_wheel = BallWheel()
 
         # Video capture and serial communication objects
         self.cap = cap
+        # Frames are captured at the Switch's native resolution and text is
+        # read from them at full detail. Only locating the lines of dialogue,
+        # which scans a large part of the frame, works on copies scaled down
+        # to the processing resolution. The rectangles below are fractions of
+        # the frame so they work at any resolution.
         self.base_resolution = (1920, 1080)
+        self.processing_resolution = tuple(processing_resolution)
         self.display_resolution = (round(1920*video_scale), round(1080*video_scale))
+        # The display is rendered into its own buffer, with the annotation
+        # rectangles for each stage converted to display pixels once.
+        self.display_buffer = None
+        self.annotation_rects = {}
+        # The statistics panel is cached and only redrawn when it is dirty,
+        # which whatever changes a statistic marks it as.
+        self.stats_panel = None
+        self.stats_panel_time = 0
+        self.stats_dirty = True
         self.cap.set(3, self.base_resolution[0])
         self.cap.set(4, self.base_resolution[1])
+        # Frames are read continuously on a background thread once the
+        # grabber is started; until then they are read on demand.
+        self.frame_grabber = FrameGrabber(cap)
+        self.frame_timestamp = 0
+        # Newest frame read by the control thread, shown by the display when
+        # the grabber isn't running
+        self.latest_frame = None
+        self.screenshot_requested = False
+        # Without a window, frames are only rendered for screenshots.
+        self.headless = False
+        # Optional clip_recorder.ClipRecorder that saves clips around events
+        self.clip_recorder = None
         self.com = com
-        self.lock = lock
-        self.exit_flag = exit_flag
+        # Send button sequences to the microcontroller in one message, which
+        # requires firmware that supports them.
+        self.batch_buttons = False
+        # Once started, button presses are queued for a background thread
+        # that writes them and checks the replies; until then they are sent
+        # directly.
+        self.serial_writer = SerialWriter(com, self.log)
+        # Fixed delays that wait for the next screen are cut short by
+        # wait_until as soon as it appears, unless visual waits are disabled.
+        self.visual_waits = True
+        self.wait_time_saved = 0
+        # Created when a battle is lost (see screen_settled), so the
+        # transition to the end of the run is watched from its start.
+        self.loss_settled = None
+        # Delays can be named in the timing profile instead of given in
+        # seconds. When observing, the screen is watched during each named
+        # delay and the time it took to settle is logged.
+        self.timing = TimingProfile()
+        self.observe_timing = False
+        # Preallocated destination arrays reused when preprocessing each ROI
+        self.roi_buffers = {}
+        # When a Pokemon can't be identified confidently, this many extra
+        # frames are read concurrently (within a time limit in seconds) and
+        # the best match is voted on. Set the number of frames to 0 to disable.
+        self.identification_vote_frames = 3
+        self.identification_vote_timeout = 4
+        self.ocr_executor = ThreadPoolExecutor(max_workers=4)
+        # Reference histograms of the type badges, if they have been learned
+        self.type_references = image_processing.load_type_references(
+            TYPE_REFERENCES_PATH)
+        # Tesseract is stopped if it takes longer than this (s) to read text
+        self.ocr_timeout = 5
 
-        # Rectangles for checking shininess and reading specific text
+        # Word lists that steer Tesseract towards the names it should find
+        self.write_ocr_word_lists()
+
+        # Rectangles for checking shininess and reading specific text, along
+        # with the OCR profiles used to read them
         # Shiny star rectangle
         self.shiny_rect = ((0.075,0.53), (0.105,0.58))
         # Selectable Pokemon names rectangles
@@ -78,6 +188,12 @@ class MaxLairInstance():
         self.sel_rect_2 = ((0.485,0.54), (0.60,0.59))
         self.sel_rect_3 = ((0.485,0.80), (0.60,0.855))
         self.sel_rect_4 = ((0.485,0.59), (0.60,0.645))
+        self.name_ocr = OCRProfile('--psm 8', user_words=self.name_words_path)
+        # The third name shifts around between runs necessitating a bigger
+        # rectangle and a different text segmentation mode
+        self.name_block_ocr = OCRProfile('--psm 3',
+            user_words=self.name_words_path
+        )
         # In-battle Pokemon name & type rectangles
         self.sel_rect_5 = ((0.195,0.11), (0.39,0.16))
         self.type_rect_1 = ((0.24,0.17), (0.31,0.215))
@@ -89,15 +205,30 @@ class MaxLairInstance():
         self.abil_rect_2 = ((0.485,0.59), (0.60,0.65))
         self.abil_rect_3 = ((0.485,0.85), (0.60,0.91))
         self.abil_rect_4 = ((0.485,0.645), (0.60,0.69))
+        self.ability_ocr = OCRProfile('--psm 8',
+            user_words=self.ability_words_path
+        )
+        self.ability_block_ocr = OCRProfile('--psm 3',
+            user_words=self.ability_words_path
+        )
         # Poke ball rectangle
         self.ball_rect = ((0.69,0.63), (0.88,0.68))
-        self.ball_num_rect = ((0.915,0.63), (0.95,0.68))
+        self.ball_ocr = OCRProfile('--psm 7', ocr_profiles.LETTERS + 'é',
+            user_words=self.ball_words_path
+        )
+        # Dialogue box and command menu rectangle
+        self.dialog_rect = ((0, 0.6), (1, 1))
         # Backpacker
         self.item_rect_1 = ((0.549,0.1270), (0.745,0.1770)) 
         self.item_rect_2 = ((0.549,0.2035), (0.745,0.2535))
         self.item_rect_3 = ((0.549,0.2800), (0.745,0.3300))
         self.item_rect_4 = ((0.549,0.3565), (0.745,0.4065))
         self.item_rect_5 = ((0.549,0.4330), (0.745,0.4830))
+        # Dialogue box and command menu lines stacked by read_dialog_text
+        self.dialog_ocr = OCRProfile('--psm 6')
+        # The rectangles above assume a perfectly aligned capture until a
+        # calibration is applied.
+        self.calibration = None
 
     def reset_run(self) -> None:
         """Reset in preparation for a new Dynamax Adventure."""
@@ -105,6 +236,7 @@ class MaxLairInstance():
         self.HP = 1  # 1 = 100%
         self.num_caught = 0
         self.lives = 4
+        self.stats_dirty = True
         self.reset_stage()
         # Load precalculated resources for choosing Pokemon and moves
         self.boss_pokemon = pickle.load(open(self.boss_pokemon_path, 'rb'))
@@ -118,105 +250,263 @@ class MaxLairInstance():
         self.move_index = 0
         self.dmax_timer = -1
         self.opponent = None
+        self.stats_dirty = True
         self.dynamax_available = False
         if self.pokemon is not None:
             if self.pokemon.name == 'Ditto':
                 self.pokemon = self.rental_pokemon['Ditto']
             self.pokemon.dynamax = False
         
+    def apply_calibration(self,
+                          calibration) -> None:
+        """Correct every detection rectangle for the alignment of the capture
+        device, as measured by a calibration.Calibration object.
+        """
+        self.calibration = calibration
+        for attribute in CALIBRATED_RECTS:
+            setattr(self, attribute, calibration.apply(getattr(self, attribute)))
+        self.roi_buffers = {}
+        self.annotation_rects = {}
+        self.log('Applied capture calibration: ' + str(calibration))
+
+    def write_ocr_word_lists(self) -> None:
+        """Write Tesseract user-words files listing the rental Pokemon names,
+        abilities, and Poke Balls that can appear on screen.
+        """
+        translation = {'spa': spanish_translation,
+            'fra': french_translation}.get(self.tesseract_language)
+        names = [pokemon.name.split(' (')[0] for pokemon in self.rental_pokemon.values()]
+        abilities = [pokemon.ability for pokemon in self.rental_pokemon.values()]
+        if translation is not None:
+            names += [translation.translate_pokemon.get(name, name) for name in names]
+            abilities += [translation.translate_ability.get(ability, ability)
+                for ability in abilities]
+
+        self.name_words_path = 'Pokemon_Data/Rental_names.user-words'
+        self.ability_words_path = 'Pokemon_Data/Rental_abilities.user-words'
+        self.ball_words_path = 'Pokemon_Data/Balls.user-words'
+        write_word_list(self.name_words_path, names)
+        write_word_list(self.ability_words_path, abilities)
+        write_word_list(self.ball_words_path, ocr_profiles.BALL_NAMES)
+
     def get_frame(self,
-                  stage: str='') -> Image:
-        """Get an annotated image of the current Switch output."""
-        _, img = self.cap.read()
-
-        # Draw rectangles around detection areas
-        h, w = img.shape[:2]
-        if stage == 'select_pokemon':
-            cv2.rectangle(img, (round(self.shiny_rect[0][0]*w)-2,round(self.shiny_rect[0][1]*h)-2),
-                          (round(self.shiny_rect[1][0]*w)+2,round(self.shiny_rect[1][1]*h)+2), (0,255,0), 2)
-        elif stage == 'join':
-            cv2.rectangle(img, (round(self.sel_rect_1[0][0]*w)-2,round(self.sel_rect_1[0][1]*h)-2),
-                          (round(self.sel_rect_1[1][0]*w)+2,round(self.sel_rect_1[1][1]*h)+2), (0,255,0), 2)
-            cv2.rectangle(img, (round(self.sel_rect_2[0][0]*w)-2,round(self.sel_rect_2[0][1]*h)-2),
-                          (round(self.sel_rect_2[1][0]*w)+2,round(self.sel_rect_2[1][1]*h)+2), (0,255,0), 2)
-            cv2.rectangle(img, (round(self.sel_rect_3[0][0]*w)-2,round(self.sel_rect_3[0][1]*h)-2),
-                          (round(self.sel_rect_3[1][0]*w)+2,round(self.sel_rect_3[1][1]*h)+2), (0,255,0), 2)
-            cv2.rectangle(img, (round(self.abil_rect_1[0][0]*w)-2,round(self.abil_rect_1[0][1]*h)-2),
-                          (round(self.abil_rect_1[1][0]*w)+2,round(self.abil_rect_1[1][1]*h)+2), (0,255,255), 2)
-            cv2.rectangle(img, (round(self.abil_rect_2[0][0]*w)-2,round(self.abil_rect_2[0][1]*h)-2),
-                          (round(self.abil_rect_2[1][0]*w)+2,round(self.abil_rect_2[1][1]*h)+2), (0,255,255), 2)
-            cv2.rectangle(img, (round(self.abil_rect_3[0][0]*w)-2,round(self.abil_rect_3[0][1]*h)-2),
-                          (round(self.abil_rect_3[1][0]*w)+2,round(self.abil_rect_3[1][1]*h)+2), (0,255,255), 2)
-        elif stage == 'catch':
-            cv2.rectangle(img, (round(self.sel_rect_4[0][0]*w)-2,round(self.sel_rect_4[0][1]*h)-2),
-                          (round(self.sel_rect_4[1][0]*w)+2,round(self.sel_rect_4[1][1]*h)+2), (0,255,0), 2)
-            cv2.rectangle(img, (round(self.abil_rect_4[0][0]*w)-2,round(self.abil_rect_4[0][1]*h)-2),
-                          (round(self.abil_rect_4[1][0]*w)+2,round(self.abil_rect_4[1][1]*h)+2), (0,255,255), 2)
-            cv2.rectangle(img, (round(self.ball_rect[0][0]*w)-2,round(self.ball_rect[0][1]*h)-2),
-                          (round(self.ball_rect[1][0]*w)+2,round(self.ball_rect[1][1]*h)+2), (0,0,255), 2)
-            cv2.rectangle(img, (round(self.ball_num_rect[0][0]*w)-2,round(self.ball_num_rect[0][1]*h)-2),
-                          (round(self.ball_num_rect[1][0]*w)+2,round(self.ball_num_rect[1][1]*h)+2), (0,0,255), 2)
-        elif stage == 'battle':
-            cv2.rectangle(img, (round(self.sel_rect_5[0][0]*w)-2,round(self.sel_rect_5[0][1]*h)-2),
-                          (round(self.sel_rect_5[1][0]*w)+2,round(self.sel_rect_5[1][1]*h)+2), (0,255,0), 2)
-            cv2.rectangle(img, (round(self.type_rect_1[0][0]*w)-2,round(self.type_rect_1[0][1]*h)-2),
-                          (round(self.type_rect_1[1][0]*w)+2,round(self.type_rect_1[1][1]*h)+2), (255,255,0), 2)
-            cv2.rectangle(img, (round(self.type_rect_2[0][0]*w)-2,round(self.type_rect_2[0][1]*h)-2),
-                          (round(self.type_rect_2[1][0]*w)+2,round(self.type_rect_2[1][1]*h)+2), (255,255,0), 2)
-            cv2.rectangle(img, (round(self.dmax_symbol_rect[0][0]*w)-2,round(self.dmax_symbol_rect[0][1]*h)-2),
-                          (round(self.dmax_symbol_rect[1][0]*w)+2,round(self.dmax_symbol_rect[1][1]*h)+2), (255,255,0), 2)
-        elif stage == 'backpacker':
-            cv2.rectangle(img, (round(self.item_rect_1[0][0]*w)-2,round(self.item_rect_1[0][1]*h)-2),
-                          (round(self.item_rect_1[1][0]*w)+2,round(self.item_rect_1[1][1]*h)+2), (0,255,0), 2)
-            cv2.rectangle(img, (round(self.item_rect_2[0][0]*w)-2,round(self.item_rect_2[0][1]*h)-2),
-                          (round(self.item_rect_2[1][0]*w)+2,round(self.item_rect_2[1][1]*h)+2), (0,255,0), 2)
-            cv2.rectangle(img, (round(self.item_rect_3[0][0]*w)-2,round(self.item_rect_3[0][1]*h)-2),
-                          (round(self.item_rect_3[1][0]*w)+2,round(self.item_rect_3[1][1]*h)+2), (0,255,0), 2)
-            cv2.rectangle(img, (round(self.item_rect_4[0][0]*w)-2,round(self.item_rect_4[0][1]*h)-2),
-                          (round(self.item_rect_4[1][0]*w)+2,round(self.item_rect_4[1][1]*h)+2), (0,255,0), 2)
-            cv2.rectangle(img, (round(self.item_rect_5[0][0]*w)-2,round(self.item_rect_5[0][1]*h)-2),
-                          (round(self.item_rect_5[1][0]*w)+2,round(self.item_rect_5[1][1]*h)+2), (0,255,0), 2)
-
-        # Return and annotated image.
+                  newer_than: float=0) -> Image:
+        """Get an image of the current Switch output.
+
+        The image is read-only because it may be shared with other consumers.
+        If newer_than is given, wait for a frame captured after that time.
+        Raise ConnectionError if the video source delivers no frame.
+        """
+        img = None
+        if self.frame_grabber.running:
+            self.frame_timestamp, img = self.frame_grabber.get_frame(newer_than)
+        else:
+            for __ in range(FRAME_READ_ATTEMPTS):
+                success, img = self.cap.read()
+                if success and img is not None:
+                    self.frame_timestamp = time.time()
+                    break
+                img = None
+                time.sleep(FRAME_READ_RETRY_DELAY)
+        if img is None:
+            raise ConnectionError('Failed to get a frame from the video '
+                'source. Check that the capture card is connected.')
+        img.setflags(write=False)
+        self.latest_frame = img
         return img
 
-    def read_text(self,
+    def get_thumbnail(self,
+                      rect: Tuple[Tuple[float, float], Tuple[float, float]]=((0,0),(1,1)),
+                      newer_than: float=0) -> Image:
+        """Return a thumbnail (see image_processing.get_thumbnail) of a
+        section of the newest frame, made from the grabber's frame in place
+        rather than from a copy. If newer_than is given, wait for a frame
+        captured after that time.
+        """
+        if self.frame_grabber.running:
+            with self.frame_grabber.acquire_frame(newer_than) as held:
+                if held.frame is not None:
+                    self.frame_timestamp = held.timestamp
+                    return image_processing.get_thumbnail(held.frame, rect)
+        # Without a grabber (or a frame), get_frame reads or raises.
+        return image_processing.get_thumbnail(self.get_frame(newer_than), rect)
+
+    async def get_new_thumbnail(self,
+                          rect: Tuple[Tuple[float, float], Tuple[float, float]]=((0,0),(1,1))) -> Image:
+        """Get a thumbnail of a frame captured after the last one (see
+        get_thumbnail), waiting for it without blocking the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None,
+            functools.partial(self.get_thumbnail, rect,
+            newer_than=self.frame_timestamp)
+        )
+
+    async def get_new_frame(self) -> Image:
+        """Get a frame captured after the last one, waiting for it without
+        blocking the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None,
+            functools.partial(self.get_frame, newer_than=self.frame_timestamp)
+        )
+
+    def get_annotation_rects(self,
+                             stage: str) -> List[Tuple]:
+        """Return the rectangles drawn on the display during a stage as
+        (top left, bottom right, colour) in display pixels.
+        """
+        if stage not in self.annotation_rects:
+            w, h = self.display_resolution
+            rects = []
+            for attribute, color in STAGE_ANNOTATIONS.get(stage, ()):
+                rect = getattr(self, attribute)
+                rects.append(((round(rect[0][0]*w)-2, round(rect[0][1]*h)-2),
+                    (round(rect[1][0]*w)+2, round(rect[1][1]*h)+2), color)
+                )
+            self.annotation_rects[stage] = rects
+        return self.annotation_rects[stage]
+
+    def render_stats_panel(self,
+                           panel_width: int=250) -> Image:
+        """Return an image of the run statistics, redrawing it only if a
+        statistic has changed (or the time per run is due an update).
+        """
+        if (self.stats_panel is None or self.stats_dirty
+                or time.time() - self.stats_panel_time > STATS_REFRESH_INTERVAL):
+            # Clear the flag before reading the statistics so that a change
+            # made meanwhile marks the panel dirty again.
+            self.stats_dirty = False
+            self.stats_panel_time = time.time()
+            if self.stats_panel is None:
+                self.stats_panel = numpy.zeros((self.display_resolution[1],
+                    panel_width, 3), numpy.uint8
+                )
+            else:
+                self.stats_panel[:] = 0
+            for i, (label, value) in enumerate(self.get_stats()):
+                cv2.putText(self.stats_panel, label + value, (5, 25 + 25 * i),
+                    cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 255), 2, cv2.LINE_AA
+                )
+        return self.stats_panel
+
+    def render_display_frame(self,
+                             img: Image,
+                             panel_width: int=250) -> Image:
+        """Render a frame, annotated for the current stage, into the display
+        buffer, with the statistics panel on the right.
+        """
+        w, h = self.display_resolution
+        if self.display_buffer is None:
+            self.display_buffer = numpy.zeros((h, w + panel_width, 3), numpy.uint8)
+        view = self.display_buffer[:, :w]
+        cv2.resize(img, self.display_resolution, dst=view)
+        self.display_buffer[:, w:] = self.render_stats_panel(panel_width)
+        for top_left, bottom_right, color in self.get_annotation_rects(self.stage):
+            cv2.rectangle(view, top_left, bottom_right, color, 2)
+        return self.display_buffer
+
+    async def read_text(self,
                   img: Image,
                   section: Tuple[Tuple[float, float], Tuple[float, float]]=((0,0),(1,1)),
                   threshold: bool=True,
                   invert: bool=False,
                   language: str=None,
-                  segmentation_mode: str='--psm 11') -> str:
-        """Read text from a section (default entirety) of an image using Tesseract."""
-        # Process image according to instructions
-        h, w = img.shape[:2]
-        if threshold:
-            img = cv2.inRange(cv2.cvtColor(img, cv2.COLOR_BGR2HSV), (0,0,100), (180,15,255))
-        if invert:
-            img = cv2.bitwise_not(img)
-        img = img[round(section[0][1]*h):round(section[1][1]*h),
-                  round(section[0][0]*w):round(section[1][0]*w)]
+                  segmentation_mode: str='--psm 11',
+                  profile: OCRProfile=None) -> str:
+        """Read text from a section (default entirety) of an image using Tesseract.
+
+        If an OCR profile is supplied, its settings replace the segmentation
+        mode.
+        """
+        if profile is None:
+            profile = OCRProfile(segmentation_mode, dpi=None)
+        frame_height = img.shape[0]
+        # Crop the section first, then process only those pixels according to
+        # instructions.
+        img = image_processing.preprocess_section(img, section, threshold,
+            invert, self.roi_buffers
+        )
         #cv2.imshow('Text Area', img) # DEBUG
 
-        # Then, read text using Tesseract.
-        # Note that we need to check for the main thread exiting here.
-        if self.exit_flag.is_set():
-            sys.exit()
-        # We release the lock so that the display thread can continue while
-        # Tesseract processes the image.
-        self.lock.release()
-        text = pytesseract.image_to_string(img, lang=language, config=segmentation_mode)
-        self.lock.acquire()
+        # Then, read and return text using Tesseract. Unless the profile
+        # resized it, the section is a reused buffer or a view of the frame,
+        # so Tesseract gets its own copy in case another read (or a new
+        # frame) overwrites them while it is still running.
+        prepared = profile.prepare(img, frame_height)
+        if prepared is img:
+            prepared = img.copy()
+        return await self.run_tesseract(prepared, language,
+            profile.get_config(frame_height)
+        )
 
-        # Finally, return the OCRed text.
-        return text
+    async def read_dialog_text(self,
+                         img: Image,
+                         section: Tuple[Tuple[float, float], Tuple[float, float]]=None,
+                         language: str=None) -> str:
+        """Read the dialogue box and command menu text from a section (default
+        dialog_rect) of an image, passing Tesseract only the lines of text
+        found in it. If there are none, '' is returned without awaiting
+        anything, so a loop calling this must wait for its frames.
+        """
+        if section is None:
+            section = self.dialog_rect
+        # Locate the individual lines of text in the section, in a copy scaled
+        # down to the processing height.
+        lines = image_processing.locate_text_lines(
+            image_processing.crop(img, section), img.shape[0],
+            processing_height=self.processing_resolution[1]
+        )
+        # Nothing resembling text was found so there is nothing to read.
+        if len(lines) == 0:
+            return ''
 
-    def identify_pokemon(self,
-                         name: str,
-                         language: str,
-                         ability: str='',
-                         types: str='') -> Pokemon:
-        """Match OCRed Pokemon to a rental Pokemon."""
+        # Threshold and invert the section as read_text does, then stack only
+        # the lines and read them in one call, treating the result as a block
+        # of separate lines.
+        processed = image_processing.preprocess_section(img, section, True,
+            True, self.roi_buffers
+        )
+        lines_img = self.dialog_ocr.prepare(
+            image_processing.stack_text_lines(processed, lines), img.shape[0]
+        )
+        return await self.run_tesseract(lines_img, language,
+            self.dialog_ocr.get_config(img.shape[0])
+        )
+
+    async def run_tesseract(self,
+                      img: Image,
+                      language: str=None,
+                      config: str='--psm 11') -> str:
+        """Read text from a preprocessed image using Tesseract, which runs on
+        the OCR thread pool so other coroutines can continue meanwhile.
+        Tesseract is stopped after ocr_timeout seconds, in which case no text
+        is returned.
+        """
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.ocr_executor, functools.partial(pytesseract.image_to_string,
+                img, lang=language, config=config, timeout=self.ocr_timeout)
+            )
+        except RuntimeError as error:
+            # pytesseract reports a timeout with a plain RuntimeError, while
+            # its TesseractError (a subclass) means Tesseract failed, e.g.
+            # because of missing language data or a bad option.
+            if str(error) != 'Tesseract process timeout':
+                raise
+            self.log('WARNING: Tesseract took longer than %g s to read text.'
+                % self.ocr_timeout)
+            return ''
+
+    def match_pokemon(self,
+                      name: str,
+                      language: str,
+                      ability: str='',
+                      types: str='') -> Tuple[Pokemon, int, int, str, str]:
+        """Find the rental Pokemon that best matches OCRed text.
+
+        Returns the best match, its distance from the OCRed text, the margin
+        by which it beat the next best match, the composite OCRed text, and
+        the text it was matched to.
+        """
         # Strip line breaks from OCRed text and combine name, ability, and types
         # to make a composite identifying string.
         text = name.replace('\n','')+ability.replace('\n','')+types.replace('\n','')
@@ -229,6 +519,7 @@ class MaxLairInstance():
         # text.
         best_match = None
         match_value = 1000
+        runner_up_value = 1000
 
         # Then, loop through all the possible rental pokemon looking for the
         # best match with the OCRed text.
@@ -252,12 +543,8 @@ class MaxLairInstance():
                 if language == 'French':
                     string_to_match += french_translation.translate_ability[pokemon.ability]
             if types != '':
-                if language == 'English':
-                    string_to_match += pokemon.types[0] + pokemon.types[1]
-                if language == 'Spanish':#for now spanish is using english
-                    string_to_match += spanish_translation.translate_pokemon[pokemon.types[0]] + spanish_translation.translate_pokemon[pokemon.types[1]]
-                if language == 'French':
-                    string_to_match += french_translation.translate_type[pokemon.types[0]] + french_translation.translate_type[pokemon.types[1]]
+                string_to_match += (self.localize_type(pokemon.types[0], language)
+                    + self.localize_type(pokemon.types[1], language))
 
             # After building the identifying string, calculate how different it
             # is from the OCRed string.
@@ -266,76 +553,260 @@ class MaxLairInstance():
             # Then, update the best match values if the match is better than the
             # previous best match.
             if distance < match_value:
+                runner_up_value = match_value
                 match_value = distance
                 best_match = pokemon
                 matched_text = string_to_match
+            elif distance < runner_up_value:
+                runner_up_value = distance
+
+        return (best_match, match_value, runner_up_value - match_value, text,
+            matched_text)
+
+    def localize_type(self,
+                      type_name: str,
+                      language: str) -> str:
+        """Return the name of a type as it appears in the game's language."""
+        translation = {'Spanish': spanish_translation,
+            'French': french_translation}.get(language)
+        if translation is None:
+            return type_name
+        return translation.translate_type.get(type_name, type_name)
+
+    async def read_types(self,
+                         img: Image,
+                         rects: Tuple,
+                         language: str) -> str:
+        """Read the opponent's types from their badges, in the game's
+        language. Badges are classified by colour once reference histograms
+        have been learned from captured frames, and OCRed otherwise.
+        """
+        if self.type_references is not None:
+            return ''.join(self.localize_type(image_processing.classify_type(
+                img, rect, self.type_references), language) for rect in rects)
+        texts = await asyncio.gather(*(self.read_text(img, rect,
+            threshold=False, invert=True, language=self.tesseract_language,
+            segmentation_mode='--psm 8') for rect in rects))
+        return ''.join(text.strip().title() for text in texts)
+
+    async def identify_pokemon(self,
+                         name: str,
+                         language: str,
+                         ability: str='',
+                         types: str='',
+                         reads: Tuple=None) -> Pokemon:
+        """Match OCRed Pokemon to a rental Pokemon.
+
+        If the match is poor and the reads that produced the text (see
+        get_pokemon_reads) are supplied, more frames are read and voted on.
+        """
+        best_match, match_value, margin, text, matched_text = self.match_pokemon(
+            name, language, ability, types
+        )
 
         # Raise a warning if the OCRed text didn't closely match any stored
         # value.
         if match_value > len(text)/3:
             self.log('WARNING: could not find a good match for Pokemon: "'+text+'"')
+            self.record_event('identification warning')
+            if reads is not None and self.identification_vote_frames > 0:
+                return await self.vote_on_pokemon(reads, language,
+                    (name, ability, types)
+                )
 
-
-        self.log('OCRed Pokemon '+text+' matched to rental Pokemon '+matched_text+' with distance of '+str(match_value)) # DEBUG
+        self.log('OCRed Pokemon '+text+' matched to rental Pokemon '+matched_text+' with distance of '+str(match_value)+' (margin '+str(margin)+')') # DEBUG
 
         # finally, return the Pokemon that matched best with the OCRed text
         return best_match
 
-    def read_selectable_pokemon(self,
+    def get_pokemon_reads(self,
+                          stage: str) -> List[Tuple]:
+        """Return how each Pokemon shown during a stage is read.
+
+        Each Pokemon is described by a tuple of (name read, ability read,
+        type rectangles), where each read is a tuple of (rectangle, invert,
+        OCR profile, keep only the last line) or None if it isn't read.
+        """
+        if stage == 'join':
+            return [((self.sel_rect_1, True, self.name_ocr, False),
+                     (self.abil_rect_1, True, self.ability_ocr, False), ()),
+                    ((self.sel_rect_2, False, self.name_ocr, False),
+                     (self.abil_rect_2, False, self.ability_ocr, False), ()),
+                    ((self.sel_rect_3, False, self.name_block_ocr, False),
+                     (self.abil_rect_3, False, self.ability_block_ocr, False), ())]
+        elif stage == 'catch':
+            return [((self.sel_rect_4, False, self.name_block_ocr, True),
+                     (self.abil_rect_4, False, self.ability_block_ocr, False), ())]
+        elif stage == 'battle':
+            return [((self.sel_rect_5, False, self.name_ocr, False), None,
+                     (self.type_rect_1, self.type_rect_2))]
+        return []
+
+    def prepare_pokemon_read(self,
+                             img: Image,
+                             read: Tuple,
+                             alternative: bool=False) -> Tuple[Image, str]:
+        """Preprocess a section of an image for one of the reads returned by
+        get_pokemon_reads, returning the image and Tesseract configuration.
+
+        The alternative preprocessing isolates white text before reading. New
+        arrays are allocated so the result can be read on another thread.
+        """
+        rect, invert, profile, _ = read
+        frame_height = img.shape[0]
+        img = image_processing.preprocess_section(img, rect, alternative,
+            invert or alternative
+        )
+        return (profile.prepare(img, frame_height),
+            profile.get_config(frame_height))
+
+    def finish_pokemon_read(self,
+                            text: str,
+                            read: Tuple) -> str:
+        """Tidy the OCRed text from one of the reads returned by
+        get_pokemon_reads.
+        """
+        text = text.strip()
+        return text.split('\n')[-1] if read[3] else text
+
+    async def read_pokemon_text(self,
+                          img: Image,
+                          read: Tuple) -> str:
+        """Read the text for one of the reads returned by get_pokemon_reads."""
+        if read is None:
+            return ''
+        rect, invert, profile, _ = read
+        return self.finish_pokemon_read(await self.read_text(img, rect,
+            threshold=False, invert=invert, profile=profile), read
+        )
+
+    async def read_selectable_pokemon(self,
                                 stage: str,
                                 language: str) -> List[Pokemon]:
         """Return a list of available Pokemon names."""
         # Fetch the image from the Switch output.
         image = self.get_frame()
 
-        # Get a list of Pokemon names present, depending on stage.
-        pokemon_names = []
-        abilities = []
-        types = []
-        if stage == 'join':
-            pokemon_names.append(self.read_text(image, self.sel_rect_1, threshold=False, invert=True, segmentation_mode='--psm 8').strip())
-            pokemon_names.append(self.read_text(image, self.sel_rect_2, threshold=False, segmentation_mode='--psm 8').strip())
-            pokemon_names.append(self.read_text(image, self.sel_rect_3, threshold=False, segmentation_mode='--psm 3').strip()) # This last name shifts around between runs necessitating a bigger rectangle and different text segmentation mode
-            abilities.append(self.read_text(image, self.abil_rect_1, threshold=False, invert=True, segmentation_mode='--psm 8').strip())
-            abilities.append(self.read_text(image, self.abil_rect_2, threshold=False, segmentation_mode='--psm 8').strip())
-            abilities.append(self.read_text(image, self.abil_rect_3, threshold=False, segmentation_mode='--psm 3').strip())
-            types = ['','','']
-        elif stage == 'catch':
-            pokemon_names.append(self.read_text(image, self.sel_rect_4, threshold=False, segmentation_mode='--psm 3').strip().split('\n')[-1])
-            abilities.append(self.read_text(image, self.abil_rect_4, threshold=False, segmentation_mode='--psm 3').strip())
-            types.append('')
-        elif stage == 'battle':
-            pokemon_names.append(self.read_text(image, self.sel_rect_5, threshold=False, invert=False, segmentation_mode='--psm 8').strip())
-            abilities.append('')
-            type_1 = self.read_text(image, self.type_rect_1, threshold=False, invert=True, language=self.tesseract_language, segmentation_mode='--psm 8').strip().title()
-            type_2 = self.read_text(image, self.type_rect_2, threshold=False, invert=True, language=self.tesseract_language, segmentation_mode='--psm 8').strip().title()
-            types.append(type_1+type_2)
+        # Read the names, abilities, and types of every Pokemon present,
+        # depending on stage, at the same time.
+        all_reads = self.get_pokemon_reads(stage)
+        texts = await asyncio.gather(*(self.read_pokemon_text(image, read)
+            for reads in all_reads for read in reads[:2]), *(self.read_types(
+            image, reads[2], language) for reads in all_reads))
 
-        # Identify the Pokemon based on its name and ability/types, where
+        # Identify each Pokemon based on its name and ability/types, where
         # relevant.
         pokemon_list = []
-        for i in range(len(pokemon_names)):
-            pokemon_list.append(self.identify_pokemon(pokemon_names[i],
-                language, abilities[i], types[i])
+        for i, reads in enumerate(all_reads):
+            name, ability = texts[2*i:2*i + 2]
+            types = texts[2*len(all_reads) + i]
+            pokemon_list.append(await self.identify_pokemon(name, language,
+                ability, types, reads)
             )
 
         # Return the list of Pokemon.
         return pokemon_list
 
+    async def vote_on_pokemon(self,
+                        reads: Tuple,
+                        language: str,
+                        first_read: Tuple[str, str, str]) -> Pokemon:
+        """Identify a Pokemon that could not be matched confidently by reading
+        it from several more frames and voting on the best match.
+
+        Each extra frame is read both normally and with alternative
+        preprocessing. All reads run concurrently and any that are not done
+        within the time limit are ignored. Reads still pending when voting
+        ends, or when this is cancelled, are cancelled so they don't hold up
+        the OCR thread pool; the pool itself is shut down by close().
+        """
+        name_read, ability_read, type_rects = reads
+        self.log('Reading more frames to identify the Pokemon...')
+        start_time = time.time()
+
+        # Grab and preprocess the extra frames, then hand the images to
+        # Tesseract in parallel.
+        jobs = []
+        for __ in range(self.identification_vote_frames):
+            image = await self.get_new_frame()
+            types = await self.read_types(image, type_rects, language)
+            for alternative in (False, True):
+                name_job = self.prepare_pokemon_read(image, name_read, alternative)
+                ability_job = (None if ability_read is None else
+                    self.prepare_pokemon_read(image, ability_read, alternative))
+                jobs.append((name_job, ability_job, types))
+
+        futures = []
+        pending = []
+        try:
+            for name_job, ability_job, types in jobs:
+                futures.append((
+                    asyncio.ensure_future(self.run_tesseract(name_job[0],
+                        config=name_job[1])),
+                    None if ability_job is None else asyncio.ensure_future(
+                        self.run_tesseract(ability_job[0], config=ability_job[1])),
+                    types
+                ))
+                pending.extend(future for future in futures[-1][:2]
+                    if future is not None)
+            await asyncio.wait(pending, timeout=self.identification_vote_timeout)
+        finally:
+            # Reads that didn't finish in time are ignored.
+            for future in pending:
+                future.cancel()
+
+        # Match every completed read, including the original one, and tally
+        # the votes for each Pokemon.
+        candidates = [first_read]
+        for name_future, ability_future, types in futures:
+            # Cancelled reads may not have finished cancelling yet.
+            if any(future is not None and (not future.done()
+                    or future.cancelled() or future.exception() is not None)
+                    for future in (name_future, ability_future)):
+                continue
+            name = self.finish_pokemon_read(name_future.result(), name_read)
+            ability = ('' if ability_future is None else
+                self.finish_pokemon_read(ability_future.result(), ability_read))
+            candidates.append((name, ability, types))
+        votes = {}
+        for name, ability, types in candidates:
+            pokemon, distance, margin, text, _ = self.match_pokemon(name,
+                language, ability, types
+            )
+            count, total_distance, best_margin = votes.get(pokemon.name, (0, 0, 0))
+            votes[pokemon.name] = (count + 1, total_distance + distance,
+                max(best_margin, margin))
+
+        # The Pokemon with the most votes wins, breaking ties using the total
+        # distance of its matches.
+        winner = min(votes, key=lambda name: (-votes[name][0], votes[name][1]))
+        count, total_distance, margin = votes[winner]
+        self.log('Voted on Pokemon ' + winner + ' with ' + str(count) + ' of '
+            + str(len(candidates)) + ' votes (mean distance %0.1f, best margin %i'
+            % (total_distance / count, margin) + ') in %0.2f s'
+            % (time.time() - start_time)
+        )
+        return self.rental_pokemon[winner]
+
     def check_rect_HSV_match(self,
                             rect: Tuple[Tuple[float, float], Tuple[float, float]],
                             lower_threshold: Tuple[int, int, int],
                             upper_threshold: Tuple[int, int, int],
-                            mean_value_threshold: int) -> bool:
-        """Check a specified section of the screen for values within a certain HSV range."""
-        # Fetch, convert, crop, and threshold image so the feature of interest
+                            mean_value_threshold: int,
+                            img: Image=None) -> bool:
+        """Check a specified section of the screen (or of an image, if one is
+        supplied) for values within a certain HSV range.
+        """
+        if img is None:
+            img = self.get_frame()
+        # Crop, convert, and threshold the image so the feature of interest
         # is white (value 255) and everything else appears black (0)
-        img = cv2.cvtColor(self.get_frame(), cv2.COLOR_BGR2HSV)
-        h, w = img.shape[:2]
-        cropped_area = img[round(rect[0][1]*h):round(rect[1][1]*h),
-                         round(rect[0][0]*w):round(rect[1][0]*w)]
+        cropped_area = image_processing.crop_hsv(img, rect, self.roi_buffers)
+        mask = image_processing.get_buffer(self.roi_buffers, (rect, 'mask'),
+            cropped_area.shape[:2]
+        )
         measured_value = cv2.inRange(cropped_area, lower_threshold,
-            upper_threshold).mean()
+            upper_threshold, dst=mask).mean()
 
         # Return True if the mean value is above the supplied threshold
         return measured_value > mean_value_threshold
@@ -352,15 +823,193 @@ class MaxLairInstance():
             (180, 50, 255), 10
         )
 
+    def card_text_shown(self,
+                        *rects: Tuple[Tuple[float, float], Tuple[float, float]],
+                        card_threshold: int=128,
+                        text_range: Tuple[int, int]=(5, 115)) -> Callable[[Image], bool]:
+        """Return a condition for wait_until that every rectangle shows dark
+        text on one of the game's light cards: mostly card (mean mask value
+        above card_threshold) with some dark text (mean mask value within
+        text_range). A blank card or a white flash has no dark text, and
+        white text on a dark background has no card.
+        """
+        def shown(img):
+            for rect in rects:
+                hsv = image_processing.crop_hsv(img, rect, self.roi_buffers)
+                card = cv2.inRange(hsv, image_processing.CARD_LOWER_HSV,
+                    image_processing.CARD_UPPER_HSV).mean()
+                text = cv2.inRange(hsv, image_processing.DARK_TEXT_LOWER_HSV,
+                    image_processing.DARK_TEXT_UPPER_HSV).mean()
+                if card <= card_threshold or not text_range[0] < text < text_range[1]:
+                    return False
+            return True
+        return shown
+
+    def dialog_matches(self,
+                       phrase: str) -> Callable[[Image], Awaitable[bool]]:
+        """Return a condition for wait_until that the dialogue box shows one
+        of the configured phrases (e.g. 'PATH'). Tesseract only runs when the
+        box contains lines of text.
+        """
+        async def matches(img):
+            return re.search(self.phrases[phrase], await self.read_dialog_text(
+                img, language=self.tesseract_language)) is not None
+        return matches
+
+    def screen_settled(self,
+                       rect: Tuple[Tuple[float, float], Tuple[float, float]]=((0,0),(1,1)),
+                       change_threshold: float=8,
+                       still_threshold: float=2,
+                       dark_threshold: float=20) -> Callable[[Image], bool]:
+        """Return a condition for wait_until that a section of the screen has
+        changed since this was called and is now still and not dark, i.e. a
+        transition has finished. Create it before pushing the button that
+        starts the transition.
+        """
+        reference = self.get_thumbnail(rect)
+        state = {'changed': False, 'previous': reference}
+
+        def settled(img):
+            thumbnail = image_processing.get_thumbnail(img, rect)
+            if not state['changed']:
+                state['changed'] = cv2.absdiff(thumbnail, reference).mean() > change_threshold
+            still = cv2.absdiff(thumbnail, state['previous']).mean() < still_threshold
+            state['previous'] = thumbnail
+            return state['changed'] and still and thumbnail.mean() > dark_threshold
+        return settled
+
+    async def wait_until(self,
+                   condition: Callable[[Image], bool],
+                   timeout,
+                   min_wait: float=0,
+                   settle: float=0,
+                   poll_interval: float=0.1) -> bool:
+        """Wait until a visual condition is met, in place of a fixed delay
+        sized for the worst case (timeout, in seconds or the name of a delay
+        in the timing profile).
+
+        The condition is checked on new frames, at most every poll_interval
+        seconds, once min_wait seconds have passed, and must hold for settle
+        seconds. The condition may be a coroutine function. Return whether it
+        was met before the timeout.
+        """
+        start = time.time()
+        met = await self.poll_condition(condition, self.timing.seconds(timeout),
+            min_wait, settle, poll_interval
+        )
+        if self.observe_timing and isinstance(timeout, str):
+            # Not an observation: the delay is the longest the wait can take.
+            self.log('Timing: %s %s after %.2f s of %.2f s' % (timeout,
+                'condition met' if met else 'timed out', time.time() - start,
+                self.timing[timeout]))
+        return met
+
+    async def poll_condition(self,
+                       condition: Callable[[Image], bool],
+                       timeout: float,
+                       min_wait: float,
+                       settle: float,
+                       poll_interval: float) -> bool:
+        """Check a condition for wait_until until it is met or times out."""
+        start = time.time()
+        met_since = None
+        while True:
+            elapsed = time.time() - start
+            if elapsed >= timeout:
+                return False
+            if not self.visual_waits:
+                delay = timeout - elapsed
+            elif elapsed < min_wait:
+                delay = min_wait - elapsed
+            else:
+                met = condition(await self.get_new_frame())
+                if asyncio.iscoroutine(met):
+                    met = await met
+                if met:
+                    if met_since is None:
+                        met_since = time.time()
+                    if time.time() - met_since >= settle:
+                        self.wait_time_saved += max(0, timeout - (time.time() - start))
+                        return True
+                else:
+                    met_since = None
+                delay = min(poll_interval, timeout - (time.time() - start))
+            await asyncio.sleep(max(0, delay))
+
     def get_target_ball(self) -> str:
         """Return the name of the Poke Ball needed."""
         return self.base_ball if self.num_caught < 3 else self.legendary_ball
 
-    def check_ball(self) -> str:
+    async def check_ball(self) -> str:
         """Detect the currently selected Poke Ball during the catch phase of the game."""
-        return self.read_text(self.get_frame(), self.ball_rect, threshold=False,
-            invert=True, language='eng', segmentation_mode='--psm 8').strip()
+        return (await self.read_text(self.get_frame(), self.ball_rect, threshold=False,
+            invert=True, language='eng', profile=self.ball_ocr)).strip()
         
+    async def press_ball_wheel(self,
+                               presses: int) -> None:
+        """Move left along the ball wheel in one burst of presses."""
+        await self.push_buttons(*([(b'<', 'catch.next_ball_fast')] * (presses - 1)),
+            (b'<', 'catch.next_ball'))
+
+    async def select_ball(self) -> None:
+        """Navigate to the target ball on the ball selection wheel.
+
+        When the learned order of the wheel tells how far away the target
+        is, the presses are sent as one burst which is verified at the end.
+        Otherwise the balls already learned are skipped in a burst and the
+        rest of the wheel is stepped through one ball at a time (learning its
+        order) until the target ball appears or the wheel wraps around.
+        """
+        target = self.get_target_ball()
+        if target == 'DEFAULT':
+            return
+        current = await self.check_ball()
+        if target in current:
+            return
+
+        wheel = self.ball_wheel
+        presses = wheel.count_presses(current, target)
+        if presses > 0:
+            await self.press_ball_wheel(presses)
+            current = await self.check_ball()
+            if target in current:
+                return
+            # The wheel changed (e.g. a type of ball ran out) so forget the
+            # learned order.
+            self.log('WARNING: ' + target + ' was not found after ' + str(presses)
+                + ' presses. Relearning the ball order.'
+            )
+            self.record_event('ball warning')
+            wheel.reset()
+
+        position = wheel.locate(current)
+        last = len(wheel.order) - 1
+        if not wheel.complete and position < last:
+            # The target isn't among the balls learned after this one, so
+            # skip to the last of them before learning more.
+            await self.press_ball_wheel(last - position)
+            current = await self.check_ball()
+            if wheel.find(current) == last:
+                position = last
+            else:
+                wheel.reset()
+                position = wheel.locate(current)
+
+        # Step through the wheel, extending the learned order as we go.
+        while target not in current:
+            await self.push_buttons((b'<', 'catch.next_ball'))
+            current = await self.check_ball()
+            position = wheel.record_step(position, current)
+            presses = wheel.count_presses(current, target)
+            if wheel.complete and presses > 0:
+                # The wheel has wrapped around, so the rest of the way is
+                # known.
+                await self.press_ball_wheel(presses)
+                current = await self.check_ball()
+                if target not in current:
+                    wheel.reset()
+                position = wheel.locate(current)
+
     def record_ball_use(self) -> None:
         """Decrement the number of balls in the inventory and increment the number of pokemon caught."""
         if self.base_ball == self.legendary_ball:
@@ -371,6 +1020,7 @@ class MaxLairInstance():
         else:
             self.legendary_balls -= 1
         self.num_caught += 1
+        self.stats_dirty = True
 
     def check_sufficient_balls(self) -> bool:
         """Calculate whether sufficient balls remain for another run."""
@@ -385,6 +1035,7 @@ class MaxLairInstance():
             + (2 if self.lives == 4 else 0)
         )
         self.dynite_ore = min(self.dynite_ore, 999)
+        self.stats_dirty = True
 
     def calculate_ore_cost(self, num_resets: int) -> int:
         """Calculate the prospective Dynite Ore cost of resetting the game."""
@@ -400,34 +1051,154 @@ class MaxLairInstance():
         self.legendary_balls += 1 if self.num_caught == 4 else 0
         self.consecutive_resets += 1
         self.dynite_ore -= self.calculate_ore_cost(self.consecutive_resets)
+        self.stats_dirty = True
+
+    async def observe_delay(self,
+                      name: str) -> None:
+        """Wait for a named delay while watching the screen, and log how long
+        after the delay started the screen last changed, for tuning the
+        timing profile. Nothing is logged for tuning if it didn't change.
+        """
+        delay = self.timing[name]
+        start = time.time()
+        previous = self.get_thumbnail()
+        settled = 0
+        while time.time() - start < delay:
+            await asyncio.sleep(min(0.05, max(0, delay - (time.time() - start))))
+            thumbnail = await self.get_new_thumbnail()
+            if cv2.absdiff(thumbnail, previous).mean() > timing_profiles.CHANGE_THRESHOLD:
+                settled = min(delay, self.frame_timestamp - start)
+            previous = thumbnail
+        if settled > 0:
+            self.log(timing_profiles.OBSERVATION_FORMAT % (name, settled, delay))
+        else:
+            self.log('Timing: %s showed no change in %.2f s' % (name, delay))
+
+    async def push_buttons(self, *commands: Tuple[str, float]) -> None:
+        """Send messages to the microcontroller telling it to press buttons on the Switch.
 
-    def push_buttons(self, *commands: Tuple[str, float]) -> None:
-        """Send messages to the microcontroller telling it to press buttons on the Switch."""
+        Each delay is given in seconds or as the name of a delay in the
+        timing profile.
+        """
+        if self.observe_timing and any(isinstance(delay, str)
+                for _, delay in commands):
+            for character, delay in commands:
+                if isinstance(delay, str):
+                    await self.push_buttons((character, 0))
+                    await self.observe_delay(delay)
+                else:
+                    await self.push_buttons((character, delay))
+            return
+        commands = self.timing.resolve(commands)
+        if self.serial_writer.running:
+            await self.queue_buttons(*commands)
+            await self.wait_for_buttons()
+            return
+        if self.batch_buttons:
+            await self.push_button_sequence(commands)
+            return
         # Commands are supplied as tuples consisting of a character corresponding to a button push and a delay that follows the push
+        loop = asyncio.get_running_loop()
         for character, duration in commands:
-            # Check whether the main thread has called for the button pushing thread to terminate
-            if self.exit_flag.is_set():
-                sys.exit()
+            # Send the command to the microcontroller, waiting for its echo
+            # off the event loop.
+            await loop.run_in_executor(None, self.send_command, character)
+
+            # then we delay for the specified time
+            await asyncio.sleep(duration)
+
+    def send_command(self,
+                     character: bytes) -> None:
+        """Send one button push to the microcontroller and check that it is
+        echoed back.
+        """
+        # Clear extra characters from the serial buffer
+        self.com.reset_input_buffer()
 
-            # then we release the lock so the display thread can run while we complete the button press and subsequent delay
-            self.lock.release()
+        # then we send the command to the microcontroller using the serial port
+        self.com.write(character)
 
-            # Clear extra characters from the serial buffer
+        # then we check whether the microcontroller successfully echoed back the command, and raise a warning if it did not
+        if self.com.read() != character:
+            self.log('WARNING: Sent command was not echoed back successfully.')
+
+    async def push_button_sequence(self,
+                             commands: Tuple[Tuple[str, float], ...]) -> None:
+        """Send button pushes to the microcontroller as sequences that it
+        times itself, waiting for each sequence to be acknowledged.
+        """
+        loop = asyncio.get_running_loop()
+        for sequence in serial_protocol.split_sequence(commands):
             self.com.reset_input_buffer()
-            
-            # then we send the command to the microcontroller using the serial port
-            self.com.write(character)
+            self.com.write(serial_protocol.encode_sequence(sequence))
+            # The acknowledgement arrives after the last button's delay, so
+            # sleep through the sequence before waiting for it.
+            await asyncio.sleep(serial_protocol.sequence_duration(sequence))
+            await loop.run_in_executor(None, self.read_acknowledgement)
 
-            # then we check whether the microcontroller successfully echoed back the command, and raise a warning if it did not
-            if self.com.read() != character:
-                self.log('WARNING: Sent command was not echoed back successfully.')
+    def read_acknowledgement(self,
+                             timeout: float=1) -> None:
+        """Wait for the microcontroller to acknowledge a sequence, allowing
+        some slack for the transfer.
+        """
+        deadline = time.time() + timeout
+        reply = b''
+        while reply not in (serial_protocol.SEQUENCE_ACK,
+                serial_protocol.SEQUENCE_NAK) and time.time() < deadline:
+            reply = self.com.read()
+        if reply != serial_protocol.SEQUENCE_ACK:
+            self.log('WARNING: Button sequence was not acknowledged successfully.')
 
-            # then we delay for the specified time
-            time.sleep(duration)
+    async def queue_buttons(self, *commands: Tuple[str, float]) -> None:
+        """Queue button pushes for the serial writer without waiting for them,
+        where the next action doesn't depend on them having happened. Buttons
+        are pushed directly if the writer isn't running.
+        """
+        if not self.serial_writer.running or self.observe_timing:
+            await self.push_buttons(*commands)
+            return
+        self.serial_writer.send(self.timing.resolve(commands), self.batch_buttons)
+
+    async def wait_for_buttons(self) -> None:
+        """Wait until every queued button push and its delay has finished."""
+        loop = asyncio.get_running_loop()
+        idle = loop.create_future()
+
+        def set_idle():
+            if not idle.done():
+                idle.set_result(None)
+
+        def notify():
+            loop.call_soon_threadsafe(set_idle)
+        self.serial_writer.notify_when_idle(notify)
+        try:
+            await idle
+        finally:
+            # Don't notify the loop after this was cancelled (or it closed).
+            self.serial_writer.forget_idle_callback(notify)
 
-            # then we reacquire the lock before the next iteration
-            #   This step is needed here because calling sys.exit() in a subsequent iteration will attempt to release the lock.
-            self.lock.acquire()
+    def close(self,
+              timeout: float=10) -> None:
+        """Stop the background helpers, giving them timeout seconds in total,
+        and log their final state. Queued OCR jobs are cancelled, and helpers
+        that don't stop in time are left to exit with the process.
+        """
+        deadline = time.time() + timeout
+        self.ocr_executor.shutdown(wait=False, cancel_futures=True)
+        serial_writer_used = self.serial_writer.running
+        # The clip recorder samples the frame grabber, so it is stopped first.
+        for name, helper in (('Clip recorder', self.clip_recorder),
+                ('Frame grabber', self.frame_grabber),
+                ('Serial writer', self.serial_writer)):
+            if helper is None or not helper.running:
+                continue
+            if not helper.stop(max(0, deadline - time.time())):
+                self.log('WARNING: ' + name + ' did not stop within %g s.'
+                    % timeout)
+        if self.clip_recorder is not None:
+            self.log('Clips saved: ' + str(self.clip_recorder.num_clips))
+        if serial_writer_used:
+            self.log('Serial: ' + str(self.serial_writer))
 
     def log(self,
             string: str='') -> None:
@@ -436,41 +1207,75 @@ class MaxLairInstance():
             file.write(datetime.now().strftime('%Y-%m-%d %H:%M:%S')+'\t'+string+'\n')
         print(string)
         
-    def display_results(self, log=False, screenshot=False):
-        """Display video from the Switch alongside some annotations describing the run sequence."""
-        # Calculate some statistics for display        
+    def record_event(self,
+                     event: str,
+                     screenshot: bool=False) -> None:
+        """Save a clip of the video around an event if clips are being
+        recorded, and a screenshot if requested.
+        """
+        if self.clip_recorder is not None:
+            self.clip_recorder.trigger(event)
+        if screenshot:
+            # The display thread saves the next frame it shows.
+            self.screenshot_requested = True
+
+    def get_stats(self) -> List[Tuple[str, str]]:
+        """Return a snapshot of the statistics describing the run sequence as
+        (label, value) pairs.
+        """
         win_percent = 'N/A' if self.runs == 0 else round(100 * self.wins / self.runs)
         time_per_run = 'N/A' if self.runs == 0 else str((datetime.now() - self.start_date) / self.runs)[2:7]
+        stats = [('Run #', str(self.runs + 1)), ('Hunting for: ', self.boss),
+            ('Stage: ', self.stage), ('Base balls: ', str(self.base_balls)),
+            ('Legendary balls: ', str(self.legendary_balls)),
+            ('Pokemon caught: ', str(self.num_caught)), ('Lives: ', str(self.lives)),
+            ('Pokemon: ', str(self.pokemon)), ('Opponent: ', str(self.opponent)),
+            ('Win percentage: ', str(win_percent) + '%'),
+            ('Time per run: ', time_per_run),
+            ('Shinies found: ', str(self.shinies_found)),
+            ('Dynite Ore: ', str(self.dynite_ore)),
+            ('Wait time saved: ', str(round(self.wait_time_saved)) + ' s')]
+        for i, shiny in enumerate(list(self.caught_shinies)):
+            stats.append(('shiny #' + str(i) + ': ', shiny))
+        return stats
 
-        # Expand the image with blank space for writing results
-        frame = cv2.copyMakeBorder(cv2.resize(self.get_frame(stage=self.stage), self.display_resolution), 0, 0, 0, 250, cv2.BORDER_CONSTANT)
-        width = frame.shape[1]
-
-        # Construct arrays of text and values to display
-        labels_as_list = [
-        'Run #', 'Hunting for: ', 'Stage: ', 'Base balls: ', 'Legendary balls: ', 'Pokemon caught: ', 'Lives: ', 'Pokemon: ',
-        'Opponent: ', 'Win percentage: ', 'Time per run: ', 'Shinies found: ', 'Dynite Ore: ']
-        values_as_list = [str(self.runs + 1), self.boss, self.stage, str(self.base_balls), str(self.legendary_balls),
-                str(self.num_caught), str(self.lives), str(self.pokemon), str(self.opponent), str(win_percent) + '%', time_per_run,
-                str(self.shinies_found), str(self.dynite_ore)]
+    def acquire_display_frame(self) -> HeldFrame:
+        """Hold the newest frame for the display without disturbing the
+        stages: the grabber's newest frame, in place, if it is running, or
+        else the last frame the stages read. Release it once it is drawn.
+        """
+        if self.frame_grabber.running:
+            return self.frame_grabber.acquire_frame()
+        return HeldFrame(self.frame_timestamp, self.latest_frame)
 
-        for i in range(len(self.caught_shinies)):
-            labels_as_list.append('shiny #' + str(i) + ': ')
-            values_as_list.append(self.caught_shinies[i])
+    def display_results(self, log=False, screenshot=False):
+        """Display video from the Switch alongside some annotations describing the run sequence.
 
-        labels = tuple(labels_as_list)
-        values = tuple(values_as_list)
+        The display is independent of the control coroutines: it only uses
+        the newest published frame and a snapshot of the statistics, which is
+        redrawn only when they change.
+        """
+        if log:
+            for label, value in self.get_stats():
+                self.log(label + value)
+        if self.screenshot_requested:
+            self.screenshot_requested = False
+            screenshot = True
+        if self.headless and not (log or screenshot):
+            return
 
-        for i in range(len(labels)):
-            cv2.putText(frame, labels[i] + values[i], (width - 245, 25 + 25 * i), cv2.FONT_HERSHEY_PLAIN, 1,
-                        (255, 255, 255), 2, cv2.LINE_AA)
-            if log:
-                self.log(labels[i] + values[i])
+        # Render the image alongside the statistics, which copies it into the
+        # display buffer so it can be released.
+        with self.acquire_display_frame() as held:
+            if held.frame is None:
+                return
+            frame = self.render_display_frame(held.frame)
 
         # Display
-        cv2.imshow('Output', frame)
-        
+        if not self.headless:
+            cv2.imshow('Output', frame)
+
         if log or screenshot:
             # Save a screenshot
             self.num_saved_images += 1
-            cv2.imwrite(self.filename[:-8] + '_cap_'+str(self.num_saved_images)+'.png', frame)
\ No newline at end of file
+            cv2.imwrite(self.filename[:-8] + '_cap_'+str(self.num_saved_images)+'.png', frame)
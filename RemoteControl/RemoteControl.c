@@ -23,14 +23,49 @@ This project is based on auto-controller code written by brianuuuuSonic
 */
 
 #include <avr/io.h>
+#include <avr/interrupt.h>
 #include <avr/pgmspace.h>
 #include <stdint.h>
+#include <util/atomic.h>
 #include "../../Joystick.h"
 #include "Config.h"
 #include "uart.h"
 
 #define CPU_PRESCALE(n) (CLKPR = 0x80, CLKPR = (n))
 
+// Button sequences are sent by the computer as a frame:
+//	SEQUENCE_START, count, count * (button, duration low byte, duration high
+//	byte), checksum, SEQUENCE_END
+// where durations are in units of 10 ms and the checksum is the XOR of the
+// count and every entry byte. Each button is pressed in turn, waiting its
+// duration after pressing it, and SEQUENCE_ACK is sent once the last
+// duration has elapsed. SEQUENCE_NAK is sent instead if the frame is
+// malformed, arrives while another sequence is running, or stops arriving for
+// RECEIVE_TIMEOUT_MS; the rest of a rejected frame is ignored up to its
+// SEQUENCE_END (or until nothing arrives for RECEIVE_TIMEOUT_MS).
+// Any other character is a single button press that is echoed back.
+#define SEQUENCE_START '{'
+#define SEQUENCE_END '}'
+#define SEQUENCE_ACK '!'
+#define SEQUENCE_NAK '?'
+#define MAX_SEQUENCE_LENGTH 20
+#define RECEIVE_TIMEOUT_MS 50
+
+// Milliseconds since startup, counted by Timer0.
+volatile uint32_t milliseconds = 0;
+
+ISR(TIMER0_COMPA_vect) {
+	milliseconds++;
+}
+
+uint32_t GetMilliseconds(void) {
+	uint32_t now;
+	ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+		now = milliseconds;
+	}
+	return now;
+}
+
 // Main entry point.
 int main(void) {
 	// We'll start by performing hardware and peripheral setup.
@@ -60,6 +95,12 @@ void SetupHardware(void) {
 	// We can then initialize our hardware and peripherals, including the USB stack.
 	CPU_PRESCALE(0);  // run at 16 MHz
 	uart_init(9600);
+	// Timer0 interrupts every millisecond (16 MHz / 64 / 250) to time button
+	// sequences.
+	TCCR0A = (1 << WGM01);
+	TCCR0B = (1 << CS01) | (1 << CS00);
+	OCR0A = 249;
+	TIMSK0 = (1 << OCIE0A);
 	#ifdef ALERT_WHEN_DONE
 	// Both PORTD and PORTB will be used for the optional LED flashing and buzzer.
 	#warning LED and Buzzer functionality enabled. All pins on both PORTB and \
@@ -109,6 +150,141 @@ typedef enum {
 State_t state = PROCESS;
 char received_command = 'a';
 
+typedef enum {
+	RX_COMMAND,
+	RX_COUNT,
+	RX_BUTTON,
+	RX_DURATION_LOW,
+	RX_DURATION_HIGH,
+	RX_CHECKSUM,
+	RX_END,
+	RX_DISCARD
+} ReceiveState_t;
+ReceiveState_t receive_state = RX_COMMAND;
+uint32_t last_receive_time = 0;
+
+// The button sequence being received or run
+char sequence_buttons[MAX_SEQUENCE_LENGTH];
+uint16_t sequence_durations[MAX_SEQUENCE_LENGTH];
+uint8_t sequence_length = 0;
+uint8_t sequence_received = 0;
+uint8_t sequence_checksum = 0;
+uint8_t sequence_index = 0;
+bool sequence_running = false;
+uint32_t next_press_time = 0;
+
+// Reject the sequence frame being received and ignore the rest of it.
+void RejectSequence(void) {
+	receive_state = RX_DISCARD;
+	uart_putchar(SEQUENCE_NAK);
+}
+
+// Give up on a sequence frame whose bytes have stopped arriving, rejecting it
+// unless it was rejected already.
+void CheckReceiveTimeout(void) {
+	if (receive_state == RX_COMMAND
+			|| GetMilliseconds() - last_receive_time < RECEIVE_TIMEOUT_MS)
+		return;
+	if (receive_state != RX_DISCARD)
+		uart_putchar(SEQUENCE_NAK);
+	receive_state = RX_COMMAND;
+}
+
+// Handle one character received from the computer.
+void ReceiveCharacter(uint8_t c) {
+	CheckReceiveTimeout();
+	last_receive_time = GetMilliseconds();
+	switch (receive_state)
+	{
+		case RX_COMMAND:
+			if (c == SEQUENCE_START) {
+				// Only one sequence can run at a time.
+				if (sequence_running)
+					RejectSequence();
+				else
+					receive_state = RX_COUNT;
+			} else {
+				received_command = c;
+				state = PROCESS;
+				uart_putchar(received_command); // DEBUG echo incoming messages back to computer
+			}
+			break;
+
+		case RX_COUNT:
+			if (c == 0 || c > MAX_SEQUENCE_LENGTH) {
+				RejectSequence();
+				break;
+			}
+			sequence_length = c;
+			sequence_received = 0;
+			sequence_checksum = c;
+			receive_state = RX_BUTTON;
+			break;
+
+		case RX_BUTTON:
+			sequence_buttons[sequence_received] = c;
+			sequence_checksum ^= c;
+			receive_state = RX_DURATION_LOW;
+			break;
+
+		case RX_DURATION_LOW:
+			sequence_durations[sequence_received] = c;
+			sequence_checksum ^= c;
+			receive_state = RX_DURATION_HIGH;
+			break;
+
+		case RX_DURATION_HIGH:
+			sequence_durations[sequence_received] |= (uint16_t)c << 8;
+			sequence_checksum ^= c;
+			sequence_received++;
+			receive_state = sequence_received < sequence_length ? RX_BUTTON : RX_CHECKSUM;
+			break;
+
+		case RX_CHECKSUM:
+			if (c == sequence_checksum)
+				receive_state = RX_END;
+			else
+				RejectSequence();
+			break;
+
+		case RX_END:
+			if (c == SEQUENCE_END) {
+				receive_state = RX_COMMAND;
+				sequence_index = 0;
+				sequence_running = true;
+				next_press_time = GetMilliseconds();
+			} else {
+				RejectSequence();
+			}
+			break;
+
+		case RX_DISCARD:
+			if (c == SEQUENCE_END)
+				receive_state = RX_COMMAND;
+			break;
+	}
+}
+
+// Press the next button of a running sequence once the previous button's
+// duration has elapsed, and acknowledge the sequence when it is complete.
+// The computer sends durations of at least 60 ms (MIN_DURATION_UNITS in
+// serial_protocol.py), so a neutral report follows the echoes of each press.
+void RunSequence(void) {
+	// Wait for the previous press to be sent before replacing it.
+	if (!sequence_running || state == PROCESS
+			|| (int32_t)(GetMilliseconds() - next_press_time) < 0)
+		return;
+	if (sequence_index == sequence_length) {
+		sequence_running = false;
+		uart_putchar(SEQUENCE_ACK);
+		return;
+	}
+	received_command = sequence_buttons[sequence_index];
+	state = PROCESS;
+	next_press_time += (uint32_t)sequence_durations[sequence_index] * 10;
+	sequence_index++;
+}
+
 // Process and deliver data from IN and OUT endpoints.
 void HID_Task(void) {
 	// If the device isn't connected and properly configured, we can't do anything here.
@@ -150,14 +326,12 @@ void HID_Task(void) {
 		Endpoint_ClearIN();
 	}
 	// Lastly we'll check the serial port for incoming messages from the computer
-	while (uart_available() > 1) {
-		uart_getchar();
-	}
-	if (uart_available()) {
-		received_command = uart_getchar();
-		state = PROCESS;
-		uart_putchar(received_command); // DEBUG echo incoming messages back to computer
+	// and advance any button sequence that is running.
+	CheckReceiveTimeout();
+	while (uart_available()) {
+		ReceiveCharacter(uart_getchar());
 	}
+	RunSequence();
 }
 
 #define ECHOES 5
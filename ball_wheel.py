@@ -0,0 +1,98 @@
+# Ball Wheel
+#   The order of the Poke Balls on the ball selection wheel in the catch
+#   screen, learned while stepping through it, so that later catches can move
+#   straight to the ball needed.
+
+import enchant
+
+
+def ball_key(name: str) -> str:
+    """Return the part of an OCRed ball name before "Ball"."""
+    return name[:-4].strip() if len(name) > 4 else name
+
+
+class BallWheel():
+    """The balls seen on the wheel in the order they appear when pressing
+    left, as OCRed. The order is complete once the wheel has wrapped around
+    to the first ball seen.
+    """
+    def __init__(self) -> None:
+        self.order = []
+        self.complete = False
+
+    def reset(self) -> None:
+        """Forget the learned order, e.g. because the wheel changed."""
+        self.order = []
+        self.complete = False
+
+    def find(self,
+             name: str) -> int:
+        """Return the index of the closest match to an OCRed ball name in the
+        learned order, or -1 if there is no good match.
+
+        Only the part of the names before "Ball" is compared, since the
+        shared suffix would let different balls (e.g. Beast Ball and Great
+        Ball) pass for one another.
+        """
+        key = ball_key(name)
+        best_index = -1
+        best_distance = len(key) / 3
+        for i, ball in enumerate(self.order):
+            distance = enchant.utils.levenshtein(key, ball_key(ball))
+            if distance < best_distance:
+                best_index = i
+                best_distance = distance
+        return best_index
+
+    def count_presses(self,
+                      current: str,
+                      target: str) -> int:
+        """Return the number of left presses needed to move from the current
+        ball to the target ball, or -1 if the learned order can't tell (e.g.
+        the target is behind the current ball and the order isn't complete,
+        so the number of unseen balls in between is unknown).
+        """
+        start = self.find(current)
+        end = -1
+        for i, ball in enumerate(self.order):
+            if target in ball:
+                end = i
+                break
+        if start == -1 or end == -1:
+            return -1
+        if self.complete:
+            return (end - start) % len(self.order)
+        return end - start if end >= start else -1
+
+    def locate(self,
+               current: str) -> int:
+        """Return the position of the current ball in the learned order,
+        starting a new order from it if it isn't there.
+        """
+        position = self.find(current)
+        if position == -1:
+            self.order = [current]
+            self.complete = False
+            position = 0
+        return position
+
+    def record_step(self,
+                    position: int,
+                    current: str) -> int:
+        """Record the ball reached by pressing left once from a position and
+        return its position.
+        """
+        if self.complete:
+            return (position + 1) % len(self.order)
+        position += 1
+        if position < len(self.order):
+            if self.find(current) != position:
+                # The learned order is inconsistent so start again here.
+                self.order = [current]
+                return 0
+        elif self.find(current) == 0:
+            self.complete = True
+            return 0
+        else:
+            self.order.append(current)
+        return position
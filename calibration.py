@@ -0,0 +1,247 @@
+# Calibration
+#   Locate fixed anchors in captured frames and correct the rectangles used for
+#   detection when a capture card shifts, scales, or overscans the picture.
+#
+#   Anchor templates can be cut from a correctly aligned reference frame with:
+#       python calibration.py reference.png anchor_name x0 y0 x1 y1
+#   where the coordinates are fractions of the frame size.
+
+import json
+import os
+import sys
+import cv2
+import numpy
+from typing import TypeVar, Dict, List, Tuple
+Image = TypeVar('cv2 image')
+Rectangle = Tuple[Tuple[float, float], Tuple[float, float]]
+
+# Pixels darker than this are considered to be outside the game picture.
+BORDER_THRESHOLD = 16
+# Minimum normalized correlation for an anchor template to count as found.
+MATCH_THRESHOLD = 0.8
+# Limits on a measured correction. Capture cards overscan or shift the
+# picture by a few percent; anything larger is more likely a dark scene whose
+# edges were taken for borders, so the measurement is rejected.
+MIN_SCALE = 0.85
+MAX_SCALE = 1.15
+MAX_OFFSET = 0.15
+MAX_ASPECT_CHANGE = 0.03
+
+
+class Calibration():
+    """An axis-aligned affine correction that maps positions in a perfectly
+    aligned frame to positions in the captured frame, both expressed as
+    fractions of the frame size.
+    """
+    def __init__(self,
+                 scale: Tuple[float, float]=(1, 1),
+                 offset: Tuple[float, float]=(0, 0)) -> None:
+        self.scale = tuple(float(value) for value in scale)
+        self.offset = tuple(float(value) for value in offset)
+
+    def __str__(self):
+        return 'scale (%0.4f, %0.4f), offset (%0.4f, %0.4f)' % (self.scale
+            + self.offset)
+
+    def apply_point(self,
+                    point: Tuple[float, float]) -> Tuple[float, float]:
+        """Map a point from the aligned frame to the captured frame."""
+        return (round(self.scale[0]*point[0] + self.offset[0], 4),
+                round(self.scale[1]*point[1] + self.offset[1], 4))
+
+    def apply(self,
+              rect: Rectangle) -> Rectangle:
+        """Map a rectangle from the aligned frame to the captured frame."""
+        return (self.apply_point(rect[0]), self.apply_point(rect[1]))
+
+    def is_plausible(self) -> bool:
+        """Whether this is a correction a capture card could cause: a small
+        change of scale and position that keeps the aspect ratio.
+        """
+        return (all(MIN_SCALE <= scale <= MAX_SCALE for scale in self.scale)
+            and all(abs(offset) <= MAX_OFFSET for offset in self.offset)
+            and abs(self.scale[0] / self.scale[1] - 1) <= MAX_ASPECT_CHANGE)
+
+    def to_dict(self) -> Dict:
+        return {'scale': list(self.scale), 'offset': list(self.offset)}
+
+    @classmethod
+    def from_dict(cls, values: Dict):
+        return cls(values['scale'], values['offset'])
+
+
+def find_picture_area(frames: List[Image]) -> Rectangle:
+    """Find the part of the captured frames occupied by the game picture,
+    ignoring any black borders added by the capture card.
+
+    Several frames are combined so that dark scenes don't shrink the area.
+    """
+    h, w = frames[0].shape[:2]
+    brightest = numpy.max([cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        for frame in frames], axis=0)
+    rows = numpy.flatnonzero(brightest.max(axis=1) > BORDER_THRESHOLD)
+    columns = numpy.flatnonzero(brightest.max(axis=0) > BORDER_THRESHOLD)
+    if len(rows) == 0 or len(columns) == 0:
+        return ((0, 0), (1, 1))
+    return ((columns[0] / w, rows[0] / h),
+            ((columns[-1] + 1) / w, (rows[-1] + 1) / h))
+
+
+def load_anchors(path: str) -> List[Tuple[Image, Rectangle]]:
+    """Load anchor templates listed in an anchors JSON file.
+
+    Each entry gives a template image (relative to the JSON file) and the
+    rectangle it occupies in a perfectly aligned frame.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as file:
+        entries = json.load(file)
+    directory = os.path.dirname(path)
+    anchors = []
+    for entry in entries:
+        template = cv2.imread(os.path.join(directory, entry['template']))
+        if template is not None:
+            rect = tuple(tuple(point) for point in entry['rect'])
+            anchors.append((template, rect))
+    return anchors
+
+
+def locate_anchors(frame: Image,
+                   anchors: List[Tuple[Image, Rectangle]],
+                   estimate: Calibration,
+                   search_margin: float=0.05) -> List[Tuple[Tuple[float, float], Tuple[float, float]]]:
+    """Search for anchor templates near where an initial calibration
+    estimate places them.
+
+    Returns pairs of (aligned position, captured position) for the centre of
+    every anchor found.
+    """
+    h, w = frame.shape[:2]
+    matches = []
+    for template, rect in anchors:
+        # Resize the template to the estimated scale of the captured picture.
+        expected = estimate.apply(rect)
+        width = round((expected[1][0] - expected[0][0]) * w)
+        height = round((expected[1][1] - expected[0][1]) * h)
+        if width < 4 or height < 4:
+            continue
+        template = cv2.resize(template, (width, height))
+
+        # Only search a window around the expected position.
+        left = max(0, round((expected[0][0] - search_margin) * w))
+        top = max(0, round((expected[0][1] - search_margin) * h))
+        right = min(w, round((expected[1][0] + search_margin) * w))
+        bottom = min(h, round((expected[1][1] + search_margin) * h))
+        window = frame[top:bottom, left:right]
+        if window.shape[0] < height or window.shape[1] < width:
+            continue
+        scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(scores)
+        if score < MATCH_THRESHOLD:
+            continue
+        aligned = ((rect[0][0] + rect[1][0]) / 2, (rect[0][1] + rect[1][1]) / 2)
+        captured = ((left + location[0] + width / 2) / w,
+                    (top + location[1] + height / 2) / h)
+        matches.append((aligned, captured))
+    return matches
+
+
+def calibrate(frames: List[Image],
+              anchors: List[Tuple[Image, Rectangle]]=()) -> Calibration:
+    """Calculate the correction for a capture device from some frames.
+
+    The borders of the game picture give an initial estimate, which is then
+    refined by a least squares fit to any anchor templates that are found.
+    Return None if neither gives a plausible correction (see
+    Calibration.is_plausible).
+    """
+    area = find_picture_area(frames)
+    estimate = Calibration((area[1][0] - area[0][0], area[1][1] - area[0][1]),
+        area[0]
+    )
+    if not estimate.is_plausible():
+        estimate = None
+    matches = []
+    for frame in frames:
+        matches += locate_anchors(frame, anchors, estimate or Calibration())
+    if len(matches) == 0:
+        return estimate
+
+    # Fit each axis separately, keeping the estimate for any axis on which
+    # the anchors found don't have at least two distinct positions.
+    aligned, captured = numpy.array(matches).transpose(1, 0, 2)
+    scale = list((estimate or Calibration()).scale)
+    offset = list((estimate or Calibration()).offset)
+    for axis in (0, 1):
+        if len(numpy.unique(aligned[:, axis])) >= 2:
+            scale[axis], offset[axis] = numpy.polyfit(aligned[:, axis],
+                captured[:, axis], 1)
+    fitted = Calibration(scale, offset)
+    return fitted if fitted.is_plausible() else estimate
+
+
+def load_calibration(path: str,
+                     device: str) -> Calibration:
+    """Return the cached calibration for a capture device, if any. Cached
+    calibrations that aren't plausible (e.g. stored before they were
+    checked) are ignored.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as file:
+        cache = json.load(file)
+    if device not in cache:
+        return None
+    cached = Calibration.from_dict(cache[device])
+    return cached if cached.is_plausible() else None
+
+
+def save_calibration(path: str,
+                     device: str,
+                     calibration: Calibration) -> None:
+    """Cache the calibration for a capture device."""
+    cache = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as file:
+            cache = json.load(file)
+    cache[device] = calibration.to_dict()
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(cache, file, indent=2)
+
+
+def make_anchor(reference_path: str,
+                name: str,
+                rect: Rectangle,
+                anchors_path: str) -> None:
+    """Cut an anchor template out of a perfectly aligned reference frame and
+    add it to an anchors JSON file.
+    """
+    reference = cv2.imread(reference_path)
+    if reference is None:
+        raise FileNotFoundError('Failed to read ' + reference_path)
+    h, w = reference.shape[:2]
+    template = reference[round(rect[0][1]*h):round(rect[1][1]*h),
+                         round(rect[0][0]*w):round(rect[1][0]*w)]
+    directory = os.path.dirname(anchors_path)
+    cv2.imwrite(os.path.join(directory, name + '.png'), template)
+
+    entries = []
+    if os.path.exists(anchors_path):
+        with open(anchors_path, encoding='utf-8') as file:
+            entries = json.load(file)
+    entries = [entry for entry in entries if entry['template'] != name + '.png']
+    entries.append({'template': name + '.png', 'rect': [list(rect[0]),
+        list(rect[1])]})
+    with open(anchors_path, 'w', encoding='utf-8') as file:
+        json.dump(entries, file, indent=2)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 7:
+        print('Usage: python calibration.py reference.png anchor_name x0 y0 x1 y1')
+        sys.exit(1)
+    x0, y0, x1, y1 = (float(value) for value in sys.argv[3:7])
+    make_anchor(sys.argv[1], sys.argv[2], ((x0, y0), (x1, y1)),
+        'Calibration/anchors.json'
+    )
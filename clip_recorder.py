@@ -0,0 +1,158 @@
+# Clip Recorder
+#   Keep a rolling buffer of recent frames, compressed in memory, and save a
+#   video clip around any event worth reviewing later (e.g. a shiny Pokemon or
+#   a misidentification). Sampling and encoding happen on background threads
+#   so the control thread never waits for the disk.
+
+import collections
+import queue
+import threading
+import time
+import cv2
+import numpy
+from typing import TypeVar, List
+FrameGrabber = TypeVar('video_capture.FrameGrabber')
+
+
+class ClipRecorder():
+    """Record clips from the frames read by a FrameGrabber.
+
+    Frames are sampled at fps and stored as JPEG images for the last
+    seconds_before + seconds_after seconds. When an event is triggered, the
+    frames from seconds_before seconds before it until seconds_after seconds
+    after it are written to '<prefix>_clip_<number>_<event>.mp4'.
+    """
+    def __init__(self,
+                 frame_grabber: FrameGrabber,
+                 prefix: str,
+                 fps: float=10,
+                 seconds_before: float=10,
+                 seconds_after: float=5,
+                 jpeg_quality: int=80) -> None:
+        self.frame_grabber = frame_grabber
+        self.prefix = prefix
+        self.fps = fps
+        self.seconds_before = seconds_before
+        self.seconds_after = seconds_after
+        self.jpeg_quality = jpeg_quality
+        self.frames = collections.deque(
+            maxlen=round(fps * (seconds_before + seconds_after)) + 1
+        )
+        # Events waiting for the frames after them, as (time, name) pairs
+        self.pending_events = []
+        self.events_lock = threading.Lock()
+        self.write_queue = queue.Queue()
+        self.num_clips = 0
+        self.running = False
+        self.stop_event = threading.Event()
+        self.sample_thread = None
+        self.write_thread = None
+
+    def start(self) -> None:
+        """Start sampling frames and writing clips on background threads."""
+        if self.running:
+            return
+        self.running = True
+        self.stop_event.clear()
+        self.sample_thread = threading.Thread(target=self.sample,
+            name='ClipSampler', daemon=True
+        )
+        self.write_thread = threading.Thread(target=self.write,
+            name='ClipWriter', daemon=True
+        )
+        self.sample_thread.start()
+        self.write_thread.start()
+
+    def stop(self,
+             timeout: float=None) -> bool:
+        """Stop sampling, write clips for any pending events with the frames
+        available, and wait up to timeout seconds for all clips to be
+        written. Return whether they were.
+        """
+        if not self.running:
+            return True
+        deadline = None if timeout is None else time.time() + timeout
+        self.running = False
+        self.stop_event.set()
+        self.sample_thread.join(timeout)
+        self.flush_events(time.time() + self.seconds_after)
+        self.write_queue.put(None)
+        self.write_thread.join(None if deadline is None
+            else max(0, deadline - time.time()))
+        return not (self.sample_thread.is_alive()
+            or self.write_thread.is_alive())
+
+    def trigger(self,
+                event: str) -> None:
+        """Save a clip around the current moment. Returns immediately."""
+        if not self.running:
+            return
+        with self.events_lock:
+            self.pending_events.append((time.time(), event))
+
+    def sample(self) -> None:
+        """Compress frames into the buffer until stopped. Called by the
+        sampling thread.
+        """
+        timestamp = 0
+        while self.running:
+            # The frame is only needed while it is encoded, so it is read in
+            # place rather than copied.
+            with self.frame_grabber.acquire_frame(
+                    newer_than=timestamp + 1 / self.fps, timeout=1) as held:
+                if held.frame is None:
+                    self.stop_event.wait(0.1)
+                    continue
+                timestamp = held.timestamp
+                success, encoded = cv2.imencode('.jpg', held.frame,
+                    (cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality)
+                )
+            if success:
+                self.frames.append((timestamp, encoded))
+            self.flush_events(timestamp)
+
+    def flush_events(self,
+                     now: float) -> None:
+        """Queue clips for every pending event whose clip has ended by now."""
+        with self.events_lock:
+            ready = [event for event in self.pending_events
+                if event[0] + self.seconds_after <= now]
+            self.pending_events = [event for event in self.pending_events
+                if event not in ready]
+        for event_time, event in ready:
+            frames = [encoded for timestamp, encoded in list(self.frames)
+                if event_time - self.seconds_before <= timestamp
+                <= event_time + self.seconds_after]
+            if len(frames) > 0:
+                self.num_clips += 1
+                self.write_queue.put((self.num_clips, event, frames))
+
+    def write(self) -> None:
+        """Encode queued clips to video files until stopped. Called by the
+        writing thread.
+        """
+        while True:
+            clip = self.write_queue.get()
+            if clip is None:
+                return
+            self.write_clip(*clip)
+
+    def write_clip(self,
+                   number: int,
+                   event: str,
+                   frames: List[numpy.ndarray]) -> str:
+        """Decode the frames of a clip and write them to a video file."""
+        filename = '%s_clip_%d_%s.mp4' % (self.prefix, number,
+            ''.join(char if char.isalnum() else '_' for char in event)
+        )
+        writer = None
+        for encoded in frames:
+            frame = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+            if writer is None:
+                h, w = frame.shape[:2]
+                writer = cv2.VideoWriter(filename,
+                    cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (w, h)
+                )
+            writer.write(frame)
+        writer.release()
+        return filename
@@ -0,0 +1,217 @@
+# Display
+#   Helpers for the window that shows the video and the progress of the bot,
+#   which runs on the main thread independently of the control thread, and
+#   for the HTTP dashboard that replaces the window when running headless.
+
+import collections
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy
+from typing import Callable, Dict
+from video_capture import HeldFrame
+
+
+class FrameTimer():
+    """Pace a display loop to a target frame rate and keep statistics on how
+    long each frame took to render and how far apart frames were shown.
+    """
+    def __init__(self,
+                 target_fps: float=30,
+                 history: int=300) -> None:
+        self.period = 1 / target_fps
+        self.render_times = collections.deque(maxlen=history)
+        self.frame_intervals = collections.deque(maxlen=history)
+        self.frames = 0
+        self.frame_start = None
+        self.last_frame_start = None
+
+    def start_frame(self) -> None:
+        """Mark the start of rendering a frame."""
+        self.frame_start = time.perf_counter()
+        if self.last_frame_start is not None:
+            self.frame_intervals.append(self.frame_start - self.last_frame_start)
+        self.last_frame_start = self.frame_start
+
+    def end_frame(self) -> float:
+        """Mark the end of rendering a frame and return the time in seconds
+        until the next frame is due.
+        """
+        now = time.perf_counter()
+        self.render_times.append(now - self.frame_start)
+        self.frames += 1
+        return max(0, self.frame_start + self.period - now)
+
+    def summary(self) -> Dict[str, float]:
+        """Return the frame rate and the render and frame time percentiles in
+        milliseconds over the recent history.
+        """
+        if len(self.frame_intervals) == 0:
+            return {'fps': 0, 'render_p50_ms': 0, 'render_p95_ms': 0,
+                'frame_p95_ms': 0, 'frame_max_ms': 0}
+        render_times = 1000 * numpy.array(self.render_times)
+        intervals = 1000 * numpy.array(self.frame_intervals)
+        return {'fps': round(1000 / float(numpy.mean(intervals)), 1),
+            'render_p50_ms': round(float(numpy.percentile(render_times, 50)), 2),
+            'render_p95_ms': round(float(numpy.percentile(render_times, 95)), 2),
+            'frame_p95_ms': round(float(numpy.percentile(intervals, 95)), 2),
+            'frame_max_ms': round(float(numpy.max(intervals)), 2)}
+
+    def __str__(self):
+        return ('%(fps).1f FPS, render p50 %(render_p50_ms).1f ms / p95 '
+            '%(render_p95_ms).1f ms, frame time p95 %(frame_p95_ms).1f ms / '
+            'max %(frame_max_ms).1f ms' % self.summary())
+
+
+class Dashboard():
+    """Serve a preview of the video and the run statistics over HTTP, for
+    watching the bot when it runs without a window.
+
+    Pages served:
+        /            a page showing the preview and statistics
+        /stream.mjpg the video as an MJPEG stream at up to fps frames/s
+        /stats.json  the statistics
+    Frames are only encoded while a client is watching the stream, and
+    clients watching at the same time share each encoded frame.
+    """
+    def __init__(self,
+                 acquire_frame: Callable[[], HeldFrame],
+                 get_stats: Callable[[], Dict],
+                 port: int=8080,
+                 host: str='127.0.0.1',
+                 fps: float=5,
+                 width: int=960,
+                 jpeg_quality: int=70) -> None:
+        self.acquire_frame = acquire_frame
+        self.get_stats = get_stats
+        self.period = 1 / fps
+        self.width = width
+        self.jpeg_quality = jpeg_quality
+        self.encoded_frame = None
+        self.encoded_time = 0
+        self.encode_lock = threading.Lock()
+        # Set when stopping, to end the streams being served
+        self.stopping = threading.Event()
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def start(self) -> None:
+        """Start serving on a background thread."""
+        self.thread = threading.Thread(target=self.server.serve_forever,
+            name='Dashboard', daemon=True
+        )
+        self.thread.start()
+
+    def stop(self,
+             timeout: float=None) -> bool:
+        """Stop serving, waiting up to timeout seconds for the server thread to
+        finish. Return whether it finished.
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                return False
+            self.thread = None
+        return True
+
+    def get_jpeg(self) -> bytes:
+        """Return the newest frame as a JPEG, encoding it at most once per
+        frame period however many clients are watching.
+        """
+        with self.encode_lock:
+            if time.time() - self.encoded_time >= self.period:
+                # The frame is encoded in place and released straight away.
+                with self.acquire_frame() as held:
+                    frame = held.frame
+                    if frame is not None:
+                        h, w = frame.shape[:2]
+                        if w > self.width:
+                            frame = cv2.resize(frame, (self.width,
+                                round(h * self.width / w)),
+                                interpolation=cv2.INTER_AREA
+                            )
+                        success, encoded = cv2.imencode('.jpg', frame,
+                            (cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality)
+                        )
+                        if success:
+                            self.encoded_frame = encoded.tobytes()
+                self.encoded_time = time.time()
+            return self.encoded_frame
+
+    def make_handler(self):
+        """Create the request handler class for this dashboard."""
+        dashboard = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/':
+                    self.send_body(DASHBOARD_PAGE.encode('utf-8'), 'text/html')
+                elif self.path == '/stats.json':
+                    self.send_body(json.dumps(dashboard.get_stats()).encode(
+                        'utf-8'), 'application/json')
+                elif self.path == '/stream.mjpg':
+                    self.send_stream()
+                else:
+                    self.send_error(404)
+
+            def send_body(self, body, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_stream(self):
+                self.send_response(200)
+                self.send_header('Content-Type',
+                    'multipart/x-mixed-replace; boundary=frame')
+                self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                try:
+                    while not dashboard.stopping.is_set():
+                        start = time.time()
+                        jpeg = dashboard.get_jpeg()
+                        if jpeg is not None:
+                            self.wfile.write(b'--frame\r\nContent-Type: '
+                                b'image/jpeg\r\nContent-Length: '
+                                + str(len(jpeg)).encode() + b'\r\n\r\n'
+                                + jpeg + b'\r\n')
+                        dashboard.stopping.wait(max(0, dashboard.period
+                            - (time.time() - start)))
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped watching.
+                    pass
+
+            def log_message(self, format, *args):
+                # Keep requests out of the console.
+                pass
+
+        return Handler
+
+
+DASHBOARD_PAGE = '''<!DOCTYPE html>
+<html>
+<head><title>AutoMaxLair</title></head>
+<body style="background:#222; color:#eee; font-family:sans-serif">
+<img src="/stream.mjpg" style="max-width:100%">
+<table id="stats"></table>
+<script>
+async function update() {
+    const stats = await (await fetch('/stats.json')).json();
+    document.getElementById('stats').innerHTML = Object.entries(stats).map(
+        ([label, value]) => '<tr><td>' + label + '</td><td>' + value
+        + '</td></tr>').join('');
+}
+update();
+setInterval(update, 1000);
+</script>
+</body>
+</html>
+'''
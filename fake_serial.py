@@ -0,0 +1,348 @@
+# Fake Serial
+#   A software stand-in for the microcontroller running RemoteControl.c, so
+#   button pushing can be exercised and timed without any hardware. It can be
+#   used in-process in place of serial.Serial (set COM_PORT = FAKE) or exposed
+#   as a pseudo-terminal that any program can open as a serial port:
+#       python fake_serial.py [--latency 0.005] [--drop-rate 0.01]
+
+import argparse
+import collections
+import os
+import random
+import threading
+import time
+from typing import List, Tuple
+import serial_protocol
+
+# Time taken to receive one byte at 9600 baud (10 bits per byte)
+BYTE_TIME = 10 / 9600
+# The firmware holds each press for ECHOES + 1 reports, sent every 8 ms
+PRESS_TIME = 6 * 0.008
+# Characters the firmware recognizes as buttons; anything else (e.g. '0')
+# presses nothing.
+BUTTONS = frozenset(b'^<v>xyablrLR-+Cctph')
+CAPTURE_BUTTON = ord('p')
+# States of the firmware's receiver, as in ReceiveCharacter
+(RX_COMMAND, RX_COUNT, RX_BUTTON, RX_DURATION_LOW, RX_DURATION_HIGH,
+    RX_CHECKSUM, RX_END, RX_DISCARD) = range(8)
+# A sequence frame that stops arriving for this long (s) is abandoned
+RECEIVE_TIMEOUT = 0.05
+
+
+class FirmwareEmulator():
+    """Emulate the serial protocol and timing of the RemoteControl firmware.
+
+    latency: extra delay (s) before each reply is sent.
+    drop_rate: probability that a reply is lost.
+    Every byte received is recorded in `received` and every button pressed in
+    `presses`, both as (timestamp, byte) pairs; `screenshots` counts presses
+    of the capture button. As in the firmware, a single command replaces any
+    command still waiting for the previous press to be sent, so every command
+    is echoed but only the last of a burst is pressed.
+    """
+    def __init__(self,
+                 latency: float=0,
+                 drop_rate: float=0,
+                 seed: int=None) -> None:
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.condition = threading.Condition()
+        self.incoming = collections.deque()
+        self.outgoing = collections.deque()
+        self.replies = []
+        self.received = []
+        self.presses = []
+        self.screenshots = 0
+        self.byte_arrival = 0
+        self.press_available = 0
+        # Single command waiting to be pressed, as a (press time, button) pair
+        self.pending = None
+        # Sequence frame being received, as (button, duration units) entries
+        self.receive_state = RX_COMMAND
+        self.last_receive_time = 0
+        self.sequence_length = 0
+        self.sequence_checksum = 0
+        self.entries = []
+        # Sequence being run as a queue of (press time, button) pairs
+        self.sequence = collections.deque()
+        self.sequence_end = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='FirmwareEmulator',
+            daemon=True
+        )
+        self.thread.start()
+
+    def close(self) -> None:
+        """Stop the emulator."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+
+    def write(self,
+              data: bytes) -> None:
+        """Receive bytes from the computer."""
+        with self.condition:
+            now = time.time()
+            for byte in data:
+                # Bytes arrive one after another at the baud rate.
+                self.byte_arrival = max(now, self.byte_arrival) + BYTE_TIME
+                self.incoming.append((self.byte_arrival, byte))
+            self.condition.notify_all()
+
+    def read(self,
+             size: int=1,
+             timeout: float=None) -> bytes:
+        """Return up to size bytes sent to the computer, waiting up to timeout
+        seconds for the first one.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.outgoing) > 0, timeout)
+            data = bytearray()
+            while len(self.outgoing) > 0 and len(data) < size:
+                data.append(self.outgoing.popleft())
+            return bytes(data)
+
+    def reset_output(self) -> None:
+        """Discard bytes waiting to be read by the computer."""
+        with self.condition:
+            self.outgoing.clear()
+
+    def waiting(self) -> int:
+        """Return the number of bytes waiting to be read by the computer."""
+        with self.condition:
+            return len(self.outgoing)
+
+    def run(self) -> None:
+        """Process received bytes, sequences, and replies at the time they
+        are due. Called by the emulator thread.
+        """
+        with self.condition:
+            while self.running:
+                now = time.time()
+                if len(self.incoming) > 0 and self.incoming[0][0] <= now:
+                    self.receive(*self.incoming.popleft())
+                elif self.pending is not None and self.pending[0] <= now:
+                    self.press(*self.pending)
+                    self.pending = None
+                elif len(self.sequence) > 0 and self.sequence[0][0] <= now:
+                    self.press(*self.sequence.popleft())
+                elif self.sequence_end is not None and self.sequence_end <= now:
+                    self.sequence_end = None
+                    self.reply(serial_protocol.SEQUENCE_ACK[0], now)
+                elif (self.receive_state != RX_COMMAND
+                        and self.receive_deadline() <= now):
+                    self.check_receive_timeout(now)
+                elif len(self.replies) > 0 and self.replies[0][0] <= now:
+                    self.outgoing.append(self.replies.pop(0)[1])
+                    self.condition.notify_all()
+                else:
+                    # Sleep until the next event is due or more bytes arrive.
+                    due = [queue[0][0] for queue in (self.incoming,
+                        self.sequence, self.replies) if len(queue) > 0]
+                    if self.pending is not None:
+                        due.append(self.pending[0])
+                    if self.sequence_end is not None:
+                        due.append(self.sequence_end)
+                    if self.receive_state != RX_COMMAND:
+                        due.append(self.receive_deadline())
+                    self.condition.wait(min(due) - now if due else None)
+
+    def receive_deadline(self) -> float:
+        """Return when the sequence frame being received times out."""
+        return self.last_receive_time + RECEIVE_TIMEOUT
+
+    def check_receive_timeout(self,
+                              now: float) -> None:
+        """Give up on a sequence frame whose bytes have stopped arriving, as
+        CheckReceiveTimeout does.
+        """
+        if self.receive_state == RX_COMMAND or now < self.receive_deadline():
+            return
+        if self.receive_state != RX_DISCARD:
+            self.reply(serial_protocol.SEQUENCE_NAK[0], self.receive_deadline())
+        self.receive_state = RX_COMMAND
+
+    def reject_sequence(self,
+                        timestamp: float) -> None:
+        """Reject the sequence frame being received and ignore the rest of
+        it.
+        """
+        self.receive_state = RX_DISCARD
+        self.reply(serial_protocol.SEQUENCE_NAK[0], timestamp)
+
+    def receive(self,
+                timestamp: float,
+                byte: int) -> None:
+        """Handle one byte from the computer as ReceiveCharacter does."""
+        self.received.append((timestamp, byte))
+        self.check_receive_timeout(timestamp)
+        self.last_receive_time = timestamp
+        state = self.receive_state
+        if state == RX_COMMAND:
+            if byte == serial_protocol.SEQUENCE_START[0]:
+                # Only one sequence can run at a time.
+                if len(self.sequence) > 0 or self.sequence_end is not None:
+                    self.reject_sequence(timestamp)
+                else:
+                    self.receive_state = RX_COUNT
+            else:
+                # received_command is overwritten until it is pressed.
+                self.pending = (max(timestamp, self.press_available), byte)
+                self.reply(byte, timestamp)
+        elif state == RX_COUNT:
+            if byte == 0 or byte > serial_protocol.MAX_SEQUENCE_LENGTH:
+                self.reject_sequence(timestamp)
+                return
+            self.sequence_length = byte
+            self.sequence_checksum = byte
+            self.entries = []
+            self.receive_state = RX_BUTTON
+        elif state == RX_BUTTON:
+            self.entries.append([byte, 0])
+            self.sequence_checksum ^= byte
+            self.receive_state = RX_DURATION_LOW
+        elif state == RX_DURATION_LOW:
+            self.entries[-1][1] = byte
+            self.sequence_checksum ^= byte
+            self.receive_state = RX_DURATION_HIGH
+        elif state == RX_DURATION_HIGH:
+            self.entries[-1][1] |= byte << 8
+            self.sequence_checksum ^= byte
+            self.receive_state = (RX_BUTTON if len(self.entries)
+                < self.sequence_length else RX_CHECKSUM)
+        elif state == RX_CHECKSUM:
+            if byte == self.sequence_checksum:
+                self.receive_state = RX_END
+            else:
+                self.reject_sequence(timestamp)
+        elif state == RX_END:
+            if byte == serial_protocol.SEQUENCE_END[0]:
+                self.receive_state = RX_COMMAND
+                self.start_sequence(timestamp)
+            else:
+                self.reject_sequence(timestamp)
+        elif byte == serial_protocol.SEQUENCE_END[0]:
+            # RX_DISCARD
+            self.receive_state = RX_COMMAND
+
+    def start_sequence(self,
+                       timestamp: float) -> None:
+        """Queue the presses of the sequence frame just received."""
+        press_time = timestamp
+        for button, units in self.entries:
+            self.sequence.append((press_time, button))
+            press_time += units * serial_protocol.DURATION_UNIT
+        self.sequence_end = press_time
+
+    def press(self,
+              timestamp: float,
+              button: int) -> None:
+        """Press a button, after the previous press has been sent."""
+        timestamp = max(timestamp, self.press_available)
+        self.press_available = timestamp + PRESS_TIME
+        if button in BUTTONS:
+            self.presses.append((timestamp, button))
+            if button == CAPTURE_BUTTON:
+                self.screenshots += 1
+
+    def reply(self,
+              byte: int,
+              timestamp: float) -> None:
+        """Queue a byte for the computer, subject to latency and drops."""
+        if self.random.random() < self.drop_rate:
+            return
+        self.replies.append((timestamp + self.latency, byte))
+        self.replies.sort()
+
+
+class FakeSerial():
+    """Stand-in for serial.Serial connected to a FirmwareEmulator."""
+    def __init__(self,
+                 port: str='FAKE',
+                 baudrate: int=9600,
+                 timeout: float=None,
+                 emulator: FirmwareEmulator=None) -> None:
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.emulator = FirmwareEmulator() if emulator is None else emulator
+        self.is_open = True
+
+    def open(self) -> None:
+        self.is_open = True
+
+    def close(self) -> None:
+        self.is_open = False
+
+    @property
+    def in_waiting(self) -> int:
+        return self.emulator.waiting()
+
+    def write(self,
+              data: bytes) -> int:
+        self.emulator.write(data)
+        return len(data)
+
+    def read(self,
+             size: int=1) -> bytes:
+        return self.emulator.read(size, self.timeout)
+
+    def reset_input_buffer(self) -> None:
+        self.emulator.reset_output()
+
+
+def open_pty_device(emulator: FirmwareEmulator) -> str:
+    """Expose an emulator as a pseudo-terminal and return the path of the
+    serial port to open (POSIX only).
+    """
+    import pty
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+
+    def forward_input():
+        while emulator.running:
+            try:
+                data = os.read(master, 256)
+            except OSError:
+                return
+            emulator.write(data)
+
+    def forward_output():
+        while emulator.running:
+            data = emulator.read(256, timeout=0.1)
+            if data:
+                os.write(master, data)
+
+    for target in (forward_input, forward_output):
+        threading.Thread(target=target, daemon=True).start()
+    return os.ttyname(slave)
+
+
+def summarize_presses(presses: List[Tuple[float, int]]) -> str:
+    """Describe the buttons pressed and the gaps between them."""
+    gaps = [later[0] - earlier[0] for earlier, later in zip(presses, presses[1:])]
+    return '%d presses, mean gap %.1f ms' % (len(presses),
+        1000 * sum(gaps) / max(1, len(gaps)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Emulate the RemoteControl '
+        'firmware on a pseudo-terminal.')
+    parser.add_argument('--latency', type=float, default=0,
+        help='Delay before each reply (s).')
+    parser.add_argument('--drop-rate', type=float, default=0,
+        help='Probability that a reply is lost.')
+    args = parser.parse_args()
+    emulator = FirmwareEmulator(args.latency, args.drop_rate)
+    print('Emulating the microcontroller at ' + open_pty_device(emulator)
+        + '. Press Ctrl+C to stop.')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print('Received %d bytes; %s; %d screenshots' % (len(emulator.received),
+            summarize_presses(emulator.presses), emulator.screenshots))
+        emulator.close()
@@ -0,0 +1,280 @@
+# Frame Bus
+#   Share captured frames between processes through a fixed pool of slots in
+#   shared memory, so video can be captured in its own process (outside the
+#   GIL) while other processes read the frames without copying them.
+
+import functools
+import multiprocessing
+import time
+import numpy
+from multiprocessing import shared_memory
+from typing import TypeVar, Tuple
+import video_capture
+Image = TypeVar('cv2 image')
+
+# Header fields, stored as int64 values at the start of the shared memory
+# block and followed by the sequence number, timestamp, and number of readers
+# of each slot.
+LATEST_SLOT, SLOTS, HEIGHT, WIDTH, CHANNELS, FINISHED = range(6)
+HEADER_FIELDS = 6
+
+
+class FrameBus():
+    """A pool of frame slots in shared memory.
+
+    One process publishes frames, each numbered with an increasing sequence
+    number, and any number of processes read them in place. A reader pins the
+    slot it is reading so the publisher leaves it alone until it is released,
+    which means there must be more slots than frames held at once.
+
+    If name is None a new bus is created for frames of the given shape;
+    otherwise the existing bus with that name is opened, and its shape is
+    read from the header. Every process must share the creator's lock.
+    """
+    def __init__(self,
+                 name: str=None,
+                 shape: Tuple[int, int, int]=(1080, 1920, 3),
+                 slots: int=8,
+                 lock=None) -> None:
+        self.owner = name is None
+        if self.owner:
+            frame_size = int(numpy.prod(shape))
+            header_size = 8 * (HEADER_FIELDS + 3*slots)
+            self.memory = shared_memory.SharedMemory(create=True,
+                size=header_size + slots*frame_size
+            )
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.lock = multiprocessing.Lock() if lock is None else lock
+
+        header = numpy.ndarray((HEADER_FIELDS,), numpy.int64, self.memory.buf)
+        if self.owner:
+            header[:] = (-1, slots) + tuple(shape) + (0,)
+        self.header = header
+        self.slots = int(header[SLOTS])
+        self.shape = tuple(int(value) for value in header[HEIGHT:CHANNELS+1])
+        offset = 8 * HEADER_FIELDS
+        self.sequences = numpy.ndarray((self.slots,), numpy.int64,
+            self.memory.buf, offset
+        )
+        offset += 8 * self.slots
+        self.timestamps = numpy.ndarray((self.slots,), numpy.float64,
+            self.memory.buf, offset
+        )
+        offset += 8 * self.slots
+        self.pins = numpy.ndarray((self.slots,), numpy.int64,
+            self.memory.buf, offset
+        )
+        offset += 8 * self.slots
+        self.frames = numpy.ndarray((self.slots,) + self.shape, numpy.uint8,
+            self.memory.buf, offset
+        )
+        if self.owner:
+            self.sequences[:] = 0
+            self.timestamps[:] = 0
+            self.pins[:] = 0
+        self.sequence = 0
+
+    @property
+    def finished(self) -> bool:
+        """Whether the publisher has no more frames to deliver."""
+        return bool(self.header[FINISHED])
+
+    @finished.setter
+    def finished(self, value: bool) -> None:
+        self.header[FINISHED] = int(value)
+
+    def latest_timestamp(self) -> float:
+        """Return the capture time of the newest frame, or 0 if none."""
+        slot = int(self.header[LATEST_SLOT])
+        return 0 if slot < 0 else float(self.timestamps[slot])
+
+    def publish(self,
+                frame: Image,
+                timestamp: float=None) -> int:
+        """Copy a frame into a free slot and return its sequence number, or 0
+        if every slot is pinned and the frame was dropped.
+        """
+        latest = int(self.header[LATEST_SLOT])
+        with self.lock:
+            for i in range(1, self.slots + 1):
+                slot = (latest + i) % self.slots
+                if slot != latest and self.pins[slot] == 0:
+                    break
+            else:
+                return 0
+            # Mark the slot as being written so readers can't pin it.
+            self.sequences[slot] = 0
+        self.frames[slot] = video_capture.fit_frame(frame, self.shape[1::-1])
+        self.sequence += 1
+        with self.lock:
+            self.timestamps[slot] = time.time() if timestamp is None else timestamp
+            self.sequences[slot] = self.sequence
+            self.header[LATEST_SLOT] = slot
+        return self.sequence
+
+    def acquire(self) -> Tuple[int, int, float, Image]:
+        """Pin the newest frame and return (slot, sequence, timestamp, frame),
+        where the frame is a read-only view of the slot, or (-1, 0, 0, None)
+        if nothing has been published yet. Release the slot when done.
+        """
+        with self.lock:
+            slot = int(self.header[LATEST_SLOT])
+            if slot < 0:
+                return -1, 0, 0, None
+            self.pins[slot] += 1
+            sequence = int(self.sequences[slot])
+            timestamp = float(self.timestamps[slot])
+        frame = self.frames[slot].view()
+        frame.setflags(write=False)
+        return slot, sequence, timestamp, frame
+
+    def release(self,
+                slot: int) -> None:
+        """Unpin a slot returned by acquire."""
+        if slot >= 0:
+            with self.lock:
+                self.pins[slot] -= 1
+
+    def close(self) -> None:
+        """Detach from the bus, removing it if this process created it."""
+        self.header = self.sequences = self.timestamps = None
+        self.pins = self.frames = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def run_capture(bus_name: str,
+                lock,
+                source: str,
+                real_time: bool,
+                loop: bool,
+                fps: float,
+                stop_event) -> None:
+    """Publish frames from a video source to a bus until stopped. This is the
+    target of the capture process.
+    """
+    bus = FrameBus(bus_name, lock=lock)
+    cap = video_capture.open_video_source(source, real_time, loop, fps)
+    cap.set(3, bus.shape[1])
+    cap.set(4, bus.shape[0])
+    try:
+        while not stop_event.is_set():
+            success, frame = cap.read()
+            if not success:
+                stop_event.wait(0.01)
+                continue
+            bus.publish(frame)
+            if cap.finished:
+                bus.finished = True
+                break
+    finally:
+        cap.release()
+        bus.close()
+
+
+class SharedCapture(video_capture.VideoSource):
+    """Capture video in a separate process and read it through a FrameBus.
+
+    This is both the video source and the frame grabber of a
+    MaxLairInstance. read() and get_frame() return copies of the newest frame,
+    which their callers own and may keep as long as they like, e.g. across
+    awaits while it is read with Tesseract. acquire_frame() returns it in
+    place, pinned until the returned HeldFrame is released, for consumers
+    that are done with it right away: the display, the dashboard, screen
+    change thumbnails, and the clip recorder.
+    """
+    def __init__(self,
+                 source: str,
+                 resolution: Tuple[int, int]=(1920, 1080),
+                 real_time: bool=True,
+                 loop: bool=False,
+                 fps: float=30,
+                 slots: int=8,
+                 poll_interval: float=0.002) -> None:
+        super().__init__()
+        self.bus = FrameBus(shape=(resolution[1], resolution[0], 3),
+            slots=slots
+        )
+        self.poll_interval = poll_interval
+        self.stop_event = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=run_capture,
+            args=(self.bus.name, self.bus.lock, source, real_time, loop, fps,
+            self.stop_event), name='Capture', daemon=True
+        )
+        self.running = False
+
+    def start(self) -> None:
+        """Start the capture process."""
+        if not self.running:
+            self.running = True
+            self.process.start()
+
+    def stop(self,
+             timeout: float=None) -> bool:
+        """Stop the capture process, terminating it if it hasn't exited after
+        timeout seconds. Return whether it exited by itself.
+        """
+        if not self.running:
+            return True
+        self.running = False
+        self.stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+            return False
+        return True
+
+    def acquire_frame(self,
+                      newer_than: float=0,
+                      timeout: float=5) -> video_capture.HeldFrame:
+        """Pin the newest frame and return it in place as a HeldFrame, waiting
+        up to timeout seconds for one captured after newer_than (see
+        FrameGrabber). Its slot is reused once it is released.
+        """
+        deadline = time.time() + timeout
+        while (self.bus.latest_timestamp() <= newer_than and self.running
+                and time.time() < deadline):
+            time.sleep(self.poll_interval)
+        self.finished = self.bus.finished
+        slot, _, timestamp, frame = self.bus.acquire()
+        if slot < 0:
+            return video_capture.HeldFrame(timestamp, None)
+        return video_capture.HeldFrame(timestamp, frame,
+            functools.partial(self.bus.release, slot)
+        )
+
+    def get_frame(self,
+                  newer_than: float=0,
+                  timeout: float=5) -> Tuple[float, Image]:
+        """Return the newest (timestamp, frame) pair, where the frame is a
+        read-only copy, waiting up to timeout seconds for one captured after
+        newer_than (see FrameGrabber).
+        """
+        with self.acquire_frame(newer_than, timeout) as held:
+            if held.frame is None:
+                return 0, None
+            frame = held.frame.copy()
+        frame.setflags(write=False)
+        return held.timestamp, frame
+
+    def read(self) -> Tuple[bool, Image]:
+        with self.acquire_frame() as held:
+            if held.frame is None:
+                return False, None
+            return True, held.frame.copy()
+
+    def isOpened(self) -> bool:
+        """Whether the capture process is delivering frames, waiting for the
+        first one if necessary.
+        """
+        if self.running and self.bus.latest_timestamp() == 0:
+            self.get_frame()
+        return self.process.is_alive() and self.bus.latest_timestamp() > 0
+
+    def release(self) -> None:
+        self.stop()
+        self.bus.close()
@@ -0,0 +1,283 @@
+# Image Processing
+#   Helpers for cropping and preprocessing sections of captured frames before
+#   they are checked for colours or passed to Tesseract.
+
+import json
+import os
+import cv2
+import numpy
+from typing import TypeVar, Dict, List, Tuple
+Image = TypeVar('cv2 image')
+Rectangle = Tuple[Tuple[float, float], Tuple[float, float]]
+
+# HSV range that isolates the white text used throughout the game's UI.
+TEXT_LOWER_HSV = (0, 0, 100)
+TEXT_UPPER_HSV = (180, 15, 255)
+# HSV ranges that isolate the light background of the game's cards (e.g. the
+# summary of a caught Pokemon) and the dark text printed on them.
+CARD_LOWER_HSV = (0, 0, 170)
+CARD_UPPER_HSV = (180, 60, 255)
+DARK_TEXT_LOWER_HSV = (0, 0, 0)
+DARK_TEXT_UPPER_HSV = (180, 255, 100)
+
+
+def get_rect_pixels(rect: Rectangle,
+                    shape: Tuple[int, ...]) -> Tuple[int, int, int, int]:
+    """Convert a rectangle in fractional coordinates to pixel bounds
+    (top, bottom, left, right) for an image of the given shape.
+    """
+    h, w = shape[:2]
+    return (round(rect[0][1]*h), round(rect[1][1]*h),
+            round(rect[0][0]*w), round(rect[1][0]*w))
+
+
+def crop(img: Image,
+         rect: Rectangle) -> Image:
+    """Return a view of the section of an image covered by a rectangle."""
+    top, bottom, left, right = get_rect_pixels(rect, img.shape)
+    return img[top:bottom, left:right]
+
+
+def get_buffer(buffers: Dict,
+               key,
+               shape: Tuple[int, ...]) -> Image:
+    """Return a reusable destination array for a preprocessing step.
+
+    Buffers are keyed by the caller-supplied key and the shape so that a
+    change in capture resolution simply allocates a new buffer.
+    """
+    if buffers is None:
+        return numpy.empty(shape, numpy.uint8)
+    buffer = buffers.get((key, shape))
+    if buffer is None:
+        buffer = numpy.empty(shape, numpy.uint8)
+        buffers[(key, shape)] = buffer
+    return buffer
+
+
+def crop_hsv(img: Image,
+             rect: Rectangle,
+             buffers: Dict=None) -> Image:
+    """Crop a section of a BGR image and convert only that section to HSV."""
+    cropped_area = crop(img, rect)
+    hsv = get_buffer(buffers, (rect, 'hsv'), cropped_area.shape)
+    return cv2.cvtColor(cropped_area, cv2.COLOR_BGR2HSV, dst=hsv)
+
+
+def get_thumbnail(img: Image,
+                  rect: Rectangle=((0, 0), (1, 1)),
+                  size: Tuple[int, int]=(64, 36)) -> Image:
+    """Return a small greyscale copy of a section of an image, which is cheap
+    to compare with other thumbnails to tell whether the screen changed.
+    """
+    return cv2.resize(cv2.cvtColor(crop(img, rect), cv2.COLOR_BGR2GRAY), size,
+        interpolation=cv2.INTER_AREA
+    )
+
+
+def preprocess_section(img: Image,
+                       rect: Rectangle,
+                       threshold: bool=True,
+                       invert: bool=False,
+                       buffers: Dict=None) -> Image:
+    """Crop a section of an image and prepare it for OCR.
+
+    The section is sliced out first so that colour conversion, thresholding
+    and inversion only touch the pixels that will actually be read. Passing
+    a dict as `buffers` lets repeated calls on the same section reuse their
+    destination arrays instead of allocating new ones every frame. The
+    result is then overwritten by the next call on that section, so copy it
+    before handing it to anything that may still be reading it meanwhile
+    (e.g. a Tesseract job on another thread). Without threshold or invert,
+    the result is a view of the frame itself.
+    """
+    img = crop(img, rect)
+    if threshold:
+        hsv = get_buffer(buffers, (rect, 'hsv'), img.shape)
+        cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=hsv)
+        mask = get_buffer(buffers, (rect, 'mask'), img.shape[:2])
+        img = cv2.inRange(hsv, TEXT_LOWER_HSV, TEXT_UPPER_HSV, dst=mask)
+    if invert:
+        inverted = get_buffer(buffers, (rect, 'inverted'), img.shape)
+        img = cv2.bitwise_not(img, dst=inverted)
+    return img
+
+
+def locate_text_lines(img: Image,
+                      frame_height: int,
+                      max_lines: int=6,
+                      processing_height: int=None) -> List[Tuple[int, int, int, int]]:
+    """Find tight bounding boxes (top, bottom, left, right) around lines of
+    text in a cropped BGR image.
+
+    Text is found from its dense edges so both light text on the dark battle
+    bar and dark text in the white dialogue boxes are located. Edges are
+    smeared horizontally so each word or line forms a single blob, then blobs
+    whose size does not resemble a line of dialogue or menu text are
+    discarded. Sizes are relative to the height of the full frame so the same
+    limits work at any capture resolution. If processing_height is below
+    frame_height, the lines are found in a copy of the image scaled down as if
+    the frame had that height, and their boxes are scaled back up.
+    """
+    if processing_height is not None and processing_height < frame_height:
+        factor = frame_height / processing_height
+        small = cv2.resize(img, (max(1, round(img.shape[1]/factor)),
+            max(1, round(img.shape[0]/factor))), interpolation=cv2.INTER_AREA
+        )
+        return [(round(top*factor), min(img.shape[0], round(bottom*factor)),
+            round(left*factor), min(img.shape[1], round(right*factor)))
+            for top, bottom, left, right in locate_text_lines(small,
+            processing_height, max_lines)]
+    scale = frame_height / 1080
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT,
+        cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    )
+    _, edges = cv2.threshold(gradient, 0, 255,
+        cv2.THRESH_BINARY | cv2.THRESH_OTSU
+    )
+    smeared = cv2.morphologyEx(edges, cv2.MORPH_CLOSE,
+        cv2.getStructuringElement(cv2.MORPH_RECT,
+        (max(1, round(25*scale)), max(1, round(5*scale))))
+    )
+    count, _, stats, _ = cv2.connectedComponentsWithStats(smeared)
+
+    lines = []
+    # Label 0 is the background.
+    for left, top, width, height, _ in stats[1:count]:
+        if not (15*scale <= height <= 90*scale and width >= 1.5 * height):
+            continue
+        # Reject blobs that are nearly empty (e.g. box outlines) or nearly
+        # solid (e.g. busy scenery) since neither is text.
+        density = cv2.countNonZero(edges[top:top+height, left:left+width]) / (width*height)
+        if not 0.1 <= density <= 0.8:
+            continue
+        # Pad the box slightly so the outermost strokes are not clipped.
+        pad = round(4*scale)
+        lines.append((max(0, top-pad), min(img.shape[0], top+height+pad),
+            max(0, left-pad), min(img.shape[1], left+width+pad))
+        )
+
+    # Keep the widest blobs, then return them in reading order.
+    lines.sort(key=lambda line: line[3] - line[2], reverse=True)
+    lines = lines[:max_lines]
+    lines.sort(key=lambda line: (line[0], line[2]))
+    return lines
+
+
+def stack_text_lines(img: Image,
+                     lines: List[Tuple[int, int, int, int]],
+                     padding: int=10) -> Image:
+    """Copy the line boxes of a single-channel image into one compact image,
+    one line per row, separated by white space.
+    """
+    height = sum(bottom - top for top, bottom, _, _ in lines) + padding*(len(lines)+1)
+    width = max(right - left for _, _, left, right in lines) + 2*padding
+    stacked = numpy.full((height, width), 255, numpy.uint8)
+    y = padding
+    for top, bottom, left, right in lines:
+        stacked[y:y+bottom-top, padding:padding+right-left] = img[top:bottom, left:right]
+        y += bottom - top + padding
+    return stacked
+
+
+# Type badges on the opponent's summary in battle are recognised by the
+# hue/saturation histogram of their coloured background. The reference
+# histogram of each type is learned from labeled crops of captured frames
+# (see Benchmarks/benchmark_types.py), so it matches the colour balance of
+# the capture that produced them.
+TYPE_NAMES = ('Normal', 'Fire', 'Water', 'Electric', 'Grass', 'Ice',
+    'Fighting', 'Poison', 'Ground', 'Flying', 'Psychic', 'Bug', 'Rock',
+    'Ghost', 'Dragon', 'Dark', 'Steel', 'Fairy')
+TYPE_HISTOGRAM_BINS = (30, 32)
+
+
+def type_badge_histogram(img: Image,
+                         rect: Rectangle,
+                         min_coverage: float=0.3) -> numpy.ndarray:
+    """Return the normalised hue/saturation histogram of the background of a
+    type badge, or None if the section does not contain a badge (e.g. the
+    second badge of a single-typed Pokemon).
+    """
+    hsv = crop_hsv(img, rect)
+    # Ignore the white lettering and dark outline so only the coloured
+    # background of the badge is measured.
+    lettering = cv2.inRange(hsv, (0, 0, 200), (180, 40, 255))
+    background = cv2.inRange(hsv, (0, 0, 60), (180, 255, 255))
+    background[lettering > 0] = 0
+    if cv2.countNonZero(background) < min_coverage * background.size:
+        return None
+    histogram = cv2.calcHist([hsv], [0, 1], background,
+        list(TYPE_HISTOGRAM_BINS), [0, 180, 0, 256]
+    )
+    return cv2.normalize(histogram, None, 1, 0, cv2.NORM_L1)
+
+
+def build_type_references(samples: List[Tuple[str, numpy.ndarray]]) -> Dict[str, numpy.ndarray]:
+    """Average the badge histograms of labeled (type name, histogram) samples
+    into one reference histogram per type.
+    """
+    references = {}
+    for name in TYPE_NAMES:
+        histograms = [histogram for label, histogram in samples
+            if label == name and histogram is not None]
+        if len(histograms) > 0:
+            references[name] = cv2.normalize(numpy.mean(histograms, axis=0),
+                None, 1, 0, cv2.NORM_L1)
+    return references
+
+
+def save_type_references(path: str,
+                         references: Dict[str, numpy.ndarray]) -> None:
+    """Store reference histograms in a JSON file."""
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'bins': TYPE_HISTOGRAM_BINS, 'types': {name:
+            histogram.ravel().tolist() for name, histogram
+            in references.items()}}, file)
+
+
+def load_type_references(path: str) -> Dict[str, numpy.ndarray]:
+    """Load reference histograms stored by save_type_references, or return
+    None unless there is one for every type (built with the current bins),
+    since a badge of a missing type would be taken for another type.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as file:
+        data = json.load(file)
+    if (tuple(data['bins']) != TYPE_HISTOGRAM_BINS
+            or set(data['types']) != set(TYPE_NAMES)):
+        return None
+    return {name: numpy.array(values, numpy.float32).reshape(TYPE_HISTOGRAM_BINS)
+        for name, values in data['types'].items()}
+
+
+def classify_type(img: Image,
+                  rect: Rectangle,
+                  references: Dict[str, numpy.ndarray],
+                  max_distance: float=0.5) -> str:
+    """Identify the type shown on a type badge by comparing its histogram
+    with the reference histogram of each type.
+
+    Returns the English name of the type, or an empty string if the section
+    does not contain a badge or it doesn't resemble any reference closely.
+    """
+    return classify_type_histogram(type_badge_histogram(img, rect), references,
+        max_distance)
+
+
+def classify_type_histogram(histogram: numpy.ndarray,
+                            references: Dict[str, numpy.ndarray],
+                            max_distance: float=0.5) -> str:
+    """Identify the type of a badge histogram (see classify_type)."""
+    if histogram is None:
+        return ''
+    best_name = ''
+    best_distance = max_distance
+    for name, reference in references.items():
+        distance = cv2.compareHist(histogram, reference,
+            cv2.HISTCMP_BHATTACHARYYA)
+        if distance < best_distance:
+            best_name = name
+            best_distance = distance
+    return best_name
@@ -0,0 +1,108 @@
+# OCR Profiles
+#   Tesseract settings tailored to each section of the screen that is read.
+
+import cv2
+from typing import TypeVar, Iterable
+Image = TypeVar('cv2 image')
+
+# Names of all Poke Balls that can appear on the ball selection wheel.
+BALL_NAMES = ('Poke Ball', 'Great Ball', 'Ultra Ball', 'Master Ball',
+    'Premier Ball', 'Heal Ball', 'Net Ball', 'Nest Ball', 'Dive Ball',
+    'Dusk Ball', 'Timer Ball', 'Quick Ball', 'Repeat Ball', 'Luxury Ball',
+    'Level Ball', 'Lure Ball', 'Moon Ball', 'Friend Ball', 'Love Ball',
+    'Heavy Ball', 'Fast Ball', 'Sport Ball', 'Safari Ball', 'Dream Ball',
+    'Beast Ball', 'Cherish Ball'
+)
+
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+# Frame height the profiles are tuned for. Sections of smaller frames are
+# enlarged to the size they would have at this height before being read, while
+# sections of larger frames keep their extra detail.
+REFERENCE_HEIGHT = 1080
+
+
+class OCRProfile():
+    """Tesseract settings used when reading a specific section of the screen.
+
+    segmentation_mode: Tesseract page segmentation mode option.
+    whitelist: characters Tesseract is allowed to output.
+    user_words: path to a file listing words expected in the section.
+    user_patterns: path to a file of patterns expected in the section.
+    dpi: resolution of a section of a frame of the reference height, which
+        spares Tesseract from estimating it. It is adjusted for the size of
+        the section actually read.
+    scale: factor the section is resized by before it is read.
+    """
+    def __init__(self,
+                 segmentation_mode: str='--psm 11',
+                 whitelist: str=None,
+                 user_words: str=None,
+                 user_patterns: str=None,
+                 dpi: int=70,
+                 scale: float=1) -> None:
+        self.segmentation_mode = segmentation_mode
+        self.whitelist = whitelist
+        self.user_words = user_words
+        self.user_patterns = user_patterns
+        self.dpi = dpi
+        self.scale = scale
+        self.config = self.build_config()
+
+    def build_config(self,
+                     frame_height: int=REFERENCE_HEIGHT) -> str:
+        """Assemble the Tesseract command line options for reading a section
+        cut from a frame of the given height.
+        """
+        options = [self.segmentation_mode]
+        if self.dpi is not None:
+            options.append('--dpi ' + str(round(self.dpi
+                * self.get_scale(frame_height) * frame_height / REFERENCE_HEIGHT)))
+        if self.user_words is not None:
+            options.append('--user-words ' + self.user_words)
+        if self.user_patterns is not None:
+            options.append('--user-patterns ' + self.user_patterns)
+        if self.whitelist is not None:
+            options.append('-c tessedit_char_whitelist=' + self.whitelist)
+        return ' '.join(options)
+
+    def get_config(self,
+                   frame_height: int=REFERENCE_HEIGHT) -> str:
+        """Return the Tesseract options for a section cut from a frame of the
+        given height.
+        """
+        if frame_height == REFERENCE_HEIGHT:
+            return self.config
+        return self.build_config(frame_height)
+
+    def get_scale(self,
+                  frame_height: int=REFERENCE_HEIGHT) -> float:
+        """Return the factor a section cut from a frame of the given height is
+        resized by.
+        """
+        return self.scale * max(1, REFERENCE_HEIGHT / frame_height)
+
+    def prepare(self,
+                img: Image,
+                frame_height: int=REFERENCE_HEIGHT) -> Image:
+        """Resize an already preprocessed section according to the profile
+        and the height of the frame it was cut from.
+        """
+        scale = self.get_scale(frame_height)
+        if scale == 1:
+            return img
+        return cv2.resize(img, None, fx=scale, fy=scale,
+            interpolation=cv2.INTER_CUBIC
+        )
+
+
+def write_word_list(path: str,
+                    phrases: Iterable[str]) -> None:
+    """Write the individual words of some phrases to a Tesseract user-words
+    file.
+    """
+    words = set()
+    for phrase in phrases:
+        words.update(phrase.split())
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(sorted(words)) + '\n')
@@ -0,0 +1,59 @@
+# Serial Protocol
+#   Messages understood by the RemoteControl firmware. Single characters press
+#   one button and are echoed back; a framed sequence presses several buttons
+#   with the timing kept by the microcontroller and is acknowledged once when
+#   it is complete.
+
+from typing import Iterable, List, Tuple
+
+SEQUENCE_START = b'{'
+SEQUENCE_END = b'}'
+SEQUENCE_ACK = b'!'
+SEQUENCE_NAK = b'?'
+# Most buttons the firmware accepts in one sequence
+MAX_SEQUENCE_LENGTH = 20
+# Durations are sent in units of this many seconds
+DURATION_UNIT = 0.01
+MAX_DURATION_UNITS = 0xFFFF
+# The firmware sends each press for 6 reports of 8 ms and only releases the
+# button if the next press is not yet due, so shorter durations are raised to
+# this to leave at least one neutral report between two presses.
+MIN_DURATION_UNITS = 6
+
+
+def duration_units(duration: float) -> int:
+    """Return a duration (s) in the units sent to the firmware."""
+    return min(MAX_DURATION_UNITS,
+        max(MIN_DURATION_UNITS, round(duration / DURATION_UNIT)))
+
+
+def encode_sequence(commands: Iterable[Tuple[bytes, float]]) -> bytes:
+    """Encode (button, duration) commands as a sequence frame:
+    start, count, (button, duration low byte, duration high byte) per command,
+    checksum, end, where the checksum is the XOR of the count and entries.
+    """
+    commands = list(commands)
+    if not 0 < len(commands) <= MAX_SEQUENCE_LENGTH:
+        raise ValueError('A sequence must contain 1 to '
+            + str(MAX_SEQUENCE_LENGTH) + ' commands.')
+    payload = bytearray([len(commands)])
+    for character, duration in commands:
+        units = duration_units(duration)
+        payload += character + bytes((units & 0xFF, units >> 8))
+    checksum = 0
+    for byte in payload:
+        checksum ^= byte
+    return SEQUENCE_START + bytes(payload) + bytes((checksum,)) + SEQUENCE_END
+
+
+def split_sequence(commands: Iterable[Tuple[bytes, float]]) -> List[List[Tuple[bytes, float]]]:
+    """Split commands into sequences short enough for the firmware."""
+    commands = list(commands)
+    return [commands[i:i+MAX_SEQUENCE_LENGTH]
+        for i in range(0, len(commands), MAX_SEQUENCE_LENGTH)]
+
+
+def sequence_duration(commands: Iterable[Tuple[bytes, float]]) -> float:
+    """Return how long the firmware takes to run a sequence."""
+    return sum(DURATION_UNIT * duration_units(duration)
+        for _, duration in commands)
@@ -0,0 +1,252 @@
+# Serial Writer
+#   Send button presses to the microcontroller from a dedicated thread. The
+#   control thread queues presses and carries on; the writer keeps the delay
+#   between them while a reader matches the replies as they arrive, counting
+#   any that are wrong or missing and timing how long they took.
+
+import collections
+import threading
+import time
+import numpy
+from typing import TypeVar, Callable, Dict, Iterable, Tuple
+import serial_protocol
+Serial = TypeVar('serial.Serial')
+
+# Upper edges (ms) of the round-trip time histogram bins
+RTT_BINS = (2, 5, 10, 20, 50, 100, 200)
+
+
+class SerialWriter():
+    """Write queued button presses to a serial port on a background thread and
+    verify the microcontroller's replies on another.
+
+    Single presses are written on schedule without waiting for their echo.
+    Sequences (see serial_protocol) are timed by the microcontroller, so the
+    writer waits for each one to be acknowledged before sending more.
+    A reply that hasn't arrived echo_timeout seconds after it was due is
+    counted as lost.
+    """
+    def __init__(self,
+                 com: Serial,
+                 log: Callable[[str], None]=print,
+                 echo_timeout: float=0.5,
+                 history: int=1000) -> None:
+        self.com = com
+        self.log = log
+        self.echo_timeout = echo_timeout
+        self.condition = threading.Condition()
+        # Queued (character, duration) presses and (None, sequence) sequences
+        self.commands = collections.deque()
+        # Commands queued but not finished, including their delays
+        self.outstanding = 0
+        # Replies expected, as [expected byte, time due, outcome]
+        self.pending = collections.deque()
+        self.round_trip_times = collections.deque(maxlen=history)
+        self.counts = collections.Counter()
+        # Functions to call once every queued command has finished
+        self.idle_callbacks = []
+        self.running = False
+        self.threads = []
+
+    def start(self) -> None:
+        """Start the writer and reader threads."""
+        if self.running:
+            return
+        self.running = True
+        self.threads = [threading.Thread(target=target, name=name, daemon=True)
+            for target, name in ((self.run_writer, 'SerialWriter'),
+            (self.run_reader, 'SerialReader'))]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self,
+             timeout: float=None) -> bool:
+        """Stop both threads, discarding (and logging) any presses still
+        queued, and wait up to timeout seconds for them to finish. Return
+        whether they finished.
+        """
+        if not self.running:
+            return True
+        with self.condition:
+            self.running = False
+            dropped = sum(1 if character is not None else len(sequence)
+                for character, sequence in self.commands)
+            if dropped > 0:
+                self.log('Discarded %d queued button presses.' % dropped)
+            self.commands.clear()
+            self.outstanding = 0
+            self.condition.notify_all()
+            self.call_idle_callbacks()
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0, deadline - time.time()))
+        return not any(thread.is_alive() for thread in self.threads)
+
+    def send(self,
+             commands: Iterable[Tuple[bytes, float]],
+             batch: bool=False) -> None:
+        """Queue (character, delay) button presses, as sequences if batch is
+        set, and return without waiting for them.
+        """
+        if batch:
+            items = [(None, sequence)
+                for sequence in serial_protocol.split_sequence(commands)]
+        else:
+            items = list(commands)
+        with self.condition:
+            self.commands.extend(items)
+            self.outstanding += len(items)
+            self.condition.notify_all()
+
+    def wait(self,
+             timeout: float=None) -> bool:
+        """Wait until every queued press and its delay has finished. Return
+        False if the timeout expired first.
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.outstanding == 0 or not self.running, timeout
+            )
+
+    def notify_when_idle(self,
+                         callback: Callable[[], None]) -> None:
+        """Call a function (from the writer thread) once every queued press
+        and its delay has finished, or now if none are queued.
+        """
+        with self.condition:
+            if self.outstanding > 0 and self.running:
+                self.idle_callbacks.append(callback)
+                return
+        callback()
+
+    def forget_idle_callback(self,
+                             callback: Callable[[], None]) -> None:
+        """Stop waiting to call a function passed to notify_when_idle, e.g.
+        because whatever it would notify has been cancelled.
+        """
+        with self.condition:
+            if callback in self.idle_callbacks:
+                self.idle_callbacks.remove(callback)
+
+    def call_idle_callbacks(self) -> None:
+        """Call and forget the functions waiting for the queue to empty."""
+        callbacks, self.idle_callbacks = self.idle_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def run_writer(self) -> None:
+        """Write queued commands, keeping the delay after each. Called by the
+        writer thread.
+        """
+        with self.condition:
+            while self.running:
+                if len(self.commands) == 0:
+                    self.condition.wait()
+                    continue
+                character, duration = self.commands.popleft()
+                now = time.time()
+                if character is None:
+                    # A sequence: wait for it to be acknowledged.
+                    sequence = duration
+                    duration = serial_protocol.sequence_duration(sequence)
+                    reply = self.expect(serial_protocol.SEQUENCE_ACK[0],
+                        now + duration)
+                    self.com.write(serial_protocol.encode_sequence(sequence))
+                    self.condition.wait_for(lambda: reply[2] is not None
+                        or not self.running)
+                    finish = time.time()
+                else:
+                    self.expect(character[0], now)
+                    self.com.write(character)
+                    finish = now + duration
+                # Sleep through the delay unless stopped.
+                self.condition.wait_for(lambda: not self.running,
+                    max(0, finish - time.time()))
+                self.outstanding = max(0, self.outstanding - 1)
+                if self.outstanding == 0:
+                    self.call_idle_callbacks()
+                self.condition.notify_all()
+
+    def expect(self,
+               byte: int,
+               due: float) -> list:
+        """Record a reply expected from the microcontroller."""
+        reply = [byte, due, None]
+        self.pending.append(reply)
+        self.counts['sent'] += 1
+        return reply
+
+    def run_reader(self) -> None:
+        """Match replies from the microcontroller against the expected ones.
+        Called by the reader thread.
+        """
+        while self.running:
+            data = self.com.read()
+            now = time.time()
+            with self.condition:
+                for byte in data:
+                    self.match(byte, now)
+                # Give up on replies that are overdue.
+                while (len(self.pending) > 0
+                        and now - self.pending[0][1] > self.echo_timeout):
+                    self.resolve(self.pending.popleft(), 'lost')
+                self.condition.notify_all()
+
+    def match(self,
+              byte: int,
+              timestamp: float) -> None:
+        """Match one received byte to the earliest reply it could be,
+        treating any replies expected before it as lost.
+        """
+        for i, reply in enumerate(self.pending):
+            if byte == reply[0] or (reply[0] == serial_protocol.SEQUENCE_ACK[0]
+                    and byte == serial_protocol.SEQUENCE_NAK[0]):
+                for __ in range(i):
+                    self.resolve(self.pending.popleft(), 'lost')
+                self.pending.popleft()
+                self.round_trip_times.append(max(0, timestamp - reply[1]))
+                self.resolve(reply, 'nak' if byte != reply[0] else 'matched')
+                return
+        self.counts['unexpected'] += 1
+        self.log('WARNING: Unexpected reply from the microcontroller: '
+            + repr(bytes((byte,))))
+
+    def resolve(self,
+                reply: list,
+                outcome: str) -> None:
+        """Record the outcome of an expected reply."""
+        reply[2] = outcome
+        self.counts[outcome] += 1
+        if outcome == 'lost':
+            self.log('WARNING: Sent command was not echoed back successfully.')
+        elif outcome == 'nak':
+            self.log('WARNING: Button sequence was not acknowledged successfully.')
+
+    def histogram(self) -> Dict[str, int]:
+        """Return the number of round trips in each time bin (ms)."""
+        counts = numpy.histogram(1000 * numpy.array(self.round_trip_times),
+            (0,) + RTT_BINS + (numpy.inf,))[0]
+        labels = ['<' + str(edge) for edge in RTT_BINS] + ['>=' + str(RTT_BINS[-1])]
+        return dict(zip(labels, (int(count) for count in counts)))
+
+    def summary(self) -> Dict[str, float]:
+        """Return the reply counts and round-trip time percentiles (ms)."""
+        summary = {key: self.counts[key]
+            for key in ('sent', 'matched', 'lost', 'nak', 'unexpected')}
+        if len(self.round_trip_times) > 0:
+            times = 1000 * numpy.array(self.round_trip_times)
+            summary['rtt_p50_ms'] = round(float(numpy.percentile(times, 50)), 1)
+            summary['rtt_p95_ms'] = round(float(numpy.percentile(times, 95)), 1)
+            summary['rtt_max_ms'] = round(float(numpy.max(times)), 1)
+        return summary
+
+    def __str__(self):
+        summary = self.summary()
+        text = ('%(sent)d sent, %(matched)d replies matched, %(lost)d lost, '
+            '%(nak)d rejected, %(unexpected)d unexpected' % summary)
+        if 'rtt_p50_ms' in summary:
+            text += (', round trip p50 %(rtt_p50_ms).1f ms / p95 %(rtt_p95_ms).1f'
+                ' ms / max %(rtt_max_ms).1f ms' % summary)
+            text += ', histogram (ms) ' + ' '.join(label + ':' + str(count)
+                for label, count in self.histogram().items())
+        return text
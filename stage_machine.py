@@ -0,0 +1,124 @@
+# Stage Machine
+#   Run the bot as a state machine whose stages, and the stages each one may
+#   go to next, are declared up front. Every transition is timestamped and the
+#   time spent in each stage is kept, so it's clear where each run's minutes
+#   go.
+
+import collections
+import time
+import numpy
+from typing import Any, Awaitable, Callable, Dict, Iterable
+
+# Upper edges (s) of the stage duration histogram bins
+DURATION_BINS = (5, 10, 20, 30, 60, 120, 300)
+
+
+class Stage():
+    """A stage of a run: a coroutine function that takes the instance and
+    returns the name of the next stage, which must be one of transitions.
+    """
+    def __init__(self,
+                 name: str,
+                 action: Callable[[Any], Awaitable[str]],
+                 transitions: Iterable[str]) -> None:
+        self.name = name
+        self.action = action
+        self.transitions = tuple(transitions)
+
+
+class StageMachine():
+    """Run declared stages until the final stage is reached, timing each one.
+
+    The current stage is kept in the instance's `stage` attribute, so the
+    run can be started at any stage by setting it first. Transitions are kept
+    as (timestamp, from, to) and durations (s) per stage, each up to history
+    entries. When a run starts again at the initial stage, the time spent in
+    each stage of the previous run is logged.
+    """
+    def __init__(self,
+                 stages: Iterable[Stage],
+                 initial: str='join',
+                 final: str='done',
+                 log: Callable[[str], None]=print,
+                 history: int=1000) -> None:
+        self.stages = collections.OrderedDict((stage.name, stage)
+            for stage in stages)
+        self.initial = initial
+        self.final = final
+        self.log = log
+        for stage in self.stages.values():
+            unknown = set(stage.transitions) - set(self.stages) - {final}
+            if unknown:
+                raise KeyError('Stage ' + stage.name + ' goes to unknown '
+                    'stages: ' + ', '.join(sorted(unknown)))
+        self.transitions = collections.deque(maxlen=history)
+        self.durations = {name: collections.deque(maxlen=history)
+            for name in self.stages}
+        # Time spent in each stage of the current run
+        self.run_durations = collections.OrderedDict()
+
+    async def run(self,
+                  inst) -> None:
+        """Run stages from the instance's current stage until the final
+        stage.
+        """
+        while inst.stage != self.final:
+            stage = self.stages[inst.stage]
+            start = time.time()
+            next_stage = await stage.action(inst)
+            now = time.time()
+            if next_stage not in stage.transitions:
+                raise ValueError('Stage ' + stage.name + ' cannot go to stage '
+                    + repr(next_stage))
+            self.record(stage.name, next_stage, now, now - start)
+            inst.stage = next_stage
+            # The stage is shown in the statistics panel.
+            inst.stats_dirty = True
+
+    def record(self,
+               stage: str,
+               next_stage: str,
+               timestamp: float,
+               duration: float) -> None:
+        """Record a transition and the time spent in the stage it ended."""
+        self.transitions.append((timestamp, stage, next_stage))
+        self.durations[stage].append(duration)
+        self.run_durations[stage] = self.run_durations.get(stage, 0) + duration
+        self.log('Stage: %s -> %s after %.1f s' % (stage, next_stage, duration))
+        if next_stage in (self.initial, self.final):
+            self.log('Run time by stage: ' + ', '.join('%s %.0f s'
+                % item for item in self.run_durations.items()))
+            self.run_durations.clear()
+
+    def histogram(self,
+                  stage: str) -> Dict[str, int]:
+        """Return the number of times a stage took each range of time (s)."""
+        counts = numpy.histogram(numpy.array(self.durations[stage]),
+            (0,) + DURATION_BINS + (numpy.inf,))[0]
+        labels = ['<' + str(edge) for edge in DURATION_BINS] + [
+            '>=' + str(DURATION_BINS[-1])]
+        return dict(zip(labels, (int(count) for count in counts)))
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Return how many times each stage ran and how long it took (s)."""
+        summary = {}
+        for name, durations in self.durations.items():
+            if len(durations) == 0:
+                continue
+            times = numpy.array(durations)
+            summary[name] = {'count': len(times),
+                'total_s': round(float(numpy.sum(times)), 1),
+                'mean_s': round(float(numpy.mean(times)), 1),
+                'p50_s': round(float(numpy.percentile(times, 50)), 1),
+                'p95_s': round(float(numpy.percentile(times, 95)), 1)}
+        return summary
+
+    def __str__(self):
+        lines = []
+        for name, stats in self.summary().items():
+            lines.append(('%s: %d times, %.0f s total, mean %.1f s, p50 %.1f s'
+                ' / p95 %.1f s' % (name, stats['count'], stats['total_s'],
+                stats['mean_s'], stats['p50_s'], stats['p95_s']))
+                + ', histogram (s) ' + ' '.join(label + ':' + str(count)
+                for label, count in self.histogram(name).items()))
+        return '\n'.join(lines) if lines else 'No stages completed'
@@ -0,0 +1,26 @@
+# Corpus
+#   Load the labeled frames of the benchmark corpus (see
+#   Benchmarks/benchmark_ocr.py) for tests that check behaviour on real
+#   captures. Tests using them are skipped when the corpus is empty.
+
+import json
+import os
+import cv2
+
+CORPUS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'Benchmarks', 'Corpus')
+
+
+def load_entries(directory: str=CORPUS_DIRECTORY) -> list:
+    """Return the corpus entries, each with its frame loaded as 'image'."""
+    path = os.path.join(directory, 'labels.json')
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as file:
+        entries = json.load(file)
+    loaded = []
+    for entry in entries:
+        image = cv2.imread(os.path.join(directory, entry['frame']))
+        if image is not None:
+            loaded.append(dict(entry, image=image))
+    return loaded
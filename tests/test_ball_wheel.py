@@ -0,0 +1,152 @@
+import asyncio
+import pytest
+pytest.importorskip('enchant')
+from ball_wheel import BallWheel
+
+WHEEL = ['Poke Ball', 'Great Ball', 'Ultra Ball', 'Premier Ball', 'Beast Ball']
+
+
+def learn(wheel, balls, start=0, steps=None):
+    """Step through a wheel of balls from a starting index, recording each
+    ball seen, and return the final position.
+    """
+    position = wheel.locate(balls[start])
+    for step in range(1, (len(balls) if steps is None else steps) + 1):
+        position = wheel.record_step(position, balls[(start + step) % len(balls)])
+    return position
+
+
+def test_stepping_all_the_way_around_completes_the_order():
+    wheel = BallWheel()
+    position = learn(wheel, WHEEL)
+    assert wheel.order == WHEEL
+    assert wheel.complete
+    assert position == 0
+
+
+def test_partial_order_counts_presses_ahead_only():
+    wheel = BallWheel()
+    learn(wheel, WHEEL, steps=2)
+    assert not wheel.complete
+    assert wheel.count_presses('Poke Ball', 'Ultra Ball') == 2
+    # Behind the current ball: the unseen part of the wheel is in between.
+    assert wheel.count_presses('Ultra Ball', 'Great Ball') == -1
+    # Not learned yet.
+    assert wheel.count_presses('Poke Ball', 'Beast Ball') == -1
+
+
+def test_complete_order_wraps_around():
+    wheel = BallWheel()
+    learn(wheel, WHEEL)
+    assert wheel.count_presses('Premier Ball', 'Great Ball') == 3
+    assert wheel.count_presses('Great Ball', 'Poke Ball') == 4
+    assert wheel.count_presses('Poke Ball', 'Master Ball') == -1
+
+
+def test_ocr_noise_is_matched():
+    wheel = BallWheel()
+    learn(wheel, WHEEL)
+    assert wheel.find('Ultra BaII') == 2
+    assert wheel.find('Dusk Ball') == -1
+    assert wheel.count_presses('Grcat Ball', 'Premier Ball') == 2
+
+
+def test_inconsistent_step_restarts_the_order():
+    wheel = BallWheel()
+    learn(wheel, WHEEL)
+    wheel.complete = False
+    # Great Ball ran out, so Ultra Ball now follows Poke Ball.
+    position = wheel.record_step(0, 'Ultra Ball')
+    assert position == 0
+    assert wheel.order == ['Ultra Ball']
+
+
+def test_wheel_change_is_relearned():
+    wheel = BallWheel()
+    learn(wheel, WHEEL)
+    wheel.reset()
+    changed = [ball for ball in WHEEL if ball != 'Great Ball']
+    learn(wheel, changed, start=2)
+    assert wheel.complete
+    assert wheel.count_presses('Poke Ball', 'Ultra Ball') == 1
+
+
+class FakeWheelInstance():
+    """Just enough of MaxLairInstance for select_ball: a wheel of balls the
+    presses move through, read back by check_ball.
+    """
+    def __init__(self, balls, target, index=0):
+        from MaxLairInstance import MaxLairInstance
+        self.select_ball = MaxLairInstance.select_ball.__get__(self)
+        self.press_ball_wheel = MaxLairInstance.press_ball_wheel.__get__(self)
+        self.balls = balls
+        self.target = target
+        self.index = index
+        self.ball_wheel = BallWheel()
+        self.presses = 0
+        self.bursts = 0
+        self.events = []
+
+    def get_target_ball(self):
+        return self.target
+
+    async def check_ball(self):
+        return self.balls[self.index]
+
+    async def push_buttons(self, *commands):
+        self.bursts += 1
+        self.presses += len(commands)
+        self.index = (self.index + len(commands)) % len(self.balls)
+
+    def log(self, string):
+        pass
+
+    def record_event(self, event):
+        self.events.append(event)
+
+
+def select(inst):
+    inst.presses = inst.bursts = 0
+    asyncio.run(inst.select_ball())
+    assert inst.balls[inst.index] == inst.target
+
+
+def test_select_ball_uses_the_learned_order():
+    pytest.importorskip('pytesseract')
+    inst = FakeWheelInstance(WHEEL, 'Premier Ball')
+    select(inst)
+    assert inst.presses == 3
+    inst.index = 0
+    select(inst)
+    assert inst.bursts == 1 and inst.presses == 3
+
+
+def test_select_ball_target_behind_with_partial_order():
+    pytest.importorskip('pytesseract')
+    inst = FakeWheelInstance(WHEEL, 'Ultra Ball')
+    select(inst)
+    # From Premier Ball, Ultra Ball is behind and the order ends at Ultra.
+    inst.target = 'Premier Ball'
+    select(inst)
+    inst.target = 'Great Ball'
+    select(inst)
+    assert inst.index == 1
+    # The wheel wrapped, so the order is complete and one burst suffices.
+    assert inst.ball_wheel.complete
+    inst.target = 'Ultra Ball'
+    select(inst)
+    assert inst.bursts == 1
+
+
+def test_select_ball_relearns_a_changed_wheel():
+    pytest.importorskip('pytesseract')
+    inst = FakeWheelInstance(WHEEL, 'Poke Ball', index=1)
+    select(inst)
+    inst.target = 'Great Ball'
+    select(inst)
+    assert inst.ball_wheel.complete
+    inst.balls = [ball for ball in WHEEL if ball != 'Ultra Ball']
+    inst.index = 0
+    inst.target = 'Beast Ball'
+    select(inst)
+    assert inst.events == ['ball warning']
@@ -0,0 +1,55 @@
+import types
+import numpy
+import pytest
+from calibration import (Calibration, calibrate, load_calibration,
+    save_calibration)
+
+
+def test_apply_maps_both_corners():
+    calibration = Calibration((0.5, 0.9), (0.25, 0.05))
+    assert calibration.apply(((0, 0), (1, 1))) == ((0.25, 0.05), (0.75, 0.95))
+
+
+def test_apply_calibration_corrects_only_the_listed_rectangles():
+    pytest.importorskip('enchant')
+    pytest.importorskip('pytesseract')
+    import MaxLairInstance
+    inst = types.SimpleNamespace(log=lambda string: None,
+        name_block_ocr=object())
+    for attribute in MaxLairInstance.CALIBRATED_RECTS:
+        setattr(inst, attribute, ((0.2, 0.2), (0.4, 0.4)))
+    profile = inst.name_block_ocr
+    MaxLairInstance.MaxLairInstance.apply_calibration(inst,
+        Calibration((1, 1), (0.1, 0)))
+    for attribute in MaxLairInstance.CALIBRATED_RECTS:
+        assert getattr(inst, attribute) == ((0.3, 0.2), (0.5, 0.4))
+    assert inst.name_block_ocr is profile
+
+
+def picture(borders=(0, 0, 0, 0), shape=(90, 160)):
+    """A bright game picture inside black (top, bottom, left, right) borders."""
+    frame = numpy.zeros(shape + (3,), numpy.uint8)
+    top, bottom, left, right = borders
+    frame[top:shape[0] - bottom, left:shape[1] - right] = 200
+    return frame
+
+
+def test_small_overscan_is_measured():
+    correction = calibrate([picture((2, 2, 4, 4))])
+    assert correction.scale == pytest.approx((0.95, 0.9556), abs=1e-3)
+    assert correction.offset == pytest.approx((0.025, 0.0222), abs=1e-3)
+
+
+def test_dark_scene_edges_are_not_taken_for_borders():
+    # Dark edges on one side only change the aspect ratio.
+    assert calibrate([picture((0, 0, 0, 30))]) is None
+    # A picture much smaller than the frame.
+    assert calibrate([picture((20, 20, 36, 36))]) is None
+
+
+def test_implausible_cached_calibration_is_ignored(tmp_path):
+    path = str(tmp_path / 'calibration.json')
+    save_calibration(path, '0', Calibration((0.5, 0.9), (0.25, 0.05)))
+    assert load_calibration(path, '0') is None
+    save_calibration(path, '0', Calibration((0.98, 0.98), (0.01, 0.01)))
+    assert load_calibration(path, '0').scale == (0.98, 0.98)
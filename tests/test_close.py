@@ -0,0 +1,70 @@
+import concurrent.futures
+import threading
+import time
+import types
+import pytest
+pytest.importorskip('enchant')
+pytest.importorskip('pytesseract')
+from MaxLairInstance import MaxLairInstance
+
+
+class Helper():
+    """Background helper that takes a while to stop, or never does."""
+    def __init__(self, name, stops, stop_time=0, running=True):
+        self.name = name
+        self.stops = stops
+        self.stop_time = stop_time
+        self.running = running
+        self.num_clips = 2
+
+    def stop(self, timeout):
+        self.stops.append((self.name, timeout))
+        if self.stop_time > timeout:
+            time.sleep(timeout)
+            return False
+        time.sleep(self.stop_time)
+        self.running = False
+        return True
+
+    def __str__(self):
+        return '3 presses sent'
+
+
+def make_instance(clip_time=0, grabber_time=0, writer_running=True):
+    stops = []
+    messages = []
+    inst = types.SimpleNamespace(log=messages.append,
+        ocr_executor=concurrent.futures.ThreadPoolExecutor(1),
+        clip_recorder=Helper('clips', stops, clip_time),
+        frame_grabber=Helper('grabber', stops, grabber_time),
+        serial_writer=Helper('writer', stops, running=writer_running))
+    return inst, stops, messages
+
+
+def test_helpers_share_one_deadline():
+    inst, stops, messages = make_instance(clip_time=0.3, grabber_time=10)
+    start = time.time()
+    MaxLairInstance.close(inst, timeout=1)
+    assert time.time() - start < 1.5
+    # The clip recorder stops first, and each helper gets what is left.
+    assert [name for name, _ in stops] == ['clips', 'grabber', 'writer']
+    assert stops[0][1] == pytest.approx(1, abs=0.05)
+    assert stops[1][1] == pytest.approx(0.7, abs=0.05)
+    assert stops[2][1] == pytest.approx(0, abs=0.05)
+    # The serial writer had nothing left to send, so it stopped in no time.
+    assert messages == ['WARNING: Frame grabber did not stop within 1 s.',
+        'Clips saved: 2', 'Serial: 3 presses sent']
+
+
+def test_queued_ocr_is_cancelled_and_idle_helpers_are_skipped():
+    inst, stops, messages = make_instance(writer_running=False)
+    inst.clip_recorder = None
+    release = threading.Event()
+    running = inst.ocr_executor.submit(release.wait, 5)
+    queued = inst.ocr_executor.submit(time.sleep, 0)
+    MaxLairInstance.close(inst, timeout=1)
+    release.set()
+    assert queued.cancelled()
+    assert running.result(1)
+    assert stops == [('grabber', pytest.approx(1, abs=0.05))]
+    assert messages == []
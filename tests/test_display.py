@@ -0,0 +1,98 @@
+import json
+import types
+import urllib.error
+import urllib.request
+import cv2
+import numpy
+import pytest
+import display
+from display import FrameTimer
+from video_capture import HeldFrame
+
+
+def test_frame_timer_paces_and_summarizes(monkeypatch):
+    clock = types.SimpleNamespace(now=0)
+    monkeypatch.setattr(display, 'time',
+        types.SimpleNamespace(perf_counter=lambda: clock.now))
+    timer = FrameTimer(target_fps=10, history=3)
+    assert timer.summary()['fps'] == 0
+    waits = []
+    # Frames start every 0.1 s except the last, and take 10, 20, 30 then
+    # 150 ms to render.
+    for start, render in ((0, 0.01), (0.1, 0.02), (0.2, 0.03), (0.3, 0.15)):
+        clock.now = start
+        timer.start_frame()
+        clock.now += render
+        waits.append(timer.end_frame())
+    assert waits == pytest.approx([0.09, 0.08, 0.07, 0])
+    clock.now = 0.6
+    timer.start_frame()
+    assert timer.frames == 4
+    # Only the last 3 render times and frame intervals are kept.
+    assert list(timer.render_times) == pytest.approx([0.02, 0.03, 0.15])
+    summary = timer.summary()
+    assert summary['fps'] == pytest.approx(1 / (0.5 / 3), abs=0.1)
+    assert summary['render_p50_ms'] == 30
+    assert summary['frame_max_ms'] == 300
+    assert str(timer).startswith('6.0 FPS, render p50 30.0 ms')
+
+
+def make_dashboard(frame):
+    released = []
+    acquired = []
+
+    def acquire_frame():
+        acquired.append(frame)
+        return HeldFrame(1, frame, lambda: released.append(frame))
+    dashboard = display.Dashboard(acquire_frame, lambda: {'Runs': 3}, port=0,
+        fps=2, width=64)
+    return dashboard, acquired, released
+
+
+def get(dashboard, path):
+    host, port = dashboard.server.server_address[:2]
+    return urllib.request.urlopen('http://%s:%d%s' % (host, port, path),
+        timeout=5)
+
+
+def test_dashboard_encodes_each_frame_once_per_period():
+    frame = numpy.zeros((90, 160, 3), numpy.uint8)
+    dashboard, acquired, released = make_dashboard(frame)
+    try:
+        jpeg = dashboard.get_jpeg()
+        assert dashboard.get_jpeg() is jpeg
+        assert len(acquired) == len(released) == 1
+        assert cv2.imdecode(numpy.frombuffer(jpeg, numpy.uint8),
+            cv2.IMREAD_COLOR).shape == (36, 64, 3)
+        dashboard.encoded_time -= dashboard.period
+        dashboard.get_jpeg()
+        assert len(acquired) == len(released) == 2
+    finally:
+        dashboard.server.server_close()
+
+
+def test_dashboard_without_a_frame_has_no_preview():
+    dashboard, acquired, released = make_dashboard(None)
+    try:
+        assert dashboard.get_jpeg() is None
+        assert len(released) == 1
+    finally:
+        dashboard.server.server_close()
+
+
+def test_dashboard_serves_stats_and_stream_until_stopped():
+    dashboard, acquired, released = make_dashboard(
+        numpy.zeros((90, 160, 3), numpy.uint8))
+    dashboard.start()
+    try:
+        assert json.load(get(dashboard, '/stats.json')) == {'Runs': 3}
+        assert b'/stream.mjpg' in get(dashboard, '/').read()
+        with pytest.raises(urllib.error.HTTPError):
+            get(dashboard, '/missing')
+        stream = get(dashboard, '/stream.mjpg')
+        assert stream.readline() == b'--frame\r\n'
+        assert stream.readline() == b'Content-Type: image/jpeg\r\n'
+    finally:
+        assert dashboard.stop(5)
+    # Stopping ends the stream being served.
+    assert stream.read().count(b'--frame') <= 2
@@ -0,0 +1,91 @@
+import time
+import pytest
+import serial_protocol
+from fake_serial import FirmwareEmulator, RECEIVE_TIMEOUT
+
+ACK = serial_protocol.SEQUENCE_ACK
+NAK = serial_protocol.SEQUENCE_NAK
+
+
+@pytest.fixture
+def emulator():
+    emulator = FirmwareEmulator()
+    yield emulator
+    emulator.close()
+
+
+def replies(emulator, quiet=0.2):
+    """Collect replies until none arrive for quiet seconds."""
+    data = b''
+    while True:
+        reply = emulator.read(256, timeout=quiet)
+        if not reply:
+            return data
+        data += reply
+
+
+def pressed(emulator):
+    return bytes(button for _, button in emulator.presses)
+
+
+def frame(*buttons, duration=0.02):
+    return bytearray(serial_protocol.encode_sequence(
+        [(button, duration) for button in buttons]))
+
+
+def test_sequence_is_pressed_and_acknowledged(emulator):
+    emulator.write(bytes(frame(b'a', b'b')))
+    assert replies(emulator) == ACK
+    assert pressed(emulator) == b'ab'
+
+
+def test_bad_count_skips_the_rest_of_the_frame(emulator):
+    data = frame(b'a', b'b')
+    data[1] = serial_protocol.MAX_SEQUENCE_LENGTH + 1
+    emulator.write(bytes(data) + b'x')
+    # Only the command after the rejected frame is pressed and echoed.
+    assert replies(emulator) == NAK + b'x'
+    assert pressed(emulator) == b'x'
+
+
+def test_bad_checksum_is_rejected(emulator):
+    data = frame(b'a')
+    data[-2] ^= 1
+    emulator.write(bytes(data) + b'y')
+    assert replies(emulator) == NAK + b'y'
+    assert pressed(emulator) == b'y'
+
+
+def test_missing_end_discards_through_the_next_end(emulator):
+    data = frame(b'a')
+    data[-1] = ord('b')
+    emulator.write(bytes(data) + b'ab}x')
+    assert replies(emulator) == NAK + b'x'
+    assert pressed(emulator) == b'x'
+
+
+def test_truncated_frame_times_out(emulator):
+    emulator.write(bytes(frame(b'a', b'b')[:5]))
+    start = time.time()
+    assert emulator.read(1, timeout=1) == NAK
+    assert time.time() - start >= RECEIVE_TIMEOUT - 0.01
+    emulator.write(b'x')
+    assert replies(emulator) == b'x'
+    assert pressed(emulator) == b'x'
+
+
+def test_frame_during_a_sequence_is_rejected(emulator):
+    emulator.write(bytes(frame(b'a', duration=0.3)))
+    time.sleep(0.05)
+    emulator.write(bytes(frame(b'b')))
+    assert replies(emulator, quiet=0.5) == NAK + ACK
+    assert pressed(emulator) == b'a'
+
+
+def test_burst_of_commands_presses_only_the_last(emulator):
+    emulator.write(b'a')
+    time.sleep(0.01)
+    # These arrive while 'a' is still being sent and overwrite each other.
+    emulator.write(b'bxy')
+    assert replies(emulator) == b'abxy'
+    assert pressed(emulator) == b'ay'
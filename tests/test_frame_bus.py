@@ -0,0 +1,142 @@
+import asyncio
+import types
+import numpy
+import pytest
+from frame_bus import FrameBus, SharedCapture
+
+SHAPE = (4, 6, 3)
+
+
+def frame(value):
+    return numpy.full(SHAPE, value, numpy.uint8)
+
+
+@pytest.fixture
+def capture():
+    # The capture process isn't started; frames are published by the test.
+    capture = SharedCapture('0', resolution=SHAPE[1::-1], slots=3)
+    yield capture
+    capture.bus.close()
+
+
+def test_held_frame_survives_overwriting_every_other_slot(capture):
+    capture.bus.publish(frame(1), timestamp=1)
+    with capture.acquire_frame() as held:
+        assert held.timestamp == 1
+        for value in range(2, 12):
+            capture.bus.publish(frame(value), timestamp=value)
+        assert numpy.all(held.frame == 1)
+        # Only the other slots were reused.
+        assert capture.bus.latest_timestamp() == 11
+    assert held.frame is None
+    assert not capture.bus.pins.any()
+
+
+def test_released_slot_is_reused(capture):
+    capture.bus.publish(frame(1), timestamp=1)
+    held = capture.acquire_frame()
+    slot = int(capture.bus.header[0])
+    held.release()
+    held.release()
+    assert capture.bus.pins[slot] == 0
+    for value in range(2, 2 + capture.bus.slots):
+        capture.bus.publish(frame(value), timestamp=value)
+    assert not numpy.any(capture.bus.frames[slot] == 1)
+
+
+def test_get_frame_returns_a_copy_and_pins_nothing(capture):
+    capture.bus.publish(frame(1), timestamp=1)
+    timestamp, img = capture.get_frame()
+    assert timestamp == 1
+    assert not img.flags.writeable
+    for value in range(2, 12):
+        capture.bus.publish(frame(value), timestamp=value)
+    assert numpy.all(img == 1)
+    assert not capture.bus.pins.any()
+    success, img = capture.read()
+    assert success and numpy.all(img == 11) and img.flags.writeable
+    assert not capture.bus.pins.any()
+
+
+def test_stage_frames_survive_awaits_while_slots_are_reused(capture):
+    pytest.importorskip('enchant')
+    pytest.importorskip('pytesseract')
+    from MaxLairInstance import MaxLairInstance
+    # The display and the stages share the event loop's thread, and
+    # get_new_frame reads from executor threads.
+    inst = types.SimpleNamespace(frame_grabber=capture, frame_timestamp=0)
+    inst.get_frame = MaxLairInstance.get_frame.__get__(inst)
+    inst.get_new_frame = MaxLairInstance.get_new_frame.__get__(inst)
+
+    async def publish(values):
+        for value in values:
+            capture.bus.publish(frame(value), timestamp=value)
+            await asyncio.sleep(0)
+
+    async def read_across_awaits():
+        capture.bus.publish(frame(1), timestamp=1)
+        image = inst.get_frame()
+        capture.bus.publish(frame(2), timestamp=2)
+        new_image = await inst.get_new_frame()
+        # As in read_selectable_pokemon, the images are held while other
+        # tasks run and every slot is published to several times.
+        await asyncio.gather(publish(range(3, 8)), publish(range(8, 13)))
+        return image, new_image
+
+    capture.running = True
+    try:
+        image, new_image = asyncio.run(read_across_awaits())
+    finally:
+        capture.running = False
+    assert numpy.all(image == 1) and numpy.all(new_image == 2)
+    assert capture.bus.latest_timestamp() == 12
+    assert not capture.bus.pins.any()
+
+
+def test_display_and_thumbnails_read_in_place(capture, monkeypatch):
+    pytest.importorskip('enchant')
+    pytest.importorskip('pytesseract')
+    import image_processing
+    from MaxLairInstance import MaxLairInstance
+    inst = types.SimpleNamespace(frame_grabber=capture, frame_timestamp=0)
+    for name in ('get_thumbnail', 'get_new_thumbnail', 'acquire_display_frame'):
+        setattr(inst, name, getattr(MaxLairInstance, name).__get__(inst))
+    # Copying the frame would fail.
+    monkeypatch.setattr(capture, 'get_frame', None)
+    capture.bus.publish(frame(1), timestamp=1)
+    capture.running = True
+    try:
+        assert numpy.array_equal(inst.get_thumbnail(),
+            image_processing.get_thumbnail(frame(1)))
+        assert inst.frame_timestamp == 1
+        capture.bus.publish(frame(2), timestamp=2)
+        thumbnail = asyncio.run(inst.get_new_thumbnail())
+        assert numpy.all(thumbnail == 2) and inst.frame_timestamp == 2
+        with inst.acquire_display_frame() as held:
+            assert numpy.all(held.frame == 2)
+            assert capture.bus.pins.sum() == 1
+    finally:
+        capture.running = False
+    assert not capture.bus.pins.any()
+
+
+def test_nothing_published(capture):
+    with capture.acquire_frame(timeout=0) as held:
+        assert held.frame is None
+    assert capture.get_frame(timeout=0) == (0, None)
+    assert capture.read() == (False, None)
+
+
+def test_reader_process_view_matches():
+    bus = FrameBus(shape=SHAPE, slots=3)
+    try:
+        reader = FrameBus(bus.name, lock=bus.lock)
+        bus.publish(frame(7), timestamp=1)
+        slot, sequence, timestamp, img = reader.acquire()
+        assert sequence == 1 and timestamp == 1 and numpy.all(img == 7)
+        assert bus.pins[slot] == 1
+        reader.release(slot)
+        assert bus.pins[slot] == 0
+        reader.close()
+    finally:
+        bus.close()
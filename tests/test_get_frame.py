@@ -0,0 +1,75 @@
+import types
+import numpy
+import pytest
+pytest.importorskip('enchant')
+pytest.importorskip('pytesseract')
+import MaxLairInstance
+
+
+class FailingCapture():
+    """Video source whose first few reads fail."""
+    def __init__(self, failures):
+        self.failures = failures
+
+    def read(self):
+        if self.failures > 0:
+            self.failures -= 1
+            return False, None
+        return True, numpy.zeros((9, 16, 3), numpy.uint8)
+
+
+def make_instance(failures):
+    inst = types.SimpleNamespace(cap=FailingCapture(failures),
+        frame_grabber=types.SimpleNamespace(running=False),
+        base_resolution=None)
+    inst.get_frame = MaxLairInstance.MaxLairInstance.get_frame.__get__(inst)
+    return inst
+
+
+def test_failed_reads_are_retried(monkeypatch):
+    monkeypatch.setattr(MaxLairInstance, 'FRAME_READ_RETRY_DELAY', 0)
+    inst = make_instance(MaxLairInstance.FRAME_READ_ATTEMPTS - 1)
+    img = inst.get_frame()
+    assert img.shape == (9, 16, 3)
+    assert not img.flags.writeable
+    assert inst.latest_frame is img
+
+
+def test_no_frame_raises_a_clear_error(monkeypatch):
+    monkeypatch.setattr(MaxLairInstance, 'FRAME_READ_RETRY_DELAY', 0)
+    inst = make_instance(MaxLairInstance.FRAME_READ_ATTEMPTS)
+    with pytest.raises(ConnectionError):
+        inst.get_frame()
+
+
+def test_grabber_without_frames_raises_a_clear_error():
+    inst = make_instance(0)
+    inst.frame_grabber = types.SimpleNamespace(running=True,
+        get_frame=lambda newer_than: (0, None))
+    with pytest.raises(ConnectionError):
+        inst.get_frame()
+
+
+def test_display_does_not_read_the_source_without_a_grabber():
+    inst = make_instance(0)
+    inst.latest_frame = None
+    inst.frame_timestamp = 0
+    inst.acquire_display_frame = (MaxLairInstance.MaxLairInstance
+        .acquire_display_frame.__get__(inst))
+    inst.cap.read = None
+    with inst.acquire_display_frame() as held:
+        assert held.frame is None
+    inst.cap = FailingCapture(0)
+    img = inst.get_frame()
+    inst.cap.read = None
+    with inst.acquire_display_frame() as held:
+        assert held.frame is img
+
+
+def test_shiny_event_saves_both_a_clip_and_a_screenshot():
+    events = []
+    inst = types.SimpleNamespace(screenshot_requested=False,
+        clip_recorder=types.SimpleNamespace(trigger=events.append))
+    MaxLairInstance.MaxLairInstance.record_event(inst, 'shiny', screenshot=True)
+    assert events == ['shiny']
+    assert inst.screenshot_requested
@@ -0,0 +1,84 @@
+import cv2
+import numpy
+import pytest
+import image_processing
+from tests import corpus
+
+SECTIONS = (
+    ((0, 0.6), (1, 1)),
+    ((0.485, 0.28), (0.60, 0.33)),
+    ((0.485, 0.80), (0.60, 0.855)),
+    ((0.69, 0.63), (0.88, 0.68)),
+    ((0.075, 0.53), (0.105, 0.58)),
+)
+
+
+def full_frame_section(img, section, threshold, invert):
+    """The pipeline read_text used before preprocessing was made crop-first:
+    convert and threshold the whole frame, then crop.
+    """
+    h, w = img.shape[:2]
+    if threshold:
+        img = cv2.inRange(cv2.cvtColor(img, cv2.COLOR_BGR2HSV),
+            image_processing.TEXT_LOWER_HSV, image_processing.TEXT_UPPER_HSV)
+    if invert:
+        img = cv2.bitwise_not(img)
+    return img[round(section[0][1]*h):round(section[1][1]*h),
+               round(section[0][0]*w):round(section[1][0]*w)]
+
+
+def frames():
+    random = numpy.random.default_rng(0)
+    yield 'random', random.integers(0, 256, (1080, 1920, 3), numpy.uint8)
+    yield 'random_720p', random.integers(0, 256, (720, 1280, 3), numpy.uint8)
+    for entry in corpus.load_entries():
+        yield entry['frame'], entry['image']
+
+
+@pytest.mark.parametrize('threshold,invert', ((True, True), (True, False),
+    (False, True), (False, False)))
+def test_crop_first_matches_full_frame(threshold, invert):
+    buffers = {}
+    for name, frame in frames():
+        for section in SECTIONS:
+            expected = full_frame_section(frame, section, threshold, invert)
+            # Twice, so the second call reuses the first call's buffers.
+            for __ in range(2):
+                result = image_processing.preprocess_section(frame, section,
+                    threshold, invert, buffers)
+                assert numpy.array_equal(result, expected), (name, section)
+
+
+def test_crop_hsv_matches_full_frame():
+    for name, frame in frames():
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        for section in SECTIONS:
+            assert numpy.array_equal(image_processing.crop_hsv(frame, section,
+                {}), image_processing.crop(hsv, section)), (name, section)
+
+
+def test_corpus_frames_compared():
+    if not corpus.load_entries():
+        pytest.skip('The corpus in Benchmarks/Corpus is empty.')
+
+
+def dialog_section():
+    """A dark dialogue box with two lines of white text, as a 1080p section."""
+    img = numpy.zeros((432, 1920, 3), numpy.uint8)
+    cv2.putText(img, 'What will you do?', (100, 120),
+        cv2.FONT_HERSHEY_SIMPLEX, 1.6, (255, 255, 255), 3)
+    cv2.putText(img, 'Fight  Cheer  Run', (100, 300),
+        cv2.FONT_HERSHEY_SIMPLEX, 1.6, (255, 255, 255), 3)
+    return img
+
+
+def test_lines_located_at_processing_height_fit_the_full_frame():
+    img = dialog_section()
+    full = image_processing.locate_text_lines(img, 1080)
+    scaled = image_processing.locate_text_lines(img, 1080,
+        processing_height=540)
+    assert len(full) == len(scaled) == 2
+    for expected, line in zip(full, scaled):
+        assert all(abs(a - b) <= 8 for a, b in zip(expected, line))
+        assert 0 <= line[0] < line[1] <= img.shape[0]
+        assert 0 <= line[2] < line[3] <= img.shape[1]
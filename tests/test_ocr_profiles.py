@@ -0,0 +1,18 @@
+import numpy
+from ocr_profiles import OCRProfile
+
+
+def test_sections_of_small_frames_are_enlarged_to_the_reference_size():
+    profile = OCRProfile('--psm 8', dpi=70, scale=2)
+    section = numpy.zeros((36, 100), numpy.uint8)
+    assert profile.prepare(section, 720).shape == (108, 300)
+    assert '--dpi 140' in profile.get_config(720)
+
+
+def test_sections_of_large_frames_keep_their_detail():
+    profile = OCRProfile('--psm 8', dpi=70)
+    section = numpy.zeros((108, 300), numpy.uint8)
+    assert profile.prepare(section, 2160) is section
+    assert '--dpi 140' in profile.get_config(2160)
+    assert profile.get_config() == profile.config
+    assert '--dpi 70' in profile.config
@@ -0,0 +1,39 @@
+import asyncio
+import concurrent.futures
+import types
+import pytest
+pytest.importorskip('enchant')
+pytesseract = pytest.importorskip('pytesseract')
+from MaxLairInstance import MaxLairInstance
+
+
+def make_instance():
+    inst = types.SimpleNamespace(ocr_timeout=1, messages=[],
+        ocr_executor=concurrent.futures.ThreadPoolExecutor(1))
+    inst.log = inst.messages.append
+    inst.run_tesseract = MaxLairInstance.run_tesseract.__get__(inst)
+    return inst
+
+
+def fail_with(error):
+    def image_to_string(*args, **kwargs):
+        raise error
+    return image_to_string
+
+
+def test_timeout_returns_no_text(monkeypatch):
+    monkeypatch.setattr(pytesseract, 'image_to_string',
+        fail_with(RuntimeError('Tesseract process timeout')))
+    inst = make_instance()
+    assert asyncio.run(inst.run_tesseract(None)) == ''
+    assert inst.messages == ['WARNING: Tesseract took longer than 1 s to read '
+        'text.']
+
+
+def test_tesseract_errors_propagate(monkeypatch):
+    monkeypatch.setattr(pytesseract, 'image_to_string',
+        fail_with(pytesseract.TesseractError(1, 'Failed loading language')))
+    inst = make_instance()
+    with pytest.raises(pytesseract.TesseractError):
+        asyncio.run(inst.run_tesseract(None))
+    assert inst.messages == []
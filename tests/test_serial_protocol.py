@@ -0,0 +1,47 @@
+import pytest
+import serial_protocol
+from fake_serial import FirmwareEmulator, PRESS_TIME
+
+
+def test_sequence_frame_layout():
+    data = serial_protocol.encode_sequence([(b'a', 0.5), (b'b', 3)])
+    assert data == (b'{\x02a\x32\x00b\x2c\x01'
+        + bytes((2 ^ ord('a') ^ 0x32 ^ ord('b') ^ 0x2c ^ 0x01,)) + b'}')
+
+
+def test_sequence_length_is_limited():
+    with pytest.raises(ValueError):
+        serial_protocol.encode_sequence([])
+    with pytest.raises(ValueError):
+        serial_protocol.encode_sequence([(b'a', 0.1)]
+            * (serial_protocol.MAX_SEQUENCE_LENGTH + 1))
+    commands = [(b'a', 0.1)] * 45
+    assert [len(sequence) for sequence
+        in serial_protocol.split_sequence(commands)] == [20, 20, 5]
+
+
+def test_durations_are_rounded_and_clamped():
+    assert serial_protocol.duration_units(0.124) == 12
+    assert serial_protocol.duration_units(0.005) == (
+        serial_protocol.MIN_DURATION_UNITS)
+    assert serial_protocol.duration_units(1000) == (
+        serial_protocol.MAX_DURATION_UNITS)
+    assert serial_protocol.sequence_duration([(b'a', 0.124), (b'b', 0),
+        (b'x', 1)]) == pytest.approx(1.18)
+
+
+def test_short_presses_are_released_before_the_next():
+    # e.g. battle.skip_dialogue, which is shorter than a press
+    assert serial_protocol.MIN_DURATION_UNITS * serial_protocol.DURATION_UNIT \
+        >= PRESS_TIME + 0.008
+    emulator = FirmwareEmulator()
+    try:
+        emulator.write(serial_protocol.encode_sequence(
+            [(b'b', 0.005), (b'b', 0.005), (b'b', 0.005)]))
+        assert emulator.read(1, timeout=1) == serial_protocol.SEQUENCE_ACK
+    finally:
+        emulator.close()
+    times = [timestamp for timestamp, _ in emulator.presses]
+    assert len(times) == 3
+    for previous, current in zip(times, times[1:]):
+        assert current - previous >= PRESS_TIME + 0.008 - 0.001
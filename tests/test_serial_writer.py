@@ -0,0 +1,34 @@
+import time
+from fake_serial import FakeSerial
+from serial_writer import SerialWriter
+
+
+def test_stopping_logs_the_presses_discarded():
+    messages = []
+    com = FakeSerial(timeout=0.05)
+    writer = SerialWriter(com, messages.append)
+    writer.start()
+    try:
+        writer.send([(b'a', 10), (b'b', 0), (b'x', 0)])
+        writer.send([(b'a', 0.01), (b'b', 0.01)], batch=True)
+        # Let the first press be written; the rest wait behind its delay.
+        time.sleep(0.2)
+        assert writer.stop(5)
+    finally:
+        com.close()
+    assert 'Discarded 4 queued button presses.' in messages
+    assert writer.counts['sent'] == 1
+
+
+def test_stopping_an_idle_writer_logs_nothing():
+    messages = []
+    com = FakeSerial(timeout=0.05)
+    writer = SerialWriter(com, messages.append)
+    writer.start()
+    try:
+        writer.send([(b'a', 0)])
+        assert writer.wait(5)
+        assert writer.stop(5)
+    finally:
+        com.close()
+    assert not any(message.startswith('Discarded') for message in messages)
@@ -0,0 +1,92 @@
+import asyncio
+import types
+import pytest
+import stage_machine
+from stage_machine import Stage, StageMachine
+
+
+class Clock():
+    """Stands in for time.time, advanced by the stages."""
+    def __init__(self):
+        self.now = 1000
+
+    def time(self):
+        return self.now
+
+
+def make_stages(clock, route):
+    """Stages that follow a route, each visit taking 10 s longer than the
+    last.
+    """
+    async def action(inst):
+        clock.now += 10 * (inst.visits + 1)
+        inst.visits += 1
+        return route[inst.visits]
+    return (Stage('join', action, ('path',)),
+        Stage('path', action, ('detect', 'join')),
+        Stage('detect', action, ('done',)))
+
+
+def make_instance(stage='join'):
+    return types.SimpleNamespace(stage=stage, visits=0, stats_dirty=False)
+
+
+def test_declared_transitions_must_exist():
+    async def action(inst):
+        return 'done'
+    with pytest.raises(KeyError):
+        StageMachine((Stage('join', action, ('path',)),))
+
+
+def test_undeclared_transition_raises(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(stage_machine, 'time', clock)
+    machine = StageMachine(make_stages(clock, ('join', 'path', 'done')),
+        log=lambda string: None)
+    inst = make_instance()
+    with pytest.raises(ValueError):
+        asyncio.run(machine.run(inst))
+    assert inst.stage == 'path'
+    assert len(machine.transitions) == 1
+
+
+def test_durations_and_transitions_are_recorded(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(stage_machine, 'time', clock)
+    messages = []
+    machine = StageMachine(make_stages(clock, ('join', 'path', 'join', 'path',
+        'detect', 'done')), log=messages.append)
+    inst = make_instance()
+    asyncio.run(machine.run(inst))
+    assert inst.stage == 'done'
+    assert inst.stats_dirty
+    assert [(stage, next_stage) for _, stage, next_stage
+        in machine.transitions] == [('join', 'path'), ('path', 'join'),
+        ('join', 'path'), ('path', 'detect'), ('detect', 'done')]
+    assert list(machine.durations['join']) == [10, 30]
+    assert list(machine.durations['path']) == [20, 40]
+    assert list(machine.durations['detect']) == [50]
+    assert machine.summary()['path'] == {'count': 2, 'total_s': 60,
+        'mean_s': 30, 'p50_s': 30, 'p95_s': 39}
+    assert machine.histogram('detect')['<60'] == 1
+    # Run times are logged each time a run returns to the start or ends.
+    assert [message for message in messages if message.startswith('Run')] == [
+        'Run time by stage: join 10 s, path 20 s',
+        'Run time by stage: join 30 s, path 40 s, detect 50 s']
+
+
+def test_stats_are_marked_dirty_on_each_transition(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(stage_machine, 'time', clock)
+    dirty = []
+
+    async def action(inst):
+        dirty.append(inst.stats_dirty)
+        inst.stats_dirty = False
+        return 'path' if inst.stage == 'join' else 'done'
+    machine = StageMachine((Stage('join', action, ('path',)),
+        Stage('path', action, ('done',))), log=lambda string: None)
+    inst = make_instance()
+    asyncio.run(machine.run(inst))
+    assert dirty == [False, True]
+    assert inst.stats_dirty
@@ -0,0 +1,71 @@
+import types
+import numpy
+import pytest
+pytest.importorskip('enchant')
+pytest.importorskip('pytesseract')
+import MaxLairInstance
+
+RENDER_METHODS = ('render_stats_panel', 'render_display_frame',
+    'get_annotation_rects', 'record_ball_use', 'record_ore_reward')
+
+
+def make_instance():
+    inst = types.SimpleNamespace(stats_panel=None, stats_panel_time=0,
+        stats_dirty=True, display_buffer=None, annotation_rects={},
+        display_resolution=(64, 36), stage='catch', ball_rect=((0.5, 0.5),
+        (0.75, 0.75)), sel_rect_4=((0, 0), (0.25, 0.25)),
+        abil_rect_4=((0, 0), (0.25, 0.25)), base_ball='Poke Ball',
+        legendary_ball='Dusk Ball', base_balls=10, legendary_balls=10,
+        num_caught=0, lives=4, dynite_ore=0, consecutive_resets=0)
+    inst.stats_reads = 0
+
+    def get_stats():
+        inst.stats_reads += 1
+        return [('Pokemon caught: ', str(inst.num_caught))]
+    inst.get_stats = get_stats
+    for name in RENDER_METHODS:
+        setattr(inst, name, getattr(MaxLairInstance.MaxLairInstance,
+            name).__get__(inst))
+    return inst
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1000)
+    monkeypatch.setattr(MaxLairInstance, 'time',
+        types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_panel_is_redrawn_only_when_dirty_or_stale(clock):
+    inst = make_instance()
+    panel = inst.render_stats_panel(20)
+    assert panel.shape == (36, 20, 3)
+    assert inst.stats_reads == 1
+    assert not inst.stats_dirty
+    assert inst.render_stats_panel(20) is panel
+    assert inst.stats_reads == 1
+    # Recording a statistic marks the panel dirty; it is redrawn in place.
+    for record in (inst.record_ball_use, inst.record_ore_reward):
+        record()
+        assert inst.stats_dirty
+        assert inst.render_stats_panel(20) is panel
+    assert inst.stats_reads == 3
+    # The time per run is kept current.
+    clock.now += MaxLairInstance.STATS_REFRESH_INTERVAL + 0.1
+    inst.render_stats_panel(20)
+    assert inst.stats_reads == 4
+
+
+def test_display_frame_reuses_its_buffer(clock):
+    inst = make_instance()
+    img = numpy.full((72, 128, 3), 50, numpy.uint8)
+    img.setflags(write=False)
+    buffer = inst.render_display_frame(img, panel_width=20)
+    assert buffer.shape == (36, 84, 3)
+    assert inst.render_display_frame(img, panel_width=20) is buffer
+    assert numpy.array_equal(buffer[:, 64:], inst.stats_panel)
+    # The ball rectangle is drawn in red around its display pixels.
+    assert tuple(buffer[16, 40]) == (0, 0, 255)
+    assert tuple(buffer[30, 10]) == (50, 50, 50)
+    assert inst.stats_reads == 1
@@ -0,0 +1,25 @@
+import timing_profiles
+
+LOG = '\n'.join('2026-10-19 12:00:00\t' + line for line in (
+    timing_profiles.OBSERVATION_FORMAT % ('menu.move', 0.42, 1),
+    timing_profiles.OBSERVATION_FORMAT % ('menu.move', 0.58, 1),
+    timing_profiles.OBSERVATION_FORMAT % ('menu.move', 0, 1),
+    'Timing: join.save showed no change in 4.00 s',
+    'Timing: catch.summary condition met after 9.50 s of 29.00 s',
+    'Timing: select_pokemon.after_loss timed out after 10.00 s of 10.00 s',
+)) + '\n'
+
+
+def test_only_screen_changes_are_mined(tmp_path):
+    path = tmp_path / 'run_log.txt'
+    path.write_text(LOG, encoding='utf-8')
+    assert timing_profiles.read_observations([str(path)]) == {
+        'menu.move': [0.42, 0.58]}
+
+
+def test_proposals_never_lengthen_a_delay():
+    profile = timing_profiles.TimingProfile()
+    proposals = timing_profiles.propose_delays({'menu.move': [0.4] * 5,
+        'join.save': [9] * 5, 'path.choose': [1] * 4}, profile)
+    assert proposals == {'menu.move': (5, 1, 0.4, 0.7),
+        'join.save': (5, 4, 9, 4)}
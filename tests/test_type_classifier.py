@@ -0,0 +1,88 @@
+import os
+import cv2
+import numpy
+import pytest
+import image_processing
+from Benchmarks import benchmark_types
+from tests import corpus
+
+RECT = ((0.2, 0.2), (0.4, 0.3))
+
+
+def badge_frame(hue, saturation=200, value=200, seed=0):
+    """Draw a badge of one colour, with some noise and white lettering."""
+    random = numpy.random.default_rng(seed)
+    hsv = numpy.zeros((108, 192, 3), numpy.uint8)
+    hsv[..., 0] = hue
+    hsv[..., 1] = saturation
+    hsv[..., 2] = value
+    frame = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR).astype(numpy.int16)
+    frame += random.integers(-6, 7, frame.shape, numpy.int16)
+    frame = numpy.clip(frame, 0, 255).astype(numpy.uint8)
+    cv2.putText(frame, 'ABC', (45, 31), cv2.FONT_HERSHEY_PLAIN, 0.8,
+        (255, 255, 255), 1)
+    return frame
+
+
+def synthetic_samples(seeds):
+    hues = numpy.linspace(0, 170, len(image_processing.TYPE_NAMES)).astype(int)
+    return [(name, image_processing.type_badge_histogram(badge_frame(hue,
+        seed=seed), RECT)) for seed in seeds
+        for name, hue in zip(image_processing.TYPE_NAMES, hues)]
+
+
+def test_learned_references_classify_badges():
+    references = image_processing.build_type_references(
+        synthetic_samples(range(3)))
+    for name, histogram in synthetic_samples((10,)):
+        assert image_processing.classify_type_histogram(histogram,
+            references) == name
+
+
+def test_empty_badge_is_not_classified():
+    references = image_processing.build_type_references(
+        synthetic_samples((0,)))
+    dark = numpy.zeros((108, 192, 3), numpy.uint8)
+    assert image_processing.classify_type(dark, RECT, references) == ''
+
+
+def test_references_are_only_used_when_complete(tmp_path):
+    references = image_processing.build_type_references(
+        synthetic_samples((0,)))
+    path = str(tmp_path / 'types.json')
+    image_processing.save_type_references(path, references)
+    loaded = image_processing.load_type_references(path)
+    assert set(loaded) == set(image_processing.TYPE_NAMES)
+    for name in references:
+        assert numpy.allclose(loaded[name], references[name])
+
+    del references['Fairy']
+    image_processing.save_type_references(path, references)
+    assert image_processing.load_type_references(path) is None
+    assert image_processing.load_type_references(str(tmp_path / 'none')) is None
+
+
+def test_saved_references_classify_corpus_badges():
+    root = os.path.dirname(os.path.dirname(corpus.CORPUS_DIRECTORY))
+    references = image_processing.load_type_references(os.path.join(root,
+        benchmark_types.TYPE_REFERENCES_PATH))
+    if references is None:
+        pytest.skip('No type badge references have been learned (see README).')
+    samples = benchmark_types.load_samples(corpus.CORPUS_DIRECTORY)
+    if len(samples) == 0:
+        pytest.skip('The corpus in Benchmarks/Corpus has no labeled type badges.')
+    correct = sum(image_processing.classify_type_histogram(histogram,
+        references) == label for label, histogram in samples)
+    assert correct / len(samples) >= 0.95
+
+
+def test_corpus_accuracy_by_type():
+    samples = benchmark_types.load_samples(corpus.CORPUS_DIRECTORY)
+    if len(samples) == 0:
+        pytest.skip('The corpus in Benchmarks/Corpus has no labeled type badges.')
+    accuracy = benchmark_types.accuracy_by_type(
+        benchmark_types.cross_validate(samples))
+    for name, (count, correct) in sorted(accuracy.items()):
+        print('%-10s %d/%d' % (name or '(none)', correct, count))
+    total = sum(count for count, _ in accuracy.values())
+    assert sum(correct for _, correct in accuracy.values()) / total >= 0.95
@@ -0,0 +1,89 @@
+import threading
+import time
+import numpy
+from video_capture import FrameGrabber
+
+
+class GatedCapture():
+    """Video source that delivers a numbered frame each time it is allowed
+    to.
+    """
+    def __init__(self, shape=(9, 16, 3)):
+        self.shape = shape
+        self.allowed = threading.Semaphore(0)
+        self.count = 0
+
+    def read(self):
+        if not self.allowed.acquire(timeout=0.01):
+            return False, None
+        self.count += 1
+        return True, numpy.full(self.shape, self.count, numpy.uint8)
+
+    def deliver(self, grabber, frames=1):
+        """Let frames through and wait until the grabber has buffered them."""
+        timestamp = grabber.get_frame()[0] if grabber.frames else 0
+        for __ in range(frames):
+            self.allowed.release()
+            timestamp = grabber.get_frame(timestamp, timeout=1)[0]
+
+
+def start(grabber):
+    grabber.start()
+    return grabber
+
+
+def test_buffer_keeps_the_newest_frames_read_only():
+    capture = GatedCapture()
+    grabber = start(FrameGrabber(capture, buffer_size=3, resolution=(8, 4)))
+    try:
+        capture.deliver(grabber, 5)
+        assert [frame[0, 0, 0] for _, frame in grabber.frames] == [3, 4, 5]
+        timestamps = [timestamp for timestamp, _ in grabber.frames]
+        assert timestamps == sorted(timestamps)
+        timestamp, frame = grabber.get_frame()
+        assert frame[0, 0, 0] == 5
+        assert frame.shape == (4, 8, 3)
+        assert not frame.flags.writeable
+        with grabber.acquire_frame() as held:
+            assert held.frame is frame
+    finally:
+        assert grabber.stop(1)
+
+
+def test_newer_than_waits_for_the_next_frame():
+    capture = GatedCapture()
+    grabber = start(FrameGrabber(capture))
+    try:
+        capture.deliver(grabber)
+        timestamp, first = grabber.get_frame()
+        threading.Timer(0.1, capture.allowed.release).start()
+        start_time = time.time()
+        newer, frame = grabber.get_frame(timestamp)
+        assert 0.05 <= time.time() - start_time < 1
+        assert newer > timestamp
+        assert frame[0, 0, 0] == 2
+    finally:
+        assert grabber.stop(1)
+
+
+def test_newer_than_times_out_with_the_newest_frame():
+    capture = GatedCapture()
+    grabber = start(FrameGrabber(capture))
+    try:
+        capture.deliver(grabber)
+        timestamp, frame = grabber.get_frame()
+        start_time = time.time()
+        assert grabber.get_frame(timestamp, timeout=0.2) == (timestamp, frame)
+        assert time.time() - start_time >= 0.2
+    finally:
+        assert grabber.stop(1)
+
+
+def test_stopping_ends_a_wait_for_a_newer_frame():
+    grabber = start(FrameGrabber(GatedCapture()))
+    threading.Timer(0.1, grabber.stop).start()
+    start_time = time.time()
+    # Nothing was captured, and the default 5 s wait ends when stopped.
+    assert grabber.get_frame(time.time()) == (0, None)
+    assert time.time() - start_time < 1
+    assert not grabber.running
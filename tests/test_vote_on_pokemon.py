@@ -0,0 +1,75 @@
+import asyncio
+import types
+import pytest
+pytest.importorskip('enchant')
+pytest.importorskip('pytesseract')
+
+
+class FakeVoteInstance():
+    """Just enough of MaxLairInstance for vote_on_pokemon: reads that take
+    read_time seconds and return the text they were given.
+    """
+    def __init__(self, read_time, timeout=0.1):
+        from MaxLairInstance import MaxLairInstance
+        self.vote_on_pokemon = MaxLairInstance.vote_on_pokemon.__get__(self)
+        self.identification_vote_frames = 2
+        self.identification_vote_timeout = timeout
+        self.read_time = read_time
+        self.started = []
+        self.rental_pokemon = {'Tsareena': types.SimpleNamespace(
+            name='Tsareena'), 'Blaziken': types.SimpleNamespace(name='Blaziken')}
+
+    async def get_new_frame(self):
+        return 'Blaziken'
+
+    async def read_types(self, image, rects, language):
+        return ''
+
+    def prepare_pokemon_read(self, image, read, alternative):
+        return image, '--psm 8'
+
+    def finish_pokemon_read(self, text, read):
+        return text
+
+    async def run_tesseract(self, img, language=None, config=''):
+        future = asyncio.ensure_future(asyncio.sleep(self.read_time, img))
+        self.started.append(future)
+        return await future
+
+    def match_pokemon(self, name, language, ability, types):
+        return self.rental_pokemon[name], 0, 5, name, ''
+
+    def log(self, string):
+        pass
+
+
+def test_reads_that_finish_in_time_vote():
+    inst = FakeVoteInstance(read_time=0)
+    pokemon = asyncio.run(inst.vote_on_pokemon(('name', None, ()), 'English',
+        ('Tsareena', '', '')))
+    assert pokemon.name == 'Blaziken'
+
+
+def test_slow_reads_are_cancelled_and_ignored():
+    inst = FakeVoteInstance(read_time=10)
+    pokemon = asyncio.run(inst.vote_on_pokemon(('name', None, ()), 'English',
+        ('Tsareena', '', '')))
+    assert pokemon.name == 'Tsareena'
+    assert len(inst.started) == 4
+    assert all(future.cancelled() for future in inst.started)
+
+
+def test_cancelling_the_vote_cancels_pending_reads():
+    inst = FakeVoteInstance(read_time=10, timeout=10)
+
+    async def cancel_vote():
+        task = asyncio.ensure_future(inst.vote_on_pokemon(('name', None, ()),
+            'English', ('Tsareena', '', '')))
+        while len(inst.started) < 4:
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_vote())
+    assert all(future.cancelled() for future in inst.started)
@@ -0,0 +1,84 @@
+import types
+import cv2
+import numpy
+import pytest
+pytest.importorskip('enchant')
+pytest.importorskip('pytesseract')
+from MaxLairInstance import MaxLairInstance
+from tests import corpus
+
+SEL_RECT_4 = ((0.485, 0.59), (0.60, 0.645))
+ABIL_RECT_4 = ((0.485, 0.645), (0.60, 0.69))
+CARD = ((0.47, 0.55), (0.75, 0.80))
+
+
+def make_instance(frame=None):
+    inst = types.SimpleNamespace(roi_buffers={}, sel_rect_4=SEL_RECT_4,
+        abil_rect_4=ABIL_RECT_4, get_frame=lambda newer_than=0: frame,
+        frame_grabber=types.SimpleNamespace(running=False))
+    inst.get_thumbnail = MaxLairInstance.get_thumbnail.__get__(inst)
+    inst.card_text_shown = MaxLairInstance.card_text_shown.__get__(inst)
+    inst.screen_settled = MaxLairInstance.screen_settled.__get__(inst)
+    return inst
+
+
+def pixels(rect, shape=(1080, 1920)):
+    (left, top), (right, bottom) = rect
+    return (round(left*shape[1]), round(top*shape[0])), (round(right*shape[1]),
+        round(bottom*shape[0]))
+
+
+def battle_frame():
+    """A dark screen with white text in the summary rectangles."""
+    img = numpy.full((1080, 1920, 3), 40, numpy.uint8)
+    for rect, text in ((SEL_RECT_4, 'Tsareena'), (ABIL_RECT_4, 'Queenly')):
+        (left, top), (_, bottom) = pixels(rect)
+        cv2.putText(img, text, (left + 10, bottom - 12),
+            cv2.FONT_HERSHEY_SIMPLEX, 1.4, (255, 255, 255), 3)
+    return img
+
+
+def card_frame(text=True):
+    """The light summary card of a caught Pokemon, with or without its dark
+    text.
+    """
+    img = battle_frame()
+    top_left, bottom_right = pixels(CARD)
+    cv2.rectangle(img, top_left, bottom_right, (235, 240, 240), -1)
+    if text:
+        for rect, text in ((SEL_RECT_4, 'Tsareena'), (ABIL_RECT_4, 'Queenly')):
+            (left, top), (_, bottom) = pixels(rect)
+            cv2.putText(img, text, (left + 10, bottom - 12),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.4, (50, 50, 50), 3)
+    return img
+
+
+def test_card_text_shown_only_on_the_summary_card():
+    inst = make_instance()
+    shown = inst.card_text_shown(SEL_RECT_4, ABIL_RECT_4)
+    assert shown(card_frame())
+    assert not shown(card_frame(text=False))
+    assert not shown(numpy.full((1080, 1920, 3), 255, numpy.uint8))
+    assert not shown(battle_frame())
+    assert not shown(numpy.zeros((1080, 1920, 3), numpy.uint8))
+
+
+def test_card_text_shown_on_corpus_frames():
+    entries = corpus.load_entries()
+    if not entries:
+        pytest.skip('The corpus in Benchmarks/Corpus is empty.')
+    inst = make_instance()
+    shown = inst.card_text_shown(SEL_RECT_4, ABIL_RECT_4)
+    for entry in entries:
+        assert shown(entry['image']) == (entry['screen'] == 'catch'), entry['frame']
+
+
+def test_screen_settled_needs_the_frame_from_before_the_transition():
+    battle = battle_frame()
+    result = card_frame()
+    before = make_instance(battle).screen_settled()
+    after = make_instance(result).screen_settled()
+    # Polled once the transition is over, only the condition created before
+    # it started sees that the screen changed.
+    assert [before(result) for __ in range(3)] == [False, True, True]
+    assert [after(result) for __ in range(3)] == [False, False, False]
@@ -0,0 +1,218 @@
+# Timing Profiles
+#   Named delays used after button presses, with profiles that override them
+#   stored in a JSON file. Runs made with OBSERVE = True log how long the
+#   screen took to settle after each named delay started; this module mines
+#   those logs and proposes tightened values for a profile:
+#       python timing_profiles.py Logs/*_log.txt [--profile fast]
+#           [--percentile 95] [--margin 0.3] [--write]
+
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import numpy
+from typing import Dict, Iterable, List, Tuple
+
+# Delays (s) that the profiles override, named after the stage they are used in
+DEFAULT_DELAYS = {
+    'menu.move': 1,
+    'join.leave': 2,
+    'join.talk': 1,
+    'join.dialogue': 1.5,
+    'join.open_paths': 1,
+    'join.confirm_path': 1.5,
+    'join.lock_in': 1,
+    'join.confirm_save': 1.5,
+    'join.save': 4,
+    'join.load_rentals': 5,
+    'join.select_rental': 1,
+    'join.choose_rental': 26,
+    'path.choose': 4,
+    'battle.faint': 4,
+    'battle.loss': 7,
+    'battle.cheer': 1.5,
+    'battle.open_info': 1,
+    'battle.select_info': 1,
+    'battle.show_opponent': 3,
+    'battle.read_info': 1,
+    'battle.close_info': 1.5,
+    'battle.close_info_menu': 2,
+    'battle.back': 2,
+    'battle.fight': 2,
+    'battle.dynamax': 1,
+    'battle.select_move': 1,
+    'battle.clear_menu': 0.5,
+    'battle.skip_dialogue': 0.005,
+    'catch.open_balls': 2,
+    'catch.next_ball_fast': 0.5,
+    'catch.next_ball': 2,
+    'catch.throw': 1,
+    'catch.summary': 29,
+    'catch.throw_final': 30,
+    'catch.swap': 3,
+    'catch.keep': 3,
+    'catch.finish_run': 10,
+    'backpacker.wait': 7,
+    'backpacker.take_item': 5,
+    'scientist.wait': 3,
+    'scientist.answer': 1,
+    'select_pokemon.after_loss': 10,
+    'select_pokemon.dismiss': 1,
+    'select_pokemon.open': 1,
+    'select_pokemon.summary': 3,
+    'select_pokemon.capture': 1,
+    'select_pokemon.close_summary': 3,
+    'select_pokemon.next': 3,
+    'select_pokemon.take': 1,
+    'select_pokemon.take_confirm': 1.5,
+    'select_pokemon.take_save': 3,
+    'select_pokemon.take_dialogue': 2,
+    'select_pokemon.take_finish': 9,
+    'select_pokemon.take_close': 2,
+    'select_pokemon.leave': 3,
+    'select_pokemon.leave_confirm': 1,
+    'select_pokemon.home': 2,
+    'select_pokemon.close_game': 2,
+    'select_pokemon.advance': 1.5,
+    'select_pokemon.back_out': 1.5,
+}
+# Mean difference between thumbnails (see image_processing.get_thumbnail)
+# above which the screen is considered to have changed while observing
+CHANGE_THRESHOLD = 2
+# Shortest delay proposed, which leaves time for the press itself
+MIN_DELAY = 0.2
+# Line logged for each delay observed while the screen changed (see
+# MaxLairInstance.observe_delay), and the pattern that reads it back
+OBSERVATION_FORMAT = 'Timing: %s settled after %.2f s of %.2f s'
+OBSERVATION_PATTERN = re.compile(re.escape(OBSERVATION_FORMAT).replace('%s',
+    r'(\S+)').replace(re.escape('%.2f'), r'([0-9.]+)'))
+
+
+class TimingProfile():
+    """A set of named delays: the defaults with a profile's overrides."""
+    def __init__(self,
+                 name: str='default',
+                 overrides: Dict[str, float]=None) -> None:
+        self.name = name
+        self.overrides = {} if overrides is None else dict(overrides)
+        unknown = set(self.overrides) - set(DEFAULT_DELAYS)
+        if unknown:
+            raise KeyError('Unknown delays in timing profile ' + name + ': '
+                + ', '.join(sorted(unknown)))
+        self.delays = dict(DEFAULT_DELAYS, **self.overrides)
+
+    def __getitem__(self, name: str) -> float:
+        return self.delays[name]
+
+    def __str__(self):
+        return self.name + ' (' + str(len(self.overrides)) + ' delays changed)'
+
+    def seconds(self, delay) -> float:
+        """Return a delay given in seconds or as the name of a delay."""
+        return self.delays[delay] if isinstance(delay, str) else delay
+
+    def resolve(self,
+                commands: Iterable[Tuple[bytes, object]]) -> List[Tuple[bytes, float]]:
+        """Replace delay names in (character, delay) commands with seconds."""
+        return [(character, self.seconds(delay)) for character, delay in commands]
+
+
+def load_profile(path: str,
+                 name: str) -> TimingProfile:
+    """Return a timing profile from a profiles file, or the defaults if the
+    file or profile doesn't exist.
+    """
+    if not os.path.exists(path):
+        return TimingProfile(name)
+    with open(path, encoding='utf-8') as file:
+        profiles = json.load(file)
+    return TimingProfile(name, profiles.get(name))
+
+
+def save_profile(path: str,
+                 profile: TimingProfile) -> None:
+    """Store a profile's overrides in a profiles file."""
+    profiles = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as file:
+            profiles = json.load(file)
+    profiles[profile.name] = profile.overrides
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(profiles, file, indent=2, sort_keys=True)
+
+
+def read_observations(paths: Iterable[str]) -> Dict[str, List[float]]:
+    """Collect the observed settling times (s) of each named delay from log
+    files. Zero times, which say nothing about how long the delay needs, are
+    skipped.
+    """
+    observations = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                match = OBSERVATION_PATTERN.search(line)
+                if match is not None and float(match.group(2)) > 0:
+                    observations.setdefault(match.group(1), []).append(
+                        float(match.group(2)))
+    return observations
+
+
+def propose_delays(observations: Dict[str, List[float]],
+                   profile: TimingProfile,
+                   percentile: float=95,
+                   margin: float=0.3,
+                   min_samples: int=5) -> Dict[str, Tuple[int, float, float, float]]:
+    """Propose a delay for each name with enough observations: the given
+    percentile of the settling times plus a safety margin, rounded up to
+    0.1 s and never longer than the current delay.
+
+    Returns {name: (samples, current, percentile, proposed)}.
+    """
+    proposals = {}
+    for name, times in sorted(observations.items()):
+        if name not in DEFAULT_DELAYS or len(times) < min_samples:
+            continue
+        observed = float(numpy.percentile(times, percentile))
+        proposed = math.ceil(10 * (observed + margin)) / 10
+        proposed = min(profile[name], max(MIN_DELAY, proposed))
+        proposals[name] = (len(times), profile[name], observed, proposed)
+    return proposals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Propose tightened delays '
+        'for a timing profile from logs of runs made with OBSERVE = True.')
+    parser.add_argument('logs', nargs='+', help='Log files (wildcards allowed).')
+    parser.add_argument('--profile', default='default')
+    parser.add_argument('--file', default='Timing/profiles.json')
+    parser.add_argument('--percentile', type=float, default=95)
+    parser.add_argument('--margin', type=float, default=0.3,
+        help='Time (s) added to the observed percentile.')
+    parser.add_argument('--min-samples', type=int, default=5)
+    parser.add_argument('--write', action='store_true',
+        help='Store the proposed delays in the profile.')
+    args = parser.parse_args()
+
+    paths = [path for pattern in args.logs for path in glob.glob(pattern)]
+    profile = load_profile(args.file, args.profile)
+    proposals = propose_delays(read_observations(paths), profile,
+        args.percentile, args.margin, args.min_samples
+    )
+    print('%-32s %8s %8s %8s %8s' % ('Delay', 'Samples', 'Current',
+        'p%g' % args.percentile, 'Proposed'))
+    saved = 0
+    for name, (samples, current, observed, proposed) in proposals.items():
+        print('%-32s %8d %8.2f %8.2f %8.2f' % (name, samples, current, observed,
+            proposed))
+        saved += current - proposed
+    print('%.1f s saved if each delay is used once.' % saved)
+    if args.write:
+        profile = TimingProfile(args.profile, dict(profile.overrides,
+            **{name: proposal[3] for name, proposal in proposals.items()}))
+        save_profile(args.file, profile)
+        print('Saved timing profile ' + str(profile) + ' to ' + args.file)
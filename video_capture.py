@@ -0,0 +1,300 @@
+# Video Capture
+#   Sources of video (live capture devices and recordings) and a background
+#   thread that continuously reads them so the rest of the bot can always get
+#   the newest frame without waiting.
+
+import collections
+import os
+import threading
+import time
+import cv2
+from typing import TypeVar, Callable, Tuple
+VideoCapture = TypeVar('cv2.VideoCapture')
+Image = TypeVar('cv2 image')
+
+
+def fit_frame(frame: Image,
+              resolution: Tuple[int, int]=None) -> Image:
+    """Resize a frame to a (width, height) resolution if it isn't already
+    that size, e.g. when a capture device ignores the requested resolution.
+    """
+    if resolution is None or frame.shape[1::-1] == tuple(resolution):
+        return frame
+    return cv2.resize(frame, tuple(resolution), interpolation=cv2.INTER_AREA)
+
+
+class HeldFrame():
+    """A (timestamp, frame) pair from a frame grabber, held until released.
+
+    The frame may be read in place, without copying, until release() is
+    called, after which it must not be used. Use it as a context manager to
+    release it at the end of the block. frame is None if no frame has been
+    captured.
+    """
+    def __init__(self,
+                 timestamp: float,
+                 frame: Image,
+                 on_release: Callable[[], None]=None) -> None:
+        self.timestamp = timestamp
+        self.frame = frame
+        self.on_release = on_release
+
+    def release(self) -> None:
+        """Let the frame grabber reuse the frame's memory."""
+        self.frame = None
+        if self.on_release is not None:
+            self.on_release()
+            self.on_release = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class FrameGrabber():
+    """Drain a capture device into a small ring buffer of timestamped frames.
+
+    Frames in the buffer are shared between every consumer, so they are
+    marked read-only. If a resolution is given, frames are resized to it on
+    the background thread.
+    """
+    def __init__(self,
+                 cap: VideoCapture,
+                 buffer_size: int=4,
+                 resolution: Tuple[int, int]=None) -> None:
+        self.cap = cap
+        self.resolution = resolution
+        self.frames = collections.deque(maxlen=buffer_size)
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self) -> None:
+        """Start reading frames on a background thread."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='FrameGrabber',
+            daemon=True
+        )
+        self.thread.start()
+
+    def stop(self,
+             timeout: float=None) -> bool:
+        """Stop reading frames and wait up to timeout seconds for the thread to
+        finish. Return whether it finished.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                return False
+            self.thread = None
+        return True
+
+    def run(self) -> None:
+        """Read frames until stopped. Called by the background thread."""
+        while self.running:
+            success, frame = self.cap.read()
+            if not success:
+                # Avoid spinning if the device stops delivering frames.
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.running, 0.01)
+                continue
+            frame = fit_frame(frame, self.resolution)
+            # Frames are shared between consumers so nobody may modify them.
+            frame.setflags(write=False)
+            with self.condition:
+                self.frames.append((time.time(), frame))
+                self.condition.notify_all()
+
+    def get_frame(self,
+                  newer_than: float=0,
+                  timeout: float=5) -> Tuple[float, Image]:
+        """Return the newest (timestamp, frame) pair.
+
+        If newer_than is given, wait up to timeout seconds for a frame
+        captured after that time. If none arrives, the newest frame is
+        returned anyway, or (0, None) if no frame has been captured at all.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: not self.running or (
+                len(self.frames) > 0 and self.frames[-1][0] > newer_than),
+                timeout
+            )
+            if len(self.frames) == 0:
+                return 0, None
+            return self.frames[-1]
+
+    def acquire_frame(self,
+                      newer_than: float=0,
+                      timeout: float=5) -> HeldFrame:
+        """Return the newest frame as a HeldFrame (see get_frame). Frames in
+        the buffer are never overwritten, so releasing it does nothing.
+        """
+        return HeldFrame(*self.get_frame(newer_than, timeout))
+
+
+class VideoSource():
+    """A source of frames with the same interface as cv2.VideoCapture, so it
+    can be used anywhere the bot reads video.
+
+    paced: whether read() delivers frames no faster than real time, in which
+        case frames can be drained on a background thread.
+    finished: set when a recording has no more frames to deliver.
+    """
+    paced = True
+
+    def __init__(self) -> None:
+        self.finished = False
+
+    def read(self) -> Tuple[bool, Image]:
+        raise NotImplementedError
+
+    def set(self, prop_id: int, value: float) -> bool:
+        return False
+
+    def isOpened(self) -> bool:
+        return True
+
+    def release(self) -> None:
+        pass
+
+
+class DeviceSource(VideoSource):
+    """Live frames from a capture device."""
+    def __init__(self,
+                 index: int) -> None:
+        super().__init__()
+        self.cap = cv2.VideoCapture(index)
+
+    def read(self) -> Tuple[bool, Image]:
+        return self.cap.read()
+
+    def set(self, prop_id: int, value: float) -> bool:
+        return self.cap.set(prop_id, value)
+
+    def isOpened(self) -> bool:
+        return self.cap.isOpened()
+
+    def release(self) -> None:
+        self.cap.release()
+
+
+class ReplaySource(VideoSource):
+    """Frames replayed from a recording, either at the recording's frame rate
+    or as fast as they are requested.
+
+    When the recording ends it either starts again from the beginning or
+    keeps returning its last frame and sets finished.
+    """
+    def __init__(self,
+                 fps: float,
+                 real_time: bool=True,
+                 loop: bool=False) -> None:
+        super().__init__()
+        self.fps = fps
+        self.paced = real_time
+        self.loop = loop
+        self.start_time = None
+        self.frames_read = 0
+        self.last_frame = None
+
+    def read_next(self) -> Tuple[bool, Image]:
+        """Return the next frame of the recording."""
+        raise NotImplementedError
+
+    def rewind(self) -> None:
+        """Return to the start of the recording."""
+        raise NotImplementedError
+
+    def read(self) -> Tuple[bool, Image]:
+        if self.paced:
+            # Wait until this frame is due.
+            if self.start_time is None:
+                self.start_time = time.time()
+            delay = self.start_time + self.frames_read / self.fps - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        success, frame = self.read_next()
+        if not success and self.loop:
+            self.rewind()
+            success, frame = self.read_next()
+        if not success:
+            self.finished = True
+            if self.last_frame is None:
+                return False, None
+            frame = self.last_frame.copy()
+        self.frames_read += 1
+        self.last_frame = frame
+        return True, frame
+
+
+class FileSource(ReplaySource):
+    """Frames replayed from a video file."""
+    def __init__(self,
+                 path: str,
+                 real_time: bool=True,
+                 loop: bool=False) -> None:
+        self.cap = cv2.VideoCapture(path)
+        super().__init__(self.cap.get(cv2.CAP_PROP_FPS) or 30, real_time, loop)
+
+    def read_next(self) -> Tuple[bool, Image]:
+        return self.cap.read()
+
+    def rewind(self) -> None:
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def isOpened(self) -> bool:
+        return self.cap.isOpened()
+
+    def release(self) -> None:
+        self.cap.release()
+
+
+class ImageSequenceSource(ReplaySource):
+    """Frames replayed from a directory of PNG images, in filename order."""
+    def __init__(self,
+                 directory: str,
+                 fps: float=30,
+                 real_time: bool=True,
+                 loop: bool=False) -> None:
+        super().__init__(fps, real_time, loop)
+        self.paths = sorted(os.path.join(directory, name) for name in
+            os.listdir(directory) if name.lower().endswith('.png'))
+        self.index = 0
+
+    def read_next(self) -> Tuple[bool, Image]:
+        while self.index < len(self.paths):
+            frame = cv2.imread(self.paths[self.index])
+            self.index += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def rewind(self) -> None:
+        self.index = 0
+
+    def isOpened(self) -> bool:
+        return len(self.paths) > 0
+
+
+def open_video_source(source: str,
+                      real_time: bool=True,
+                      loop: bool=False,
+                      fps: float=30) -> VideoSource:
+    """Open a capture device index, a video file, or a directory of PNG
+    frames.
+
+    real_time, loop, and fps only apply to recordings (fps only to
+    directories of frames).
+    """
+    if source.isdigit():
+        return DeviceSource(int(source))
+    if os.path.isdir(source):
+        return ImageSequenceSource(source, fps, real_time, loop)
+    return FileSource(source, real_time, loop)